@@ -0,0 +1,143 @@
+"""Window-level scoring against the per-frame model: rows scored, time and detection parity.
+
+Usage: python benchmarks/bench_aggregate.py [--log dataSet/raw/dos/dosattack.log] [--window 1.0]
+                                            [--train-captures 3] [--seconds 300] [--test-seconds 200]
+                                            [--test-attacks dos=0.05,fuzzing=0.05,suspension=0.05]
+                                            [--max-rounds 200]
+
+Both models are trained on the same synthetic labeled captures (see
+traffic.py), all normalized by the merged statistics of their normal
+frames, which both training functions save as ``normal_stats.npz``:
+- the per-frame model with ``canbus.training.train_out_of_core``;
+- the window model with ``canbus.aggregate.train_window_model``.
+
+Then a test capture is scored both ways: a synthetic capture with
+``--test-attacks``, the training mix of DoS, fuzzing and suspension by
+default, or an unlabeled ``--log`` such as ``dosattack.log``. The script
+reports:
+- the rows each model scores and the time it takes, window summaries included;
+- how often a frame's window verdict agrees with its per-frame verdict;
+- the frames each model flags per class, with recall and precision
+  against the labels when the capture is synthetic.
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'notebooks'))
+from bench_pipeline import parse_attacks  # noqa: E402
+from canbus import FEATURE_COLUMNS, compute_features, normalize_features, parse_can_log  # noqa: E402
+from canbus.aggregate import score_windows, train_window_model, window_features  # noqa: E402
+from canbus.baseline import TrafficStats, merge_stats  # noqa: E402
+from canbus.metrics import QUIET, Metrics  # noqa: E402
+from canbus.normal_stats import NormalStats, normal_stats_path  # noqa: E402
+from canbus.store import FeatureStore  # noqa: E402
+from canbus.training import LABEL_NAMES, _scores, store_chunks, train_out_of_core  # noqa: E402
+from traffic import DEFAULT_ATTACKS, synthetic_traffic  # noqa: E402
+
+def labeled_table(frames, labels):
+    """The labeled feature table data_processing.ipynb builds, not yet normalized."""
+    df = frames.to_dataframe(compact=True)
+    df['Label'] = labels
+    return compute_features(df)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--log', help='unlabeled capture to score instead of a synthetic one')
+    parser.add_argument('--window', type=float, default=1.0)
+    parser.add_argument('--train-captures', type=int, default=3)
+    parser.add_argument('--seconds', type=float, default=300.0, help='length of each training capture')
+    parser.add_argument('--test-seconds', type=float, default=200.0)
+    parser.add_argument('--test-attacks', default=','.join(f'{name}={share}' for name, share in DEFAULT_ATTACKS.items()))
+    parser.add_argument('--can-ids', type=int, default=40)
+    parser.add_argument('--max-rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        store = FeatureStore(directory)
+        tables = [labeled_table(*synthetic_traffic(args.can_ids, args.seconds, DEFAULT_ATTACKS, seed))
+                  for seed in range(args.train_captures)]
+        # One NormalStats for every capture and both models, as the saved normal_stats.npz.
+        normal = merge_stats(TrafficStats.from_features(df, label=0) for df in tables).normal_stats()
+        for seed, df in enumerate(tables):
+            normalize_features(df, normal)
+            store.save(f'train-{seed}', df)
+        print(f"Training on {sum(map(len, tables)):,} frames in {len(tables)} synthetic captures")
+        frame_model_path = Path(directory) / 'xgboost_model.json'
+        frame_model, _ = train_out_of_core(store_chunks(store, [f'train-{seed}' for seed in range(len(tables))]),
+                                           frame_model_path, max_rounds=args.max_rounds, metrics=Metrics(QUIET))
+        window_model_path = Path(directory) / 'window_model.json'
+        window_model, report = train_window_model(tables, window_model_path, args.window,
+                                                  max_rounds=args.max_rounds, metrics=Metrics(QUIET))
+        for path in (frame_model_path, window_model_path):
+            saved = NormalStats.load(normal_stats_path(path))
+            assert (saved.can_ids == normal.can_ids).all()
+            assert np.allclose(saved.mean_inter_arrival, normal.mean_inter_arrival, rtol=1e-12)
+            assert np.allclose(saved.mean_window_count, normal.mean_window_count, rtol=1e-12)
+        print(f"Window model: {report['windows']:,} training windows (per label {report['window_labels']}), "
+              f"test F1 per frame "
+              + ", ".join(f"{name} {scores['f1']:.3f}" for name, scores in report['test_frames']['classes'].items()))
+        del tables
+
+        if args.log:
+            parsed = parse_can_log(args.log)
+            df, labels = compute_features(parsed.frames.to_dataframe(compact=True)), None
+            print(f"Scoring {args.log}: {len(df):,} frames")
+        else:
+            frames, labels = synthetic_traffic(args.can_ids, args.test_seconds, parse_attacks(args.test_attacks),
+                                               args.train_captures)
+            df = compute_features(frames.to_dataframe(compact=True))
+            print(f"Scoring a synthetic capture with {args.test_attacks}: {len(df):,} frames")
+        df = normalize_features(df, normal)
+
+        features = df[FEATURE_COLUMNS].to_numpy(dtype=np.float32)
+        frame_verdicts, frame_time = timed(lambda: frame_model.inplace_predict(features).argmax(axis=1))
+        (summaries, frame_windows), summarize_time = timed(window_features, df, args.window)
+        window_verdicts, score_time = timed(score_windows, window_model, summaries)
+        expanded, expand_time = timed(lambda: window_verdicts[frame_windows])
+        window_time = summarize_time + score_time + expand_time
+        print(f"Per-frame model: {len(df):>10,} rows scored in {frame_time:.3f} s")
+        print(f"Window model:    {len(summaries):>10,} rows scored in {window_time:.3f} s "
+              f"(summaries {summarize_time:.3f} s, scoring {score_time:.3f} s, expansion {expand_time:.3f} s); "
+              f"{len(df) / max(len(summaries), 1):.1f}x fewer rows")
+        print(f"Frames whose window verdict matches the per-frame verdict: {np.mean(expanded == frame_verdicts):.4f}")
+
+        flagged_frame = np.bincount(frame_verdicts, minlength=len(LABEL_NAMES))
+        flagged_window = np.bincount(expanded, minlength=len(LABEL_NAMES))
+        agree = np.bincount(frame_verdicts[expanded == frame_verdicts], minlength=len(LABEL_NAMES))
+        if labels is not None:
+            truth = labels.astype(np.int64)
+            size = len(LABEL_NAMES)
+            frame_scores, window_scores = (
+                _scores(np.bincount(truth * size + verdicts, minlength=size * size).reshape(size, size))['classes']
+                for verdicts in (frame_verdicts, expanded))
+        print(f"{'class':<11}{'per-frame':>11}{'window':>11}{'both':>11}" + (
+            f"{'recall':>17}{'precision':>19}" if labels is not None else ''))
+        for label, name in enumerate(LABEL_NAMES):
+            line = f"{name:<11}{flagged_frame[label]:>11,}{flagged_window[label]:>11,}{agree[label]:>11,}"
+            if labels is not None:
+                line += (f"{frame_scores[name]['recall']:>8.4f} / {window_scores[name]['recall']:.4f}"
+                         f"{frame_scores[name]['precision']:>10.4f} / {window_scores[name]['precision']:.4f}")
+            print(line)
+        if labels is not None:
+            print("(recall and precision: per-frame / window)")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Merged per-log traffic statistics against a pandas pass over every frame.
+
+Usage: python benchmarks/bench_baseline.py [--logs 6] [--frames 500000] [--can-ids 40] [--workers N]
+
+``--logs`` synthetic normal captures (see traffic.py, one seed each) are
+written to candump logs. ``canbus.baseline.traffic_stats_for_logs`` builds
+the statistics of each log in its own process and ``merge_stats`` merges
+them; the result is compared with pandas over the concatenated feature
+tables:
+- counts, means (the ``NormalStats`` used for normalization), standard
+  deviations (overall and per CAN ID), minima and maxima must match;
+- the quartiles read from the sketches must be within
+  ``RELATIVE_ACCURACY`` of ``describe()``.
+
+It then times adding one more capture both ways: statistics of the new
+log merged into the saved ones, against recomputing ``groupby().mean()``
+and ``describe()`` over every frame again.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'notebooks'))
+from canbus import compute_features, parse_can_log  # noqa: E402
+from canbus.baseline import (  # noqa: E402
+    DESCRIBE_PERCENTILES,
+    RELATIVE_ACCURACY,
+    STATS_FEATURES,
+    TrafficStats,
+    merge_stats,
+    traffic_stats_for_logs,
+)
+from traffic import seconds_for, synthetic_traffic, write_candump  # noqa: E402
+
+
+def pandas_baseline(tables):
+    """What the notebooks did: one pass over every frame of every log."""
+    df = pd.concat(tables, ignore_index=True)
+    means = df.groupby('CAN_ID')[['CAN_ID_Inter_Arrival', 'CAN_ID_Window_Count']].mean()
+    return means, df[list(STATS_FEATURES)].astype(np.float64).describe()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logs', type=int, default=6)
+    parser.add_argument('--frames', type=int, default=500000, help='frames per log')
+    parser.add_argument('--can-ids', type=int, default=40)
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        paths = []
+        for seed in range(args.logs):
+            frames, _ = synthetic_traffic(args.can_ids, seconds_for(args.frames, args.can_ids, seed), {}, seed=seed)
+            paths.append(os.path.join(directory, f'normal-{seed}.log'))
+            write_candump(paths[-1], frames)
+        tables = [compute_features(parse_can_log(path).frames.to_dataframe(compact=True)) for path in paths]
+        print(f"{sum(map(len, tables)):,} frames in {args.logs} logs")
+
+        start = time.perf_counter()
+        per_log = traffic_stats_for_logs(paths, args.workers)
+        build = time.perf_counter() - start
+        stats = merge_stats(per_log[path] for path in paths)
+        reversed_stats = merge_stats(per_log[path] for path in reversed(paths))
+        assert all((ours == theirs).all() for ours, theirs in zip(stats.sketches, reversed_stats.sketches))
+        assert np.allclose(stats.sums, reversed_stats.sums, rtol=1e-12)
+        assert np.allclose(stats.m2, reversed_stats.m2, rtol=1e-9)
+        print(f"Per-log statistics in parallel, with parsing and features: {build:.2f} s")
+
+        means, described = pandas_baseline(tables)
+        normal = stats.normal_stats()
+        assert (normal.can_ids == means.index.to_numpy()).all()
+        assert np.allclose(normal.mean_inter_arrival, means['CAN_ID_Inter_Arrival'], rtol=1e-6)
+        assert np.allclose(normal.mean_window_count, means['CAN_ID_Window_Count'], rtol=1e-6)
+        stds = pd.concat(tables, ignore_index=True).groupby('CAN_ID')[list(STATS_FEATURES)].std()
+        frame = stats.to_frame()
+        for name in STATS_FEATURES:
+            assert np.allclose(frame[f'Std_{name}'], stds[name], rtol=1e-6, atol=1e-12, equal_nan=True)
+        ours = stats.describe()
+        exact = ['count', 'mean', 'std', 'min', 'max']
+        assert np.allclose(ours.loc[exact], described.loc[exact], rtol=1e-6, atol=1e-12)
+        quartiles = [f'{percentile:.0%}' for percentile in DESCRIBE_PERCENTILES]
+        errors = ((ours.loc[quartiles] - described.loc[quartiles]).abs() / described.loc[quartiles].abs()).max()
+        print("Quartile relative error per feature: "
+              + ", ".join(f"{name} {error:.4f}" for name, error in errors.items()))
+        # Window counts are rounded to whole frames, which can add up to half a frame.
+        assert (errors <= RELATIVE_ACCURACY + 1e-3).all()
+
+        saved = os.path.join(directory, 'baseline.npz')
+        stats.save(saved)
+        print(f"Merged statistics of {len(stats)} CAN IDs: {os.path.getsize(saved) / 1024:.0f} KiB on disk")
+
+        # One more capture: the statistics of the new log only, merged in.
+        new_table = tables[-1]
+        start = time.perf_counter()
+        merged = TrafficStats.load(saved).merge(TrafficStats.from_features(new_table))
+        merged.describe()
+        merge = time.perf_counter() - start
+        start = time.perf_counter()
+        pandas_baseline(tables + [new_table])
+        recompute = time.perf_counter() - start
+        print(f"Adding one log's features: merge {merge * 1000:.1f} ms, recompute over every frame "
+              f"{recompute * 1000:.1f} ms ({recompute / merge:.1f}x)")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Incremental runs over a growing capture against recomputing the whole log.
+
+Usage: python benchmarks/bench_incremental.py [--seconds 1200] [--appends 10] [--can-ids 40] [--check]
+
+A synthetic capture (see traffic.py) is written to a log in ``--appends``
+pieces cut at arbitrary bytes, as ``candump -l`` leaves a partly written
+last line. After every piece ``canbus.incremental.incremental_features``
+processes the new tail and ``compute_features`` recomputes the whole log
+for comparison. The last run is ``final``, and the incremental rows of all
+runs must equal the full recompute exactly.
+
+``--check`` only compares the rows of ``CHECK_APPENDS`` runs over a
+``CHECK_SECONDS`` capture with one recompute at the end, without timing.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'notebooks'))
+from canbus import compute_features, parse_can_log  # noqa: E402
+from canbus.incremental import checkpoint_path, incremental_features  # noqa: E402
+from traffic import DEFAULT_ATTACKS, synthetic_traffic, write_candump  # noqa: E402
+
+CHECK_SECONDS = 60.0
+CHECK_APPENDS = 6
+
+
+def capture_bytes(directory, can_ids, seconds, seed):
+    """A synthetic capture written as a candump log, read back as bytes."""
+    source = os.path.join(directory, 'source.log')
+    frames, _ = synthetic_traffic(can_ids, seconds, DEFAULT_ATTACKS, seed)
+    write_candump(source, frames)
+    with open(source, 'rb') as source_file:
+        return frames, source_file.read()
+
+
+def append_cuts(size, appends, seed):
+    """Byte offsets ending each append; the last one is the whole capture."""
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.integers(0, size, appends - 1)).tolist() + [size]
+
+
+def assert_same_rows(parts, log):
+    """Rows of every incremental run, concatenated, against a full recompute of ``log``."""
+    actual = pd.concat(parts, ignore_index=True)
+    expected = compute_features(parse_can_log(log).frames.to_dataframe(compact=True))
+    # Each run's Interface categories are its own; compare the names.
+    for df in (actual, expected):
+        df['Interface'] = df['Interface'].astype(str)
+    pd.testing.assert_frame_equal(actual, expected, check_exact=True)
+    return actual
+
+
+def check():
+    """Incremental runs against one full recompute on a short capture, no timing."""
+    directory = tempfile.mkdtemp()
+    try:
+        _, data = capture_bytes(directory, 20, CHECK_SECONDS, 0)
+        log = os.path.join(directory, 'capture.log')
+        parts = []
+        previous = 0
+        for cut in append_cuts(len(data), CHECK_APPENDS, 0):
+            with open(log, 'ab') as log_file:
+                log_file.write(data[previous:cut])
+            previous = cut
+            parts.append(incremental_features(log, final=cut == len(data)))
+        rows = len(assert_same_rows(parts, log))
+    finally:
+        shutil.rmtree(directory)
+    print(f"Incremental check passed: {CHECK_APPENDS} runs, {rows:,} rows identical to the full recompute")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=1200.0)
+    parser.add_argument('--appends', type=int, default=10)
+    parser.add_argument('--can-ids', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check', action='store_true', help='only run a small parity check')
+    args = parser.parse_args()
+    if args.check:
+        check()
+        return
+
+    directory = tempfile.mkdtemp()
+    try:
+        frames, data = capture_bytes(directory, args.can_ids, args.seconds, args.seed)
+        print(f"{len(frames):,} frames, {len(data) / 2 ** 20:.0f} MiB, in {args.appends} appends")
+
+        log = os.path.join(directory, 'capture.log')
+        parts = []
+        previous = 0
+        print(f"{'append':>6} {'log MiB':>8} {'new rows':>9} {'incremental':>12} {'full':>9}")
+        for index, cut in enumerate(append_cuts(len(data), args.appends, args.seed)):
+            with open(log, 'ab') as log_file:
+                log_file.write(data[previous:cut])
+            previous = cut
+            start = time.perf_counter()
+            parts.append(incremental_features(log, final=cut == len(data)))
+            incremental = time.perf_counter() - start
+            start = time.perf_counter()
+            compute_features(parse_can_log(log).frames.to_dataframe(compact=True))
+            full = time.perf_counter() - start
+            print(f"{index:>6} {cut / 2 ** 20:8.1f} {len(parts[-1]):9,} {incremental:10.3f} s {full:7.3f} s", flush=True)
+
+        actual = assert_same_rows(parts, log)
+        print(f"Incremental rows identical to the full recompute ({len(actual):,} rows); "
+              f"checkpoint {os.path.getsize(checkpoint_path(log)) / 1024:.0f} KiB")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Parity and throughput check for the scenario-driven attack injection.
+
+Usage: python benchmarks/bench_injection.py [--seconds S] [--variants N] [--workers W]
+
+Generates a capture spanning the notebook's attack windows (see traffic.py)
+with IDs 18A and 2C6 busy enough that no frames need to be made up, then
+injects ``DEFAULT_SCENARIOS`` with the old pandas steps from
+data_processing.ipynb and with ``inject_attacks``. Every frame, payload
+and label outside the DoS flood must match; the flood itself only up to
+the float drift of the old ``np.arange`` timestamps. The one intended
+difference is fuzzing: the old notebook labeled every 18A frame of the
+window but randomized only the first 2222, while ``inject_attacks``
+labels just the frames it tampered with, so the rest must be exactly the
+untouched 18A frames the old steps labeled Fuzzing. Finally
+``--variants`` random scenario lists are built into labeled feature
+tables with ``parallel_variants``.
+"""
+
+import argparse
+import random
+import string
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'notebooks'))
+from canbus.injection import DEFAULT_SCENARIOS, inject_attacks, parallel_variants, random_scenarios  # noqa: E402
+from traffic import synthetic_traffic  # noqa: E402
+
+
+def generate_random_payload(length=16):
+    return ''.join(random.choice(string.hexdigits.upper()) for _ in range(length))
+
+
+def legacy_inject(df):
+    """Steps 2-4 and the labeling of the old data_processing.ipynb."""
+    dos_start, dos_end = 1508687520.000000, 1508687529.999750
+    dos_interval = 0.00025
+    dos_timestamps = np.arange(dos_start, dos_end + dos_interval, dos_interval)[:40001]
+    dos_df = pd.DataFrame({'Timestamp': dos_timestamps, 'Interface': 'slcan0', 'CAN_ID': '000',
+                           'Payload': '0000000000000000'})
+    df = df[~df['Timestamp'].between(dos_start, dos_end)]
+    df = pd.concat([df, dos_df], ignore_index=True)
+
+    fuzzing_start, fuzzing_end = 1508687510.000000, 1508687515.999500
+    fuzzing_messages = df[(df['CAN_ID'] == '18A') & (df['Timestamp'].between(fuzzing_start, fuzzing_end))].head(2222)
+    df.loc[fuzzing_messages.index, 'Payload'] = [generate_random_payload() for _ in fuzzing_messages.index]
+
+    suspension_start, suspension_end = 1508687486.000000, 1508687506.000000
+    df = df[~((df['CAN_ID'] == '2C6') & (df['Timestamp'].between(suspension_start, suspension_end)))]
+    df = df.sort_values('Timestamp').reset_index(drop=True)
+
+    df['Label'] = 0
+    df.loc[df['Timestamp'].between(dos_start, dos_end) & (df['CAN_ID'] == '000'), 'Label'] = 1
+    df.loc[df['Timestamp'].between(fuzzing_start, fuzzing_end) & (df['CAN_ID'] == '18A'), 'Label'] = 2
+    suspension_candidates = df[(df['CAN_ID'] == '2C6') & (df['Timestamp'] >= suspension_end)].head(2222)
+    df.loc[suspension_candidates.index, 'Label'] = 3
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=300.0)
+    parser.add_argument('--variants', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    frames, _ = synthetic_traffic(40, args.seconds, {}, seed=0)
+    ids, counts = np.unique(frames.can_id, return_counts=True)
+    busiest = ids[np.argsort(counts)[::-1]]
+    fuzzed, suspended = frames.can_id == busiest[0], frames.can_id == busiest[1]
+    frames.can_id[fuzzed], frames.can_id[suspended] = 0x18A, 0x2C6
+    df = frames.to_dataframe()
+    print(f"{len(frames):,} frames over {args.seconds:g} s")
+
+    start = time.perf_counter()
+    expected = legacy_inject(df)
+    legacy_time = time.perf_counter() - start
+    start = time.perf_counter()
+    injected, labels = inject_attacks(frames, DEFAULT_SCENARIOS, seed=0)
+    new_time = time.perf_counter() - start
+
+    # pandas sorts ties in any order, so compare both in (timestamp, ID, payload) order.
+    ids, payload_strings = injected.can_id_strings(), injected.payload_strings()
+    mine = np.lexsort((payload_strings, ids, injected.timestamp))
+    theirs = np.lexsort(tuple(expected[column].to_numpy().astype(str) for column in ('Payload', 'CAN_ID'))
+                        + (expected['Timestamp'].to_numpy(),))
+    dos = ids[mine] == '000'
+    legacy = {column: expected[column].to_numpy()[theirs] for column in ('Timestamp', 'CAN_ID', 'Payload', 'Label')}
+    legacy_dos = legacy['CAN_ID'] == '000'
+    assert len(injected) == len(expected), (len(injected), len(expected))
+    for column, values in (('Timestamp', injected.timestamp), ('CAN_ID', ids)):
+        assert np.array_equal(values[mine][~dos], legacy[column][~legacy_dos]), column
+    payloads = payload_strings[mine][~dos] == legacy['Payload'][~legacy_dos].astype(str)
+    ours, old = labels[mine][~dos], legacy['Label'][~legacy_dos]
+    assert payloads[ours != 2].all()
+    # Window frames past the first 2222 keep their payload and stay Normal.
+    relabeled = ours != old
+    assert ((ours[relabeled] == 0) & (old[relabeled] == 2)).all()
+    assert (ids[mine][~dos][relabeled] == '18A').all() and int((ours == 2).sum()) == 2222
+    # np.arange(start, end, 0.00025) at epoch scale drifts by a few ms over
+    # 40,000 steps, pushing the last DoS frames out of the window labeled DoS.
+    drift = np.abs(injected.timestamp[mine][dos][:-1] - legacy['Timestamp'][legacy_dos][:int(dos.sum()) - 1]).max()
+    mislabeled = int((legacy['Label'][legacy_dos] == 0).sum())
+    print(f"legacy pandas injection {legacy_time:8.3f} s")
+    print(f"inject_attacks          {new_time:8.3f} s  {legacy_time / new_time:6.1f}x  same frames and payloads")
+    print(f"  legacy DoS timestamps drift up to {drift * 1000:.2f} ms; {mislabeled} DoS frames labeled Normal")
+    print(f"  {int(relabeled.sum())} untouched 18A frames in the fuzzing window labeled Normal "
+          "(the old notebook labeled them Fuzzing)")
+
+    scenario_sets = random_scenarios(frames, args.variants, seed=1)
+    start = time.perf_counter()
+    tables = parallel_variants(frames, scenario_sets, workers=args.workers, seed=2)
+    elapsed = time.perf_counter() - start
+    rows = sum(len(table) for table in tables)
+    print(f"{args.variants} labeled variants in {elapsed:.2f} s ({rows / elapsed:,.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
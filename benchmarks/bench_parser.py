@@ -0,0 +1,153 @@
+"""Compare the vectorized candump parser with the old line-by-line loop.
+
+Usage: python benchmarks/bench_parser.py [--lines N] [--log PATH] [--check]
+
+Without ``--log`` a synthetic candump log of ``--lines`` frames is written to
+a temporary file first. Both parsers must produce the same frames.
+
+``--check`` skips the timing and only compares both parsers on a few
+hand-written lines off candump's fixed layout (integer timestamps, tabs,
+runs of spaces), which exercise the general path.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+from tqdm import tqdm
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'notebooks'))
+from canbus import parse_can_log  # noqa: E402
+
+
+def write_synthetic_log(path, lines, seed=0):
+    """Write ``lines`` candump frames with a mix of IDs and DLCs."""
+    rng = random.Random(seed)
+    can_ids = ['0C1', '12E', '18A', '1F1', '2C6', '3D0', '4F1', '7DF', '18DAF110']
+    timestamp = 1508687283.0
+    with open(path, 'w') as log_file:
+        for _ in range(lines):
+            timestamp += rng.random() * 0.0005
+            dlc = rng.choice((2, 4, 8, 8, 8))
+            payload = ''.join(rng.choice('0123456789ABCDEF') for _ in range(2 * dlc))
+            log_file.write(f'({timestamp:.6f}) slcan0 {rng.choice(can_ids)}#{payload}\n')
+
+
+def legacy_parse(input_file_path):
+    """The parsing step the notebooks used before ``canbus.parser``."""
+    messages = []
+    total_lines = sum(1 for _ in open(input_file_path, 'r', encoding='utf-8'))
+    with open(input_file_path, 'r', encoding='utf-8') as log_file:
+        for line in tqdm(log_file, total=total_lines, desc="Parsing lines", disable=True):
+            line = line.strip()
+            if not line or not line.startswith('('):
+                continue
+            try:
+                timestamp_end = line.find(')')
+                timestamp = float(line[1:timestamp_end])
+                remaining = line[timestamp_end+1:].strip()
+                parts = remaining.split(maxsplit=1)
+                if len(parts) == 2:
+                    interface = parts[0]
+                    can_data = parts[1]
+                    if '#' in can_data:
+                        can_id, payload = can_data.split('#', 1)
+                        messages.append({
+                            'Timestamp': timestamp,
+                            'Interface': interface,
+                            'CAN_ID': can_id,
+                            'Payload': payload
+                        })
+            except:  # noqa: E722 - kept as it was
+                continue
+    return pd.DataFrame(messages)
+
+
+IRREGULAR_LINES = (
+    '(1508687283) can0 12E#00\n'
+    '(12) can0 0C1#0011\n'
+    '(1508687283.891357) slcan0 12E#C680027FD0FFFF00\n'
+    '(1.5)  can0 18A#0011\n'
+    '(2.5)\tcan0\t1F1#00\n'
+    '(3.5)can0 2C6#\n'
+    '\n'
+    '  (6.25) can1   18DAF110#00  \r\n'
+)
+
+
+def assert_same_frames(parsed, legacy_df):
+    new_df = parsed.frames.to_dataframe()
+    assert len(new_df) == len(legacy_df), (len(new_df), len(legacy_df))
+    assert (new_df['Timestamp'].to_numpy() == legacy_df['Timestamp'].to_numpy()).all()
+    assert (new_df['Interface'] == legacy_df['Interface']).all()
+    # IDs and payloads come back in candump's upper case.
+    for column in ('CAN_ID', 'Payload'):
+        assert (new_df[column] == legacy_df[column].str.upper()).all(), column
+
+
+def check():
+    """Both parsers on ``IRREGULAR_LINES``, no timing."""
+    handle, log_path = tempfile.mkstemp(suffix='.log')
+    os.close(handle)
+    try:
+        with open(log_path, 'w', newline='') as log_file:
+            log_file.write(IRREGULAR_LINES)
+        parsed, legacy_df = parse_can_log(log_path), legacy_parse(log_path)
+    finally:
+        os.remove(log_path)
+    assert_same_frames(parsed, legacy_df)
+    assert parsed.frames.timestamp[:2].tolist() == [1508687283.0, 12.0]
+    print(f"Parser check passed: {len(legacy_df)} irregular lines decoded as the line loop does")
+
+
+def best_of(repeats, function, *args):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=1_000_000)
+    parser.add_argument('--log', help='existing candump log to parse instead of a synthetic one')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--check', action='store_true', help='only run the small parity check')
+    args = parser.parse_args()
+    if args.check:
+        check()
+        return
+
+    if args.log:
+        log_path = args.log
+    else:
+        handle, log_path = tempfile.mkstemp(suffix='.log')
+        os.close(handle)
+        print(f"Writing {args.lines} synthetic frames to {log_path}...")
+        write_synthetic_log(log_path, args.lines)
+
+    try:
+        legacy_time, legacy_df = best_of(args.repeats, legacy_parse, log_path)
+        new_time, parsed = best_of(args.repeats, parse_can_log, log_path)
+    finally:
+        if not args.log:
+            os.remove(log_path)
+
+    assert_same_frames(parsed, legacy_df)
+
+    lines = parsed.lines
+    print(f"{'parser':<12}{'seconds':>10}{'lines/s':>14}")
+    print(f"{'legacy':<12}{legacy_time:>10.3f}{lines / legacy_time:>14,.0f}")
+    print(f"{'vectorized':<12}{new_time:>10.3f}{lines / new_time:>14,.0f}")
+    print(f"Speedup: {legacy_time / new_time:.1f}x ({parsed.skipped} malformed lines skipped)")
+
+
+if __name__ == '__main__':
+    main()
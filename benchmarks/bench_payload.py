@@ -0,0 +1,80 @@
+"""Benchmark for the vectorized Payload_Entropy / Payload_Decimal columns.
+
+Usage: python benchmarks/bench_payload.py [--frames 1000000] [--distinct 5000]
+
+Hex payloads with variable DLC are drawn from a pool of ``--distinct``
+values, as on a real bus where counters and static signals repeat. The
+per-row ``apply`` functions from data_processing.ipynb are timed on a
+sample and checked against the vectorized path.
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.stats import entropy
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'notebooks'))
+from canbus.payload import _payload_entropy, decode_hex_payloads, payload_entropy, payload_features  # noqa: E402
+
+
+def synthetic_payloads(frames, distinct, seed=0):
+    """Hex payload strings of 0-8 bytes, mostly low-entropy repeats."""
+    rng = np.random.default_rng(seed)
+    dlc = rng.choice(9, distinct, p=[0.02, 0.03, 0.05, 0.05, 0.1, 0.05, 0.1, 0.1, 0.5])
+    alphabet = rng.integers(1, 257, distinct)
+    pool = [bytes(rng.integers(0, size, length).astype(np.uint8)).hex().upper()
+            for size, length in zip(alphabet, dlc)]
+    return pd.Series(np.array(pool, dtype=object)[rng.integers(0, distinct, frames)])
+
+
+def legacy_payload_entropy(payload):
+    """compute_payload_entropy from data_processing.ipynb."""
+    if not payload:
+        return 0.0
+    bytes_array = [int(payload[i:i+2], 16) for i in range(0, len(payload), 2)]
+    value_counts = pd.Series(bytes_array).value_counts()
+    probs = value_counts / len(bytes_array)
+    return entropy(probs, base=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=1000000)
+    parser.add_argument('--distinct', type=int, default=5000)
+    parser.add_argument('--legacy-max', type=int, default=20000)
+    args = parser.parse_args()
+
+    payloads = synthetic_payloads(args.frames, args.distinct)
+
+    start = time.perf_counter()
+    values, dlc = decode_hex_payloads(payloads)
+    entropies, decimals = payload_features(values, dlc)
+    batch_time = time.perf_counter() - start
+
+    sample = payloads[:args.legacy_max]
+    start = time.perf_counter()
+    expected_entropy = sample.apply(legacy_payload_entropy).to_numpy()
+    expected_decimal = sample.apply(lambda payload: int(payload, 16) if payload else 0)
+    legacy_time = (time.perf_counter() - start) * len(payloads) / len(sample)
+    assert np.allclose(expected_entropy, entropies[:len(sample)], rtol=0, atol=1e-12), 'entropy differs'
+    assert expected_decimal.tolist() == decimals[:len(sample)].tolist(), 'decimal differs'
+
+    start = time.perf_counter()
+    cached = [payload_entropy(value, length) for value, length in zip(values.tolist(), dlc.tolist())]
+    cached_time = time.perf_counter() - start
+    assert np.array_equal(cached, entropies), 'cached path differs'
+    # Frame arrays hand out NumPy scalars.
+    assert [payload_entropy(value, length) for value, length in zip(values[:100], dlc[:100])] == cached[:100]
+
+    print(f"{args.frames:,} payloads, {args.distinct:,} distinct; outputs match the notebook functions")
+    print(f"legacy apply  {legacy_time:8.2f} s (extrapolated from {len(sample):,})")
+    print(f"vectorized    {batch_time:8.3f} s  ({legacy_time / batch_time:.0f}x)")
+    print(f"cached scalar {cached_time:8.3f} s  {_payload_entropy.cache_info()}")
+
+
+if __name__ == '__main__':
+    main()
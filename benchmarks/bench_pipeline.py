@@ -0,0 +1,174 @@
+"""Per-stage throughput and memory of the whole pipeline at growing sizes.
+
+Usage: python benchmarks/bench_pipeline.py [--sizes 100000,1000000,10000000,100000000]
+                                           [--can-ids 40] [--attacks dos=0.05,fuzzing=0.05,suspension=0.05]
+                                           [--rounds 20] [--output results.json]
+
+For every size a synthetic labeled capture (see traffic.py) is written as
+a candump log, then each stage runs on its own and is timed:
+
+parse, inter_arrival, window_count, entropy_decimal, suspension,
+normalization, training and prediction.
+
+Each size runs in a fresh child process, so a size that runs out of memory
+is recorded as failed without losing the others and peak RSS is not
+inherited. Per stage the wall and CPU time, frames/s and peak RSS are
+recorded (peak RSS is reset before every stage where Linux allows it).
+Results are written as JSON so runs can be compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'notebooks'))
+from canbus.features import FEATURE_COLUMNS, MAX_ENTROPY, MAX_PAYLOAD_DECIMAL  # noqa: E402
+from canbus.features import inter_arrivals, suspension_indicator, window_counts  # noqa: E402
+from canbus.metrics import peak_rss_mb, reset_peak_rss  # noqa: E402
+from canbus.normal_stats import NormalStats  # noqa: E402
+from canbus.parser import parse_can_log  # noqa: E402
+from canbus.payload import payload_features  # noqa: E402
+from traffic import DEFAULT_ATTACKS, seconds_for, synthetic_traffic, write_candump  # noqa: E402
+
+DEFAULT_SIZES = '100000,1000000,10000000,100000000'
+DEFAULT_OUTPUT = Path(__file__).resolve().parent / 'results' / 'pipeline.json'
+
+
+def timed(results, stage, frames, function, *args):
+    """Run one stage and append its timings to ``results``."""
+    reset_peak_rss()
+    wall, cpu = time.perf_counter(), time.process_time()
+    value = function(*args)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    results.append({
+        'stage': stage,
+        'frames': frames,
+        'wall_s': round(wall, 4),
+        'cpu_s': round(cpu, 4),
+        'frames_per_s': round(frames / wall, 1) if wall else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    })
+    print(f"  {stage:<16} {wall:9.3f} s  {frames / wall if wall else float('inf'):>14,.0f} frames/s"
+          f"  peak {results[-1]['peak_rss_mb']:9.1f} MB", flush=True)
+    return value
+
+
+def normalization(can_ids, gaps, counts, labels):
+    """Compile the normal-traffic means and normalize both timing columns."""
+    normal = labels == 0
+    ids, codes = np.unique(can_ids[normal], return_inverse=True)
+    frames = np.bincount(codes)
+    stats = NormalStats(ids, np.bincount(codes, gaps[normal]) / frames, np.bincount(codes, counts[normal]) / frames)
+    return stats.normalize(can_ids, gaps, counts)
+
+
+def training(features, labels, rounds):
+    import xgboost as xgb
+
+    params = {'objective': 'multi:softprob', 'num_class': 4, 'tree_method': 'hist', 'max_depth': 6, 'eta': 0.3}
+    return xgb.train(params, xgb.DMatrix(features, label=labels, feature_names=FEATURE_COLUMNS), rounds)
+
+
+def run_size(size, can_ids, attacks, rounds, seed):
+    """All stages on one synthetic capture of about ``size`` frames."""
+    results = []
+    seconds = seconds_for(size, can_ids, seed, attacks)
+    frames, labels = timed(results, 'generate', size, synthetic_traffic, can_ids, seconds, attacks, seed)
+    size = len(frames)
+    directory = tempfile.mkdtemp()
+    log_path = os.path.join(directory, 'synthetic.log')
+    try:
+        timed(results, 'write_log', size, write_candump, log_path, frames)
+        log_bytes = os.path.getsize(log_path)
+        del frames
+        parsed = timed(results, 'parse', size, parse_can_log, log_path)
+    finally:
+        os.remove(log_path)
+        os.rmdir(directory)
+    frames = parsed.frames
+    timestamps, ids = frames.timestamp, frames.can_id
+
+    gaps = timed(results, 'inter_arrival', size, inter_arrivals, timestamps, ids)
+    counts = timed(results, 'window_count', size, lambda: window_counts(timestamps, ids, (5.0,))[5.0])
+    entropy, decimal = timed(results, 'entropy_decimal', size, payload_features, frames.payload, frames.dlc)
+    suspension = timed(results, 'suspension', size, suspension_indicator, timestamps, ids, gaps)
+    norm_gaps, norm_counts = timed(results, 'normalization', size, normalization, ids, gaps, counts, labels)
+
+    features = np.empty((size, len(FEATURE_COLUMNS)), dtype=np.float32)
+    for column, values in enumerate((gaps, counts, entropy, norm_gaps, norm_counts, entropy / MAX_ENTROPY,
+                                     decimal.astype(np.float64) / float(MAX_PAYLOAD_DECIMAL), suspension)):
+        features[:, column] = values
+    del parsed, frames, gaps, counts, entropy, decimal, suspension, norm_gaps, norm_counts
+    booster = timed(results, 'training', size, training, features, labels, rounds)
+    timed(results, 'prediction', size, booster.inplace_predict, features)
+    return {
+        'frames': size,
+        'seconds': round(seconds, 3),
+        'log_bytes': log_bytes,
+        'labels': np.bincount(labels, minlength=4).tolist(),
+        'stages': results,
+    }
+
+
+def parse_attacks(text):
+    if not text:
+        return {}
+    return {name: float(share) for name, share in (item.split('=') for item in text.split(','))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES)
+    parser.add_argument('--can-ids', type=int, default=40)
+    parser.add_argument('--attacks', default=','.join(f'{name}={share}' for name, share in DEFAULT_ATTACKS.items()),
+                        help='attack=share of the capture, comma separated (empty for none)')
+    parser.add_argument('--rounds', type=int, default=20, help='boosting rounds of the training stage')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=str(DEFAULT_OUTPUT))
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    attacks = parse_attacks(args.attacks)
+
+    if args.single:
+        # Child process: run one size and hand the result back on stdout's last line.
+        result = run_size(args.single, args.can_ids, attacks, args.rounds, args.seed)
+        print(json.dumps(result))
+        return
+
+    runs = []
+    for size in (int(size) for size in args.sizes.split(',')):
+        print(f"{size:,} frames", flush=True)
+        command = [sys.executable, __file__, '--single', str(size), '--can-ids', str(args.can_ids),
+                   '--attacks', args.attacks, '--rounds', str(args.rounds), '--seed', str(args.seed)]
+        child = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+        lines = child.stdout.splitlines()
+        if child.returncode == 0:
+            print('\n'.join(lines[:-1]), flush=True)
+            runs.append(json.loads(lines[-1]))
+        else:
+            print('\n'.join(lines), flush=True)
+            print(f"  failed with exit code {child.returncode} (likely out of memory)")
+            runs.append({'frames': size, 'error': f'exit code {child.returncode}', 'stages': []})
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'parameters': {'can_ids': args.can_ids, 'attacks': attacks, 'rounds': args.rounds, 'seed': args.seed},
+        'runs': runs,
+    }
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=1)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
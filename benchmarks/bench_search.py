@@ -0,0 +1,123 @@
+"""Cost of preparing the data for a hyperparameter search, and a small search.
+
+Usage: python benchmarks/bench_search.py [--frames 2000000] [--table-frames 1000000] [--trials 12]
+                                         [--max-rounds 200] [--workers N] [--threads-per-trial 1]
+                                         [--store DIR] [--output results.json]
+
+Synthetic labeled feature tables (see traffic.py) are cached in a
+``FeatureStore``. The script times what a naive search pays for every
+trial, building the train and validation ``QuantileDMatrix`` from the
+store through ``canbus.training.ChunkIter``, against what
+``canbus.search`` pays: ``quantize_splits`` once, then building the
+matrices from the stored bin codes once per worker. Then it runs
+``search`` and reports how many trials were pruned, the boosting rounds
+they were spared and the best configuration.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'notebooks'))
+from bench_training import table_keys  # noqa: E402
+from canbus.metrics import QUIET, Metrics  # noqa: E402
+from canbus.store import FeatureStore  # noqa: E402
+
+DEFAULT_OUTPUT = Path(__file__).resolve().parent / 'results' / 'search.json'
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def rebuild_matrices(chunks, max_train_rows):
+    """The train and validation matrices as a naive search would build them for each trial."""
+    import xgboost as xgb
+    from canbus.training import LABEL_NAMES, TRAIN, VALIDATION, ChunkIter, _scan, class_weights, sampling_rates
+
+    counts, _ = _scan(chunks, 0, len(LABEL_NAMES))
+    weights = class_weights(counts[TRAIN])
+    rates = sampling_rates(counts[TRAIN], max_train_rows)
+    dtrain = xgb.QuantileDMatrix(ChunkIter(chunks, TRAIN, 0, weights, rates), max_bin=255)
+    xgb.QuantileDMatrix(ChunkIter(chunks, VALIDATION, 0, weights, rates), max_bin=255, ref=dtrain)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=2000000)
+    parser.add_argument('--table-frames', type=int, default=1000000)
+    parser.add_argument('--trials', type=int, default=12)
+    parser.add_argument('--max-rounds', type=int, default=200)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--threads-per-trial', type=int, default=1)
+    parser.add_argument('--store', help='FeatureStore for the synthetic tables (default: a temporary one)')
+    parser.add_argument('--output', default=str(DEFAULT_OUTPUT))
+    args = parser.parse_args()
+    from canbus.search import MAX_TRAIN_ROWS, _load_worker, quantize_splits, search
+    from canbus.training import store_chunks
+
+    store_root = args.store or tempfile.mkdtemp(prefix='bench-search-')
+    work_dir = tempfile.mkdtemp(prefix='bench-search-codes-')
+    try:
+        store = FeatureStore(store_root)
+        keys, frames = table_keys(store, args.frames, args.table_frames)
+        chunks = store_chunks(store, keys)
+        print(f"{frames:,} frames in {len(keys)} tables")
+
+        _, rebuild = timed(rebuild_matrices, chunks, MAX_TRAIN_ROWS)
+        meta, quantize = timed(quantize_splits, chunks, work_dir, metrics=Metrics(QUIET))
+        _, load = timed(_load_worker, work_dir, args.threads_per_trial, {})
+        code_bytes = sum(os.path.getsize(Path(work_dir) / name) for name in os.listdir(work_dir))
+        print(f"Matrices from the store, every trial      {rebuild:7.2f} s")
+        print(f"quantize_splits, once                     {quantize:7.2f} s "
+              f"({meta['rows']['train']:,} + {meta['rows']['validation']:,} rows, {code_bytes / 2 ** 20:.1f} MiB)")
+        print(f"Matrices from the codes, once per worker  {load:7.2f} s")
+
+        report, wall = timed(search, work_dir, args.trials, args.workers, args.threads_per_trial, args.max_rounds,
+                             metrics=Metrics(QUIET))
+        trials = report['trials']
+        pruned = [trial for trial in trials if trial['status'] == 'pruned']
+        complete_rounds = [trial['rounds'] for trial in trials if trial['status'] == 'complete']
+        # Rounds a pruned trial would have run, estimated by the median complete trial.
+        spared = sum(max(0, int(np.median(complete_rounds)) - trial['rounds']) for trial in pruned) if complete_rounds else 0
+        best = report['best']
+        print(f"Search of {len(trials)} trials on {report['workers']} workers x {args.threads_per_trial} threads: "
+              f"{wall:.1f} s, {len(pruned)} pruned (about {spared} rounds spared)")
+        print(f"  notebook settings: mlogloss {trials[0]['mlogloss']:.5f}, rare F1 {trials[0]['rare_f1']:.4f}, "
+              f"{trials[0]['trees']} trees, {trials[0]['inference_us_per_frame']:.2f} us/frame")
+        print(f"  best (trial {best['trial']}): mlogloss {best['mlogloss']:.5f}, rare F1 {best['rare_f1']:.4f}, "
+              f"{best['trees']} trees, {best['train_s']:.1f} s to train, {best['inference_us_per_frame']:.2f} us/frame")
+        print(f"  {best['params']}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if not args.store:
+            shutil.rmtree(store_root, ignore_errors=True)
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cpus': os.cpu_count(),
+        'frames': frames,
+        'rebuild_per_trial_s': round(rebuild, 3),
+        'quantize_once_s': round(quantize, 3),
+        'load_per_worker_s': round(load, 3),
+        'search_s': round(wall, 3),
+        'pruned': len(pruned),
+        'search': report,
+    }
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=1)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
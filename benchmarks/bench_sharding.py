@@ -0,0 +1,96 @@
+"""Parity and scaling check for sharded multi-process preprocessing.
+
+Usage: python benchmarks/bench_sharding.py [--seconds S] [--workers 1,2,4,8] [--logs N] [--check]
+
+Writes ``--logs`` attack captures like bench_streaming.py, runs
+``compute_features`` serially and ``parallel_features_for_logs`` with each
+worker count, checks the tables are identical and reports the speedup.
+Shards are made small enough that every worker count gets several.
+
+``--check`` only compares two ``CHECK_SECONDS`` captures cut into shards
+of ``CHECK_SHARD_BYTES`` over two and three workers, without timing.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'notebooks'))
+from canbus import compute_features, parse_can_log  # noqa: E402
+from canbus import sharding  # noqa: E402
+from bench_streaming import write_attack_log  # noqa: E402
+
+CHECK_SECONDS = 15.0
+CHECK_SHARD_BYTES = 1 << 16
+
+
+def attack_logs(directory, logs, seconds):
+    paths = [os.path.join(directory, f'capture_{index}.log') for index in range(logs)]
+    for index, path in enumerate(paths):
+        write_attack_log(path, seconds, seed=index)
+    return paths
+
+
+def serial_features(paths):
+    return {path: compute_features(parse_can_log(path).frames.to_dataframe(compact=True)) for path in paths}
+
+
+def assert_same_tables(expected, actual):
+    for path, df in expected.items():
+        pd.testing.assert_frame_equal(df, actual[path], check_exact=True)
+
+
+def check():
+    """Sharded against serial features on two short captures, no timing."""
+    directory = tempfile.mkdtemp()
+    sharding.MIN_SHARD_BYTES = CHECK_SHARD_BYTES
+    try:
+        paths = attack_logs(directory, 2, CHECK_SECONDS)
+        expected = serial_features(paths)
+        for workers in (2, 3):
+            assert_same_tables(expected, sharding.parallel_features_for_logs(paths, workers))
+    finally:
+        shutil.rmtree(directory)
+    print(f"Sharding check passed: {sum(map(len, expected.values())):,} frames in {len(paths)} logs "
+          "identical to serial on 2 and 3 workers")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=120.0)
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--logs', type=int, default=2)
+    parser.add_argument('--check', action='store_true', help='only run a small parity check')
+    args = parser.parse_args()
+    if args.check:
+        check()
+        return
+
+    directory = tempfile.mkdtemp()
+    sharding.MIN_SHARD_BYTES = 1 << 18
+    try:
+        paths = attack_logs(directory, args.logs, args.seconds)
+        start = time.perf_counter()
+        expected = serial_features(paths)
+        serial_time = time.perf_counter() - start
+        frames = sum(len(df) for df in expected.values())
+        print(f"{args.logs} logs, {frames:,} frames; serial {serial_time:.2f} s on {os.cpu_count()} CPUs")
+
+        for workers in (int(count) for count in args.workers.split(',')):
+            start = time.perf_counter()
+            actual = sharding.parallel_features_for_logs(paths, workers)
+            elapsed = time.perf_counter() - start
+            assert_same_tables(expected, actual)
+            print(f"{workers:>3} workers {elapsed:8.2f} s  {serial_time / elapsed:5.2f}x  identical to serial")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Parity and throughput check for the streaming feature extractor.
+
+Usage: python benchmarks/bench_streaming.py [--seconds S] [--check]
+
+Writes a dosattack.log-style capture (periodic traffic, a 4 frames/ms flood
+of ID 000 and a few seconds of silence from ID 2C6), computes the eight
+model features with the batch path and with ``StreamingFeatureExtractor``,
+checks that they are identical and reports streaming frames/s on one core.
+The compiled normal-stats normalization is also checked against the
+notebooks' row-wise version on a sample.
+
+``--check`` only runs the parity check, on a capture of ``CHECK_SECONDS``
+pushed in several blocks, and skips the timing and the row-wise sample.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'notebooks'))
+from canbus import parse_can_log  # noqa: E402
+from canbus.features import FEATURE_COLUMNS, compute_features  # noqa: E402
+from canbus.normal_stats import NormalStats, normalize_features  # noqa: E402
+from canbus.streaming import StreamingFeatureExtractor  # noqa: E402
+
+# Bus rate the extractor has to keep up with: a saturated 500 kbit/s bus
+# carries roughly 4,000 frames/s, so 20k frames/s leaves ample headroom.
+REQUIRED_FRAMES_PER_SECOND = 20_000
+CHECK_SECONDS = 15.0
+
+
+def write_attack_log(path, seconds, seed=0):
+    """Periodic traffic with a DoS flood and a suspended ID."""
+    rng = random.Random(seed)
+    start = 1508687283.0
+    periods = {f'{0x0C0 + 7 * index:03X}': rng.choice((0.01, 0.02, 0.05, 0.1)) for index in range(30)}
+    periods['2C6'] = 0.01
+    periods['18DAF110'] = 0.1
+    frames = []
+    for can_id, period in periods.items():
+        timestamp = start + rng.random() * period
+        counter = 0
+        while timestamp < start + seconds:
+            suspended = can_id == '2C6' and start + 0.4 * seconds < timestamp < start + 0.4 * seconds + 4.0
+            if not suspended:
+                data = [counter & 0xFF] + [rng.randrange(4) for _ in range(7)]
+                frames.append((round(timestamp, 6), can_id, bytes(data).hex().upper()))
+            counter += 1
+            timestamp += period * (1 + rng.uniform(-0.02, 0.02))
+    dos_start = start + 0.6 * seconds
+    for index in range(int(0.2 * seconds / 0.00025)):
+        frames.append((round(dos_start + index * 0.00025, 6), '000', '0000000000000000'))
+    frames.sort(key=lambda frame: frame[0])
+    with open(path, 'w') as log_file:
+        for timestamp, can_id, payload in frames:
+            log_file.write(f'({timestamp:.6f}) slcan0 {can_id}#{payload}\n')
+
+
+def batch_features(df, normal_stats):
+    """The batch path: compute_features plus the compiled normalization."""
+    return normalize_features(compute_features(df), NormalStats.from_frame(normal_stats))
+
+
+def early_normal_stats(df, seconds):
+    """Normal statistics from the first third of the capture, as in training."""
+    features = compute_features(df)
+    normal = features[features['Timestamp'] < features['Timestamp'].min() + seconds / 3]
+    normal_stats = normal.groupby('CAN_ID').agg({
+        'CAN_ID_Inter_Arrival': 'mean',
+        'CAN_ID_Window_Count': 'mean'
+    }).reset_index()
+    normal_stats.columns = ['CAN_ID', 'Mean_Inter_Arrival', 'Mean_Window_Count']
+    return normal_stats
+
+
+def attack_frames(seconds):
+    """Parsed frames of a ``write_attack_log`` capture."""
+    handle, log_path = tempfile.mkstemp(suffix='.log')
+    os.close(handle)
+    try:
+        write_attack_log(log_path, seconds)
+        return parse_can_log(log_path).frames
+    finally:
+        os.remove(log_path)
+
+
+def assert_same_features(rows, expected):
+    """Streamed rows must hold exactly the batch timestamps and features."""
+    actual = np.array([row[4] for row in rows])
+    assert len(actual) == len(expected)
+    assert np.array_equal(np.array([row[0] for row in rows]), expected['Timestamp'].to_numpy())
+    for index, column in enumerate(FEATURE_COLUMNS):
+        mismatches = np.count_nonzero(actual[:, index] != expected[column].to_numpy(np.float64))
+        assert mismatches == 0, f"{column}: {mismatches} rows differ"
+
+
+def check():
+    """Streaming against batch features on a short capture, fed in uneven blocks."""
+    frames = attack_frames(CHECK_SECONDS)
+    df = frames.to_dataframe()
+    normal_stats = early_normal_stats(df, CHECK_SECONDS)
+    expected = batch_features(df, normal_stats)
+    extractor = StreamingFeatureExtractor(normal_stats, total_can_ids=df['CAN_ID'].nunique())
+    rows = []
+    cuts = (np.linspace(0, 1, 8) ** 2 * len(frames)).astype(int)
+    for start, end in zip(cuts[:-1], cuts[1:]):
+        rows.extend(extractor.push_frames(frames.take(np.arange(start, end))))
+    rows.extend(extractor.flush())
+    assert_same_features(rows, expected)
+    print(f"Streaming check passed: {len(frames):,} frames identical to the batch path")
+
+
+def legacy_normalize_features(row, stats_df):
+    """normalize_features from the notebooks, applied row by row."""
+    can_id = row['CAN_ID']
+    stats = stats_df[stats_df['CAN_ID'] == can_id]
+    if not stats.empty:
+        norm_inter_arrival = row['CAN_ID_Inter_Arrival'] / stats['Mean_Inter_Arrival'].iloc[0] if stats['Mean_Inter_Arrival'].iloc[0] != 0 else 1.0
+        norm_window_count = row['CAN_ID_Window_Count'] / stats['Mean_Window_Count'].iloc[0] if stats['Mean_Window_Count'].iloc[0] != 0 else 1.0
+    else:
+        norm_inter_arrival = 1.0
+        norm_window_count = 1.0
+    return pd.Series({'Norm_Inter_Arrival': norm_inter_arrival, 'Norm_Window_Count': norm_window_count})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=60.0)
+    parser.add_argument('--legacy-rows', type=int, default=5000)
+    parser.add_argument('--check', action='store_true', help='only run a small parity check')
+    args = parser.parse_args()
+    if args.check:
+        check()
+        return
+
+    frames = attack_frames(args.seconds)
+    df = frames.to_dataframe()
+    print(f"{len(frames)} frames over {args.seconds:.0f} s")
+    normal_stats = early_normal_stats(df, args.seconds)
+
+    start = time.perf_counter()
+    expected = batch_features(df, normal_stats)
+    batch_time = time.perf_counter() - start
+
+    # Spread over the capture so the flood ID, missing from normal_stats, is included.
+    sample = expected.iloc[::max(1, len(expected) // args.legacy_rows)]
+    start = time.perf_counter()
+    legacy = sample.apply(legacy_normalize_features, axis=1, args=(normal_stats,))
+    legacy_time = (time.perf_counter() - start) * len(expected) / len(sample)
+    for column in ('Norm_Inter_Arrival', 'Norm_Window_Count'):
+        assert np.array_equal(legacy[column].to_numpy(), sample[column].to_numpy()), f"{column} differs"
+    print(f"Compiled normal-stats lookup matches the row-wise normalize_features "
+          f"(row-wise would take ~{legacy_time:.1f} s for all frames).")
+
+    extractor = StreamingFeatureExtractor(normal_stats, total_can_ids=df['CAN_ID'].nunique())
+    start = time.perf_counter()
+    rows = extractor.push_frames(frames)
+    rows.extend(extractor.flush())
+    stream_time = time.perf_counter() - start
+
+    assert_same_features(rows, expected)
+    print("Streaming features are identical to the batch path.")
+
+    rate = len(frames) / stream_time
+    print(f"batch      {batch_time:8.3f} s")
+    print(f"streaming  {stream_time:8.3f} s  {rate:,.0f} frames/s")
+    status = 'OK' if rate > REQUIRED_FRAMES_PER_SECOND else 'TOO SLOW'
+    print(f"Required {REQUIRED_FRAMES_PER_SECOND:,} frames/s: {status}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Scaling benchmark for the sweep-line Suspension_Indicator.
+
+Usage: python benchmarks/bench_suspension.py [--sizes 100000,1000000,...]
+
+Synthetic traffic with a few dozen periodic CAN IDs and occasional large
+gaps is generated per size. Up to ``--legacy-max`` frames the old per-frame
+loop is also timed and the outputs are checked to be bit-identical.
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'notebooks'))
+from canbus.features import suspension_indicator  # noqa: E402
+
+
+def synthetic_frames(size, can_ids=40, gap_rate=0.001, seed=0):
+    """Sorted timestamps, integer CAN IDs and per-ID inter-arrivals."""
+    rng = np.random.default_rng(seed)
+    timestamps = 1508687283.0 + np.cumsum(rng.exponential(0.0005, size))
+    codes = rng.integers(0, can_ids, size)
+    # Stretch a few gaps past the 2 s threshold.
+    timestamps += np.cumsum(rng.random(size) < gap_rate / 100) * 3.0
+    order = np.argsort(codes, kind='stable')
+    inter_arrivals = np.full(size, 0.010)
+    same_id = codes[order][1:] == codes[order][:-1]
+    inter_arrivals[order[1:][same_id]] = np.diff(timestamps[order])[same_id]
+    big = rng.random(size) < gap_rate
+    inter_arrivals[big] = 2.5
+    return timestamps, codes, inter_arrivals
+
+
+def legacy_suspension_indicator(timestamps, can_ids, inter_arrivals, threshold=2.0, window=0.5):
+    """The per-frame loop from the notebooks, on arrays."""
+    indicators = np.zeros(len(timestamps))
+    total_can_ids = len(np.unique(can_ids))
+    for i in range(len(timestamps)):
+        timestamp = timestamps[i]
+        mask = (timestamps >= timestamp - window) & (timestamps <= timestamp + window) & (inter_arrivals > threshold)
+        affected_can_ids = len(np.unique(can_ids[mask]))
+        indicators[i] = affected_can_ids / total_can_ids if total_can_ids > 0 else 0.0
+    return indicators
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='100000,1000000,10000000,50000000')
+    parser.add_argument('--legacy-max', type=int, default=20000)
+    args = parser.parse_args()
+
+    legacy_size = args.legacy_max
+    if legacy_size:
+        frames = synthetic_frames(legacy_size)
+        start = time.perf_counter()
+        expected = legacy_suspension_indicator(*frames)
+        legacy_time = time.perf_counter() - start
+        start = time.perf_counter()
+        actual = suspension_indicator(*frames)
+        sweep_time = time.perf_counter() - start
+        assert np.array_equal(expected, actual), 'outputs differ'
+        print(f"{legacy_size} frames: legacy {legacy_time:.2f} s, sweep {sweep_time:.4f} s, "
+              f"identical output ({legacy_time / sweep_time:.0f}x)")
+
+    print(f"{'frames':>12}{'seconds':>10}{'frames/s':>14}")
+    for size in (int(size) for size in args.sizes.split(',')):
+        frames = synthetic_frames(size)
+        start = time.perf_counter()
+        suspension_indicator(*frames)
+        elapsed = time.perf_counter() - start
+        print(f"{size:>12,}{elapsed:>10.3f}{size / elapsed:>14,.0f}")
+        del frames
+
+
+if __name__ == '__main__':
+    main()
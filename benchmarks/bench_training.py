@@ -0,0 +1,123 @@
+"""Peak memory and time of out-of-core training as the dataset grows.
+
+Usage: python benchmarks/bench_training.py [--sizes 400000,4000000,40000000,100000000]
+                                           [--table-frames 1000000] [--max-rounds 50] [--in-memory]
+                                           [--store DIR] [--output results.json]
+
+Synthetic labeled feature tables (see traffic.py) of ``--table-frames``
+frames each are cached in a ``FeatureStore``, then for every size
+``canbus.training.train_out_of_core`` is run in a fresh process on as many
+tables as make up that size. Peak RSS of the whole run, time per stage,
+rounds until early stopping and test accuracy are recorded; with external
+memory the peak should not grow with the size. ``--in-memory`` uses a
+``QuantileDMatrix`` for comparison.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'notebooks'))
+from canbus.metrics import QUIET, Metrics, peak_rss_mb  # noqa: E402
+from canbus.store import FeatureStore  # noqa: E402
+from traffic import feature_table, seconds_for, synthetic_traffic  # noqa: E402
+
+DEFAULT_SIZES = '400000,4000000,40000000,100000000'
+DEFAULT_OUTPUT = Path(__file__).resolve().parent / 'results' / 'training.json'
+
+
+def table_keys(store, size, table_frames, can_ids=40):
+    """Keys of cached synthetic tables adding up to about ``size`` frames, built on demand."""
+    frames = min(size, table_frames)
+    keys = []
+    for seed in range(max(1, round(size / frames))):
+        key = f'synthetic-{can_ids}-{frames}-{seed}'
+        if key not in store:
+            capture, labels = synthetic_traffic(can_ids, seconds_for(frames, can_ids, seed), seed=seed)
+            store.save(key, feature_table(capture, labels))
+        keys.append(key)
+    return keys, sum(store.meta(key)['rows'] for key in keys)
+
+
+def run_size(store_root, keys, max_rounds, external_memory):
+    from canbus.training import store_chunks, train_out_of_core
+
+    directory = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        _, report = train_out_of_core(store_chunks(FeatureStore(store_root), keys), Path(directory) / 'model.json',
+                                      max_rounds=max_rounds, external_memory=external_memory,
+                                      cache_dir=directory, metrics=Metrics(QUIET))
+        wall = time.perf_counter() - start
+    finally:
+        shutil.rmtree(directory)
+    return {
+        'wall_s': round(wall, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'rounds': report['rounds'],
+        'best_iteration': report['best_iteration'],
+        'test_accuracy': report['test']['accuracy'],
+        'stages': {stage['stage']: stage['wall_s'] for stage in report['stages']},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES)
+    parser.add_argument('--table-frames', type=int, default=1000000)
+    parser.add_argument('--max-rounds', type=int, default=50)
+    parser.add_argument('--in-memory', action='store_true')
+    parser.add_argument('--store', help='FeatureStore for the synthetic tables (default: a temporary one)')
+    parser.add_argument('--output', default=str(DEFAULT_OUTPUT))
+    parser.add_argument('--single', nargs='+', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        # Child process: train on the given keys, result JSON on the last line.
+        print(json.dumps(run_size(args.store, args.single, args.max_rounds, not args.in_memory)))
+        return
+
+    store_root = args.store or tempfile.mkdtemp(prefix='bench-training-')
+    store = FeatureStore(store_root)
+    runs = []
+    try:
+        for size in (int(size) for size in args.sizes.split(',')):
+            keys, frames = table_keys(store, size, args.table_frames)
+            print(f"{frames:,} frames in {len(keys)} tables", flush=True)
+            command = [sys.executable, __file__, '--store', store_root, '--max-rounds', str(args.max_rounds),
+                       '--single', *keys] + (['--in-memory'] if args.in_memory else [])
+            child = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+            if child.returncode == 0:
+                result = json.loads(child.stdout.splitlines()[-1])
+                print(f"  {result['wall_s']:9.1f} s, peak {result['peak_rss_mb']:8.1f} MB, "
+                      f"{result['rounds']} rounds (best {result['best_iteration'] + 1}), "
+                      f"test accuracy {result['test_accuracy']:.4f}", flush=True)
+            else:
+                print(f"  failed with exit code {child.returncode} (likely out of memory)")
+                result = {'error': f'exit code {child.returncode}'}
+            runs.append({'frames': frames, **result})
+    finally:
+        if not args.store:
+            shutil.rmtree(store_root, ignore_errors=True)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cpus': os.cpu_count(),
+        'external_memory': not args.in_memory,
+        'max_rounds': args.max_rounds,
+        'runs': runs,
+    }
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=1)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Startup time, latency and parity of the compiled tree evaluator.
+
+Usage: python benchmarks/bench_trees.py [--model models/xgboost_model.json] [--frames 200000]
+                                        [--batches 1,16,256,1024,4096,65536]
+
+Compiles the model with ``CompiledTrees.from_json`` and checks its
+``predict_proba`` against ``XGBClassifier.predict_proba`` on the features of
+a synthetic capture (see traffic.py). Then it measures, each in a fresh
+process, the time and peak RSS from interpreter start to the first
+prediction with the compiled ``.trees.npz`` and with xgboost, and the
+latency of both per batch size (a batch of 1 is per-frame scoring).
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / 'notebooks'))
+from canbus.features import FEATURE_COLUMNS  # noqa: E402
+from canbus.trees import CompiledTrees  # noqa: E402
+from traffic import DEFAULT_ATTACKS, feature_matrix, seconds_for, synthetic_traffic  # noqa: E402
+
+DEFAULT_MODEL = ROOT / 'models' / 'xgboost_model.json'
+PARITY_TOLERANCE = 1e-5
+# Run in a fresh interpreter: import, load the model, score one frame.
+STARTUP = {
+    'compiled': ("import sys; sys.path.insert(0, {notebooks!r})\n"
+                 "import numpy as np\n"
+                 "from canbus.trees import CompiledTrees\n"
+                 "model = CompiledTrees.load({trees!r})\n"
+                 "model.predict_proba(np.zeros((1, 8), dtype=np.float32))\n"),
+    'xgboost': ("import numpy as np\n"
+                "import xgboost as xgb\n"
+                "model = xgb.Booster(model_file={model!r})\n"
+                "model.inplace_predict(np.zeros((1, 8), dtype=np.float32))\n"),
+}
+
+
+def startup(kind, model_path, trees_file, runs=3):
+    """Best wall time and peak RSS (MiB) of a fresh process up to its first prediction."""
+    code = STARTUP[kind].format(notebooks=str(ROOT / 'notebooks'), trees=str(trees_file), model=str(model_path))
+    code += "print([line.split()[1] for line in open('/proc/self/status') if line.startswith('VmHWM')][0])\n"
+    best, peak = float('inf'), 0.0
+    for _ in range(runs):
+        start = time.perf_counter()
+        child = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, text=True, check=True)
+        best = min(best, time.perf_counter() - start)
+        peak = int(child.stdout.split()[-1]) / 1024
+    return best, peak
+
+
+def latency(predict, features, batch, budget=1.0):
+    """Median seconds per call of ``predict`` on ``batch`` rows."""
+    rows = features[:batch]
+    predict(rows)
+    times = []
+    deadline = time.perf_counter() + budget
+    while len(times) < 5 or (time.perf_counter() < deadline and len(times) < 1000):
+        start = time.perf_counter()
+        predict(rows)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', default=str(DEFAULT_MODEL))
+    parser.add_argument('--frames', type=int, default=200000)
+    parser.add_argument('--batches', default='1,16,256,1024,4096,65536')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    import xgboost as xgb
+
+    start = time.perf_counter()
+    compiled = CompiledTrees.from_json(args.model)
+    compile_time = time.perf_counter() - start
+    print(f"Compiled {len(compiled)} trees of depth <= {compiled.max_depth} in {compile_time:.2f} s "
+          f"({compiled.num_class} classes, constant trees folded into the bias)")
+    if compiled.feature_names not in (None, FEATURE_COLUMNS):
+        print(f"Warning: the model's features {compiled.feature_names} are not FEATURE_COLUMNS.")
+
+    frames, labels = synthetic_traffic(40, seconds_for(args.frames, 40, args.seed), DEFAULT_ATTACKS, args.seed)
+    features = feature_matrix(frames, labels)
+    classifier = xgb.XGBClassifier()
+    classifier.load_model(args.model)
+    expected = classifier.predict_proba(features)
+    actual = compiled.predict_proba(features)
+    error = float(np.abs(expected - actual).max())
+    agree = float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean())
+    print(f"Parity on {len(features):,} frames: max |dp| {error:.2e}, same class for {agree:.4%}")
+    assert error < PARITY_TOLERANCE, error
+
+    directory = tempfile.mkdtemp()
+    trees_file = os.path.join(directory, 'model.trees.npz')
+    try:
+        compiled.save(trees_file)
+        print(f"Compiled model {os.path.getsize(trees_file) / 1024:.0f} KiB, JSON {os.path.getsize(args.model) / 1024:.0f} KiB")
+        for kind in STARTUP:
+            seconds, peak = startup(kind, args.model, trees_file)
+            print(f"  {kind:<9} start to first prediction {seconds:6.3f} s, peak {peak:6.1f} MB")
+    finally:
+        os.remove(trees_file)
+        os.rmdir(directory)
+
+    booster = classifier.get_booster()
+    print(f"{'batch':>7} {'xgboost':>12} {'compiled':>12}   per frame")
+    for batch in (int(size) for size in args.batches.split(',') if int(size) <= len(features)):
+        native = latency(booster.inplace_predict, features, batch)
+        flat = latency(compiled.predict_proba, features, batch)
+        print(f"{batch:>7} {native * 1e3:9.3f} ms {flat * 1e3:9.3f} ms   "
+              f"{native / batch * 1e6:8.2f} us {flat / batch * 1e6:8.2f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Replay a candump log against the inference service.
+
+Usage: python benchmarks/load_generator.py [LOG] [--speed X] [--port P | --unix PATH]
+
+Start the service first (from notebooks/)::
+
+    python -m canbus.service --model ../models/xgboost_model.json
+
+Lines are sent on the schedule their timestamps give, compressed by
+``--speed`` (1 = real time, 10 = ten times faster, 0 = as fast as the
+socket takes them). At the end the generator sends ``#flush`` and
+``#stats`` and prints the service's latency and throughput counters next
+to its own send and answer rates.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+
+DEFAULT_LOG = Path(__file__).resolve().parents[1] / 'dataSet' / 'raw' / 'dos' / 'dosattack.log'
+# Lines sent per write when the schedule has fallen behind.
+MAX_BURST = 4096
+
+
+def read_schedule(path):
+    """``(timestamp, line)`` pairs of a candump log, in file order."""
+    schedule = []
+    with open(path, 'rb') as log_file:
+        for line in log_file:
+            if not line.startswith(b'('):
+                continue
+            timestamp = float(line[1:line.index(b')')])
+            schedule.append((timestamp, line if line.endswith(b'\n') else line + b'\n'))
+    return schedule
+
+
+async def read_answers(reader, counters):
+    """Count scored-frame lines until ``#flushed``, then return the stats line."""
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Service closed the connection.")
+        if line.startswith(b'#flushed'):
+            return json.loads(await reader.readline())
+        counters['answers'] += 1
+
+
+async def replay(schedule, speed, host, port, unix_path):
+    if unix_path:
+        reader, writer = await asyncio.open_unix_connection(unix_path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    counters = {'answers': 0}
+    answers = asyncio.create_task(read_answers(reader, counters))
+
+    started = time.perf_counter()
+    first = schedule[0][0] if schedule else 0.0
+    position = 0
+    while position < len(schedule):
+        if speed > 0:
+            due = first + (time.perf_counter() - started) * speed
+            end = position
+            while end < len(schedule) and end - position < MAX_BURST and schedule[end][0] <= due:
+                end += 1
+            if end == position:
+                await asyncio.sleep(min((schedule[position][0] - due) / speed, 0.01))
+                continue
+        else:
+            end = min(position + MAX_BURST, len(schedule))
+        writer.write(b''.join(line for _, line in schedule[position:end]))
+        await writer.drain()
+        position = end
+    sent = time.perf_counter() - started
+
+    writer.write(b'#flush\n#stats\n')
+    await writer.drain()
+    stats = await answers
+    writer.close()
+    elapsed = time.perf_counter() - started
+    return {
+        'frames_sent': len(schedule),
+        'answers': counters['answers'],
+        'send_seconds': round(sent, 3),
+        'total_seconds': round(elapsed, 3),
+        'send_rate_fps': round(len(schedule) / sent, 1) if sent else 0.0,
+        'answer_rate_fps': round(counters['answers'] / elapsed, 1) if elapsed else 0.0,
+        'service': stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('log', nargs='?', default=str(DEFAULT_LOG))
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed multiple (1 = real time, 0 = unthrottled)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='connect to this Unix socket instead of TCP')
+    args = parser.parse_args()
+
+    schedule = read_schedule(args.log)
+    print(f"Replaying {len(schedule)} frames from {args.log} at speed {args.speed:g}.")
+    result = asyncio.run(replay(schedule, args.speed, args.host, args.port, args.unix))
+    print(json.dumps(result, indent=1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""Synthetic candump traffic shaped by the recorded summary statistics.
+
+``synthetic_traffic`` builds a labeled capture entirely with NumPy:
+``can_ids`` periodic IDs whose periods are drawn from the
+Normal_CAN_ID_Inter_Arrival quantiles in the ``Summary_statistics.csv``
+files, plus the three attacks injected the way data_processing.ipynb does:
+
+- ``dos``: ID 000 with an all-zero payload every 0.25 ms (4 frames/ms);
+- ``fuzzing``: random payloads on one ID;
+- ``suspension``: another ID silent, its first frames after resuming labeled.
+
+``attacks`` maps each attack to the share of the capture it covers; the
+windows are placed one after another from 20% of the duration on. Labels
+follow the notebooks: 0 Normal, 1 DoS, 2 Fuzzing, 3 Suspension.
+
+``feature_matrix`` and ``feature_table`` compute the eight model features of
+such a capture, normalized by its own normal frames.
+"""
+
+import csv
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from canbus.features import FEATURE_COLUMNS, MAX_ENTROPY, MAX_PAYLOAD_DECIMAL
+from canbus.features import inter_arrivals, suspension_indicator, window_counts
+from canbus.frames import CanFrames, format_can_ids, format_payloads
+from canbus.normal_stats import NormalStats
+from canbus.payload import payload_features
+
+RAW_DIR = Path(__file__).resolve().parents[1] / 'dataSet' / 'raw'
+SUMMARY_FILES = (RAW_DIR / 'dos' / 'Summary_statistics.csv', RAW_DIR / 'suspension' / 'Summary_statistics.csv')
+START = 1508687283.0
+DEFAULT_ATTACKS = {'dos': 0.05, 'fuzzing': 0.05, 'suspension': 0.05}
+DOS_INTERVAL = 0.00025
+# Frames of the suspended ID labeled after it comes back.
+SUSPENSION_LABELED = 1.0
+# Longest period drawn; the recorded maximum (3 s) is a single outlier.
+MAX_PERIOD = 1.0
+WRITE_CHUNK = 1 << 20
+
+
+def period_quantiles(paths=SUMMARY_FILES, column='Normal_CAN_ID_Inter_Arrival'):
+    """``(probabilities, inter-arrivals)`` averaged over the summary files."""
+    points = {}
+    for path in paths:
+        with open(path, newline='') as summary:
+            for row in csv.DictReader(summary):
+                statistic, value = row[''], row.get(column)
+                if value and statistic in ('min', '25%', '50%', '75%', 'max'):
+                    points.setdefault(statistic, []).append(float(value))
+    probabilities = {'min': 0.0, '25%': 0.25, '50%': 0.5, '75%': 0.75, 'max': 1.0}
+    names = [name for name in probabilities if name in points]
+    return (np.array([probabilities[name] for name in names]),
+            np.array([np.mean(points[name]) for name in names]))
+
+
+def draw_periods(can_ids, rng, quantiles=None):
+    """Per-ID periods following the recorded inter-arrival quantiles.
+
+    Periods are interpolated between the quantiles in log space, capped at
+    ``MAX_PERIOD`` and rounded to whole milliseconds like ECU schedules.
+    """
+    probabilities, values = period_quantiles() if quantiles is None else quantiles
+    periods = np.exp(np.interp(rng.random(can_ids), probabilities, np.log(values)))
+    return np.clip(np.round(periods, 3), 0.001, MAX_PERIOD)
+
+
+def frames_per_second(can_ids, seed=0, attacks=DEFAULT_ATTACKS):
+    """Mean frame rate of ``synthetic_traffic`` with these parameters."""
+    periods = draw_periods(can_ids, np.random.default_rng(seed))
+    return float((1 / periods).sum()) + attacks.get('dos', 0.0) / DOS_INTERVAL
+
+
+def seconds_for(frames, can_ids, seed=0, attacks=DEFAULT_ATTACKS):
+    """Capture duration giving roughly ``frames`` frames."""
+    return frames / frames_per_second(can_ids, seed, attacks)
+
+
+def synthetic_traffic(can_ids=40, seconds=60.0, attacks=DEFAULT_ATTACKS, seed=0):
+    """Time-ordered ``CanFrames`` and their int8 labels."""
+    rng = np.random.default_rng(seed)
+    periods = draw_periods(can_ids, rng)
+    # Standard 11-bit IDs spread over the range, skipping 000 (the DoS ID).
+    ids = np.sort(rng.choice(np.arange(1, 0x800, dtype=np.uint32), can_ids, replace=False))
+    dlcs = rng.choice(np.array([2, 4, 6, 8, 8, 8], dtype=np.uint8), can_ids)
+
+    counts = np.ceil(seconds / periods).astype(np.int64)
+    owner = np.repeat(np.arange(can_ids), counts)
+    index = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+    jitter = 1 + rng.uniform(-0.02, 0.02, len(owner))
+    timestamps = START + rng.random(can_ids)[owner] * periods[owner] + index * periods[owner] * jitter
+    keep = timestamps < START + seconds
+    owner, index, timestamps = owner[keep], index[keep], timestamps[keep]
+    can_id = ids[owner]
+    dlc = dlcs[owner]
+    # A rolling counter in the first byte and low-entropy signal bytes.
+    payload = (index.astype(np.uint64) & np.uint64(0xFF)) << np.uint64(56)
+    payload |= rng.integers(0, 4, len(owner), dtype=np.uint64) * np.uint64(0x0001000100010001)
+    payload >>= np.uint64(8) * (np.uint64(8) - dlc.astype(np.uint64))
+    labels = np.zeros(len(owner), dtype=np.int8)
+
+    by_rate = np.argsort(periods, kind='stable')
+    fuzzed = ids[by_rate[0]]
+    suspended_id = ids[by_rate[min(1, can_ids - 1)]]
+    window = START + 0.2 * seconds
+    extra = []
+    for attack, share in attacks.items():
+        start, end = window, window + share * seconds
+        window = end
+        if attack == 'dos':
+            dos_times = np.arange(start, end, DOS_INTERVAL)
+            keep = (timestamps < start) | (timestamps >= end)
+            timestamps, can_id, payload, dlc, labels = (
+                column[keep] for column in (timestamps, can_id, payload, dlc, labels))
+            extra.append((dos_times, np.zeros(len(dos_times), dtype=np.uint32), np.zeros(len(dos_times), dtype=np.uint64),
+                          np.full(len(dos_times), 8, dtype=np.uint8), np.full(len(dos_times), 1, dtype=np.int8)))
+        elif attack == 'fuzzing':
+            target = (can_id == fuzzed) & (timestamps >= start) & (timestamps < end)
+            dlc[target] = 8
+            payload[target] = rng.integers(0, 2**64, int(target.sum()), dtype=np.uint64, endpoint=False)
+            labels[target] = 2
+        elif attack == 'suspension':
+            keep = ~((can_id == suspended_id) & (timestamps >= start) & (timestamps < end))
+            timestamps, can_id, payload, dlc, labels = (
+                column[keep] for column in (timestamps, can_id, payload, dlc, labels))
+            resumed = (can_id == suspended_id) & (timestamps >= end) & (timestamps < end + SUSPENSION_LABELED)
+            labels[resumed] = 3
+        else:
+            raise ValueError(f"Unknown attack {attack!r}; expected dos, fuzzing or suspension.")
+
+    columns = [timestamps, can_id, payload, dlc, labels]
+    for block in extra:
+        columns = [np.concatenate([column, part]) for column, part in zip(columns, block)]
+    order = np.argsort(columns[0], kind='stable')
+    timestamps, can_id, payload, dlc, labels = (column[order] for column in columns)
+    frames = CanFrames(np.round(timestamps, 6), can_id, payload, dlc, np.zeros(len(order), dtype=np.uint8), ['slcan0'])
+    return frames, labels
+
+
+def write_candump(path, frames, chunk=WRITE_CHUNK):
+    """Write frames as candump lines, ``chunk`` frames at a time."""
+    with open(path, 'w') as log_file:
+        for start in range(0, len(frames), chunk):
+            part = frames.take(slice(start, start + chunk))
+            lines = [
+                f'({timestamp:.6f}) {interface} {can_id}#{payload}\n'
+                for timestamp, interface, can_id, payload in zip(
+                    part.timestamp.tolist(), part.interface_strings().tolist(),
+                    format_can_ids(part.can_id).tolist(), format_payloads(part.payload, part.dlc).tolist())
+            ]
+            log_file.write(''.join(lines))
+
+
+def feature_matrix(frames, labels):
+    """The eight model features of a capture, normalized by its normal frames."""
+    timestamps, ids = frames.timestamp, frames.can_id
+    gaps = inter_arrivals(timestamps, ids)
+    counts = window_counts(timestamps, ids, (5.0,))[5.0]
+    entropy, decimal = payload_features(frames.payload, frames.dlc)
+    normal = labels == 0
+    codes_ids, codes = np.unique(ids[normal], return_inverse=True)
+    per_id = np.bincount(codes)
+    stats = NormalStats(codes_ids, np.bincount(codes, gaps[normal]) / per_id, np.bincount(codes, counts[normal]) / per_id)
+    norm_gaps, norm_counts = stats.normalize(ids, gaps, counts)
+    columns = (gaps, counts, entropy, norm_gaps, norm_counts, entropy / MAX_ENTROPY,
+               decimal.astype(np.float64) / float(MAX_PAYLOAD_DECIMAL), suspension_indicator(timestamps, ids, gaps))
+    return np.column_stack(columns).astype(np.float32)
+
+
+def feature_table(frames, labels):
+    """``feature_matrix`` as the labeled table data_processing.ipynb caches."""
+    table = pd.DataFrame(feature_matrix(frames, labels), columns=FEATURE_COLUMNS)
+    table.insert(0, 'CAN_ID', frames.can_id)
+    table['Label'] = labels
+    return table
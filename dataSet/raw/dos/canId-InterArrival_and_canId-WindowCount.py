@@ -3,6 +3,10 @@ from pathlib import Path
 import sys
 import os
 
+# The shared parser lives next to the notebooks.
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / 'notebooks'))
+from canbus import parse_can_log, window_counts  # noqa: E402
+
 def convert_can_log_to_csv(input_file_path, output_file_path):
     # Verify input file exists
     if not Path(input_file_path).is_file():
@@ -17,51 +21,34 @@ def convert_can_log_to_csv(input_file_path, output_file_path):
         print(f"Error creating output directory '{output_dir}': {e}")
         return
 
-    # First pass: Read messages, collect timestamps, and compute windows
-    messages = []
-    can_id_timestamps = {}  # Store timestamps for each CAN ID
-    window_counts = {}      # Store message counts per CAN ID per window
+    # First pass: Parse the log, collect timestamps, and count windows
     try:
-        with open(input_file_path, 'r', encoding='utf-8') as log_file:
-            for line in log_file:
-                line = line.strip()
-                if not line or not line.startswith('('):
-                    continue
-                try:
-                    timestamp_end = line.find(')')
-                    timestamp = line[1:timestamp_end]
-                    remaining = line[timestamp_end+1:].strip()
-                    parts = remaining.split(maxsplit=1)
-                    if len(parts) == 2:
-                        interface = parts[0]
-                        can_data = parts[1]
-                        if '#' in can_data:
-                            can_id, payload = can_data.split('#', 1)
-                            timestamp_float = float(timestamp)
-                            messages.append({
-                                'timestamp': timestamp_float,
-                                'interface': interface,
-                                'can_id': can_id,
-                                'payload': payload
-                            })
-                            # Store timestamp for CAN ID
-                            if can_id not in can_id_timestamps:
-                                can_id_timestamps[can_id] = []
-                            can_id_timestamps[can_id].append(timestamp_float)
-                            # Compute window and update counts
-                            window = int(timestamp_float // 10)
-                            if can_id not in window_counts:
-                                window_counts[can_id] = {}
-                            window_counts[can_id][window] = window_counts[can_id].get(window, 0) + 1
-                except:
-                    continue
+        parsed = parse_can_log(input_file_path)
     except Exception as e:
         print(f"Error reading input file: {e}")
         return
+    if parsed.skipped:
+        print(f"Skipped {parsed.skipped} malformed lines out of {parsed.lines}.")
 
-    if not messages:
+    frames = parsed.frames
+    if len(frames) == 0:
         print("No valid messages found in the log file.")
         return
+    # Plain Python lists: the loops below walk them row by row.
+    frame_timestamps = frames.timestamp.tolist()
+    frame_interfaces = frames.interface_strings().tolist()
+    frame_can_ids = frames.can_id_strings().tolist()
+    frame_payloads = frames.payload_strings().tolist()
+
+    # Messages per CAN ID in fixed 10 s windows, one count per frame
+    frame_window_counts = window_counts(frames.timestamp, frames.can_id, (10.0,), tumbling=True)[10.0].tolist()
+
+    can_id_timestamps = {}  # Store timestamps for each CAN ID
+    for timestamp_float, can_id in zip(frame_timestamps, frame_can_ids):
+        # Store timestamp for CAN ID
+        if can_id not in can_id_timestamps:
+            can_id_timestamps[can_id] = []
+        can_id_timestamps[can_id].append(timestamp_float)
 
     # Compute CAN_ID_Inter_Arrival and mean per CAN ID
     can_id_inter_arrivals = {}
@@ -117,13 +104,8 @@ def convert_can_log_to_csv(input_file_path, output_file_path):
 
             # Track index for each CAN ID
             can_id_indices = {can_id: 0 for can_id in can_id_timestamps}
-            for msg in messages:
-                timestamp = msg['timestamp']
-                interface = msg['interface']
-                can_id = msg['can_id']
-                payload = msg['payload']
-                window = int(timestamp // 10)
-
+            rows = zip(frame_timestamps, frame_interfaces, frame_can_ids, frame_payloads, frame_window_counts)
+            for timestamp, interface, can_id, payload, window_count in rows:
                 # CAN_ID_Inter_Arrival
                 try:
                     current_index = can_id_indices[can_id]
@@ -132,9 +114,6 @@ def convert_can_log_to_csv(input_file_path, output_file_path):
                 except (KeyError, IndexError):
                     can_id_inter_arrival = can_id_means.get(can_id, dataset_mean)
 
-                # CAN_ID_Window_Count
-                window_count = window_counts.get(can_id, {}).get(window, 1)
-
                 writer.writerow([
                     timestamp,              # Float, no quotes
                     f'="{interface}"',     # Quoted string
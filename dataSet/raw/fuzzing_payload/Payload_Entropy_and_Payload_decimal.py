@@ -2,26 +2,14 @@ import csv
 from pathlib import Path
 import sys
 import os
-import numpy as np
-from scipy.stats import entropy
 
-def calc_entropy(payload):
-    if not payload:
-        return 0.0
-    try:
-        bytes_list = [int(payload[i:i+2], 16) for i in range(0, len(payload), 2)]
-        value_counts = np.bincount(bytes_list, minlength=256)
-        return entropy(value_counts[value_counts > 0])
-    except ValueError:
-        return 0.0
-
-def payload_to_decimal(payload):
-    try:
-        return int(payload, 16)
-    except ValueError:
-        return 0
+# The shared parser lives next to the notebooks.
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / 'notebooks'))
+from canbus import parse_can_log, payload_features  # noqa: E402
 
-def convert_can_log_to_csv(input_file_path, output_file_path):
+def convert_can_log_to_csv(input_file_path, output_file_path, entropy_base=2):
+    # Entropy is in bits like the training features; CSVs written before
+    # used nats (pass entropy_base=math.e to reproduce them).
     # Verify input file exists
     if not Path(input_file_path).is_file():
         print(f"Error: Input file '{input_file_path}' does not exist.")
@@ -35,40 +23,28 @@ def convert_can_log_to_csv(input_file_path, output_file_path):
         print(f"Error creating output directory '{output_dir}': {e}")
         return
 
-    # First pass: Read messages
-    messages = []
+    # First pass: Parse the log
     try:
-        with open(input_file_path, 'r', encoding='utf-8') as log_file:
-            for line in log_file:
-                line = line.strip()
-                if not line or not line.startswith('('):
-                    continue
-                try:
-                    timestamp_end = line.find(')')
-                    timestamp = line[1:timestamp_end]
-                    remaining = line[timestamp_end+1:].strip()
-                    parts = remaining.split(maxsplit=1)
-                    if len(parts) == 2:
-                        interface = parts[0]
-                        can_data = parts[1]
-                        if '#' in can_data:
-                            can_id, payload = can_data.split('#', 1)
-                            timestamp_float = float(timestamp)
-                            messages.append({
-                                'timestamp': timestamp_float,
-                                'interface': interface,
-                                'can_id': can_id,
-                                'payload': payload
-                            })
-                except:
-                    continue
+        parsed = parse_can_log(input_file_path)
     except Exception as e:
         print(f"Error reading input file: {e}")
         return
+    if parsed.skipped:
+        print(f"Skipped {parsed.skipped} malformed lines out of {parsed.lines}.")
 
-    if not messages:
+    frames = parsed.frames
+    if len(frames) == 0:
         print("No valid messages found in the log file.")
         return
+    # Plain Python lists: the loops below walk them row by row.
+    frame_timestamps = frames.timestamp.tolist()
+    frame_interfaces = frames.interface_strings().tolist()
+    frame_can_ids = frames.can_id_strings().tolist()
+    frame_payloads = frames.payload_strings().tolist()
+    # Computed for all frames at once, each distinct payload only once.
+    entropies, decimals = payload_features(frames.payload, frames.dlc, entropy_base)
+    frame_entropies = entropies.tolist()
+    frame_decimals = decimals.tolist()
 
     # Second pass: Write to CSV with Payload_Entropy and Payload_Decimal
     try:
@@ -93,19 +69,11 @@ def convert_can_log_to_csv(input_file_path, output_file_path):
                 'Payload_Entropy', 'Payload_Decimal'
             ])
 
-            for msg in messages:
-                timestamp = msg['timestamp']
-                interface = msg['interface']
-                can_id = msg['can_id']
-                payload = msg['payload']
-                
-                # Compute Payload_Entropy
-                payload_entropy = calc_entropy(payload)
+            for timestamp, interface, can_id, payload, payload_entropy, payload_decimal in zip(
+                frame_timestamps, frame_interfaces, frame_can_ids, frame_payloads, frame_entropies, frame_decimals
+            ):
                 payload_entropy = f"{payload_entropy:.5f}"  # Format to 5 decimal places
-                
-                # Compute Payload_Decimal
-                payload_decimal = payload_to_decimal(payload)
-                
+
                 writer.writerow([
                     timestamp,                        # Float, no quotes
                     f'"""{interface}"""',            # Triple-quoted string
@@ -3,7 +3,17 @@ from pathlib import Path
 import sys
 import os
 
-def convert_can_log_to_csv(input_file_path, output_file_path):
+import numpy as np
+
+# The shared parser lives next to the notebooks.
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / 'notebooks'))
+from canbus import parse_can_log  # noqa: E402
+from canbus.features import inter_arrivals  # noqa: E402
+from canbus.frames import format_can_ids  # noqa: E402
+from canbus.metrics import DETAIL, Metrics  # noqa: E402
+
+def convert_can_log_to_csv(input_file_path, output_file_path, metrics=None):
+    metrics = Metrics() if metrics is None else metrics
     # Verify input file exists
     if not Path(input_file_path).is_file():
         print(f"Error: Input file '{input_file_path}' does not exist.")
@@ -17,80 +27,56 @@ def convert_can_log_to_csv(input_file_path, output_file_path):
         print(f"Error creating output directory '{output_dir}': {e}")
         return
 
-    # First pass: Read messages and collect timestamps per CAN_ID
-    messages = []
-    can_id_timestamps = {}  # Store timestamps for each CAN ID
+    # First pass: Parse the log and collect timestamps per CAN_ID
     try:
-        with open(input_file_path, 'r', encoding='utf-8') as log_file:
-            for line in log_file:
-                line = line.strip()
-                if not line or not line.startswith('('):
-                    continue
-                try:
-                    timestamp_end = line.find(')')
-                    timestamp = line[1:timestamp_end]
-                    remaining = line[timestamp_end+1:].strip()
-                    parts = remaining.split(maxsplit=1)
-                    if len(parts) == 2:
-                        interface = parts[0]
-                        can_data = parts[1]
-                        if '#' in can_data:
-                            can_id, payload = can_data.split('#', 1)
-                            timestamp_float = float(timestamp)
-                            messages.append({
-                                'timestamp': timestamp_float,
-                                'interface': interface,
-                                'can_id': can_id,
-                                'payload': payload
-                            })
-                            # Store timestamp for CAN ID
-                            if can_id not in can_id_timestamps:
-                                can_id_timestamps[can_id] = []
-                            can_id_timestamps[can_id].append(timestamp_float)
-                except:
-                    continue
+        with metrics.stage('parse') as stage:
+            parsed = parse_can_log(input_file_path)
+            stage['frames'], stage['dropped'] = len(parsed.frames), parsed.skipped
     except Exception as e:
         print(f"Error reading input file: {e}")
         return
+    if parsed.skipped:
+        print(f"Skipped {parsed.skipped} malformed lines out of {parsed.lines}.")
 
-    if not messages:
+    frames = parsed.frames
+    if len(frames) == 0:
         print("No valid messages found in the log file.")
         return
+    # Plain Python lists: the CSV loop below walks them row by row.
+    frame_timestamps = frames.timestamp.tolist()
+    frame_interfaces = frames.interface_strings().tolist()
+    frame_can_ids = frames.can_id_strings().tolist()
+    frame_payloads = frames.payload_strings().tolist()
 
-    # Compute CAN_ID_Inter_Arrival per CAN_ID
-    can_id_inter_arrivals = {}
-    max_inter_arrivals = {}
-    large_gap_count = 0
+    # Compute CAN_ID_Inter_Arrival per CAN_ID in log order (candump writes
+    # frames in time order); the first message of each ID gets 0.00001
+    # seconds (10 µs). Frames and large gaps are counted per CAN_ID with
+    # one bincount each instead of per frame
     max_expected_gap = 5.0  # 5 seconds to detect suspension attack
-    for can_id, timestamps in can_id_timestamps.items():
-        timestamps = sorted(timestamps)
-        inter_arrivals = []
-        for i in range(len(timestamps)):
-            if i == 0:
-                # First message: Use default (0.00001 seconds or 10 µs)
-                inter_arrivals.append(0.00001)
-                print(f"Debug: CAN_ID={can_id}, Index={i}, Timestamp={timestamps[i]}, First message, Inter_Arrival=0.00001")
-            else:
-                # Difference to previous message
-                diff = timestamps[i] - timestamps[i-1]
-                inter_arrivals.append(diff)
-                if diff > max_expected_gap:
-                    large_gap_count += 1
-                    print(f"Warning: Large gap for CAN_ID={can_id}, Index={i}, Timestamp={timestamps[i]}, Prev_Timestamp={timestamps[i-1]}, Inter_Arrival={diff:.5f}")
-                print(f"Debug: CAN_ID={can_id}, Index={i}, Timestamp={timestamps[i]}, Prev_Timestamp={timestamps[i-1]}, Inter_Arrival={diff:.5f}")
-        can_id_inter_arrivals[can_id] = inter_arrivals
-        max_inter_arrivals[can_id] = max(inter_arrivals) if inter_arrivals else 0.00001
-
-    # Print summary of max_inter_arrival per CAN_ID
-    print("\nSummary of Maximum CAN_ID_Inter_Arrival per CAN_ID:")
-    for can_id, max_inter in max_inter_arrivals.items():
+    with metrics.stage('inter_arrival', frames=len(frames)):
+        frame_inter_arrivals = inter_arrivals(frames.timestamp, frames.can_id, first=0.00001)
+        ids, codes = np.unique(frames.can_id, return_inverse=True)
+        codes = codes.reshape(-1)
+        frame_counts = np.bincount(codes, minlength=len(ids))
+        gap_counts = np.bincount(codes[frame_inter_arrivals > max_expected_gap], minlength=len(ids))
+        max_inter_arrivals = np.full(len(ids), -np.inf)
+        np.maximum.at(max_inter_arrivals, codes, frame_inter_arrivals)
+    id_strings = format_can_ids(ids).tolist()
+    for can_id, count, gaps in zip(id_strings, frame_counts.tolist(), gap_counts.tolist()):
+        metrics.count('frames', count, can_id=can_id)
+        metrics.count('large_gaps', gaps, can_id=can_id)
+
+    # Summary of max_inter_arrival per CAN_ID (all IDs at DETAIL verbosity)
+    metrics.log("Summary of Maximum CAN_ID_Inter_Arrival per CAN_ID:")
+    for can_id, max_inter, gaps in zip(id_strings, max_inter_arrivals.tolist(), gap_counts.tolist()):
         if max_inter > max_expected_gap:
-            print(f"⚠️ CAN_ID={can_id}: max_inter_arrival={max_inter:.5f}s (Possible suspension attack)")
+            metrics.log(f"⚠️ CAN_ID={can_id}: max_inter_arrival={max_inter:.5f}s, {gaps} gaps over {max_expected_gap}s (Possible suspension attack)")
         else:
-            print(f"CAN_ID={can_id}: max_inter_arrival={max_inter:.5f}s")
+            metrics.log(f"CAN_ID={can_id}: max_inter_arrival={max_inter:.5f}s", DETAIL)
 
+    large_gap_count = int(gap_counts.sum())
     if large_gap_count > 0:
-        print(f"Warning: Found {large_gap_count} inter-arrival times larger than {max_expected_gap}s. Likely indicates a suspension attack.")
+        metrics.log(f"Warning: Found {large_gap_count} inter-arrival times larger than {max_expected_gap}s. Likely indicates a suspension attack.")
 
     # Second pass: Write to CSV
     try:
@@ -108,23 +94,15 @@ def convert_can_log_to_csv(input_file_path, output_file_path):
                 print("- Check file permissions (Properties > Security).")
                 print("- Use the alternative output path (e.g., 'C:\\Temp').")
 
-        with open(output_file_path, 'w', newline='', encoding='utf-8') as csv_file:
+        with metrics.stage('write_csv', frames=len(frames)), \
+                open(output_file_path, 'w', newline='', encoding='utf-8') as csv_file:
             writer = csv.writer(csv_file, quoting=csv.QUOTE_MINIMAL, escapechar='\\')
             writer.writerow([
                 'Timestamp', 'Interface', 'CAN_ID', 'Payload', 'CAN_ID_Inter_Arrival'
             ])
 
-            # Track index for each CAN_ID
-            can_id_indices = {can_id: 0 for can_id in can_id_timestamps}
-            for msg in messages:
-                timestamp = msg['timestamp']
-                interface = msg['interface']
-                can_id = msg['can_id']
-                payload = msg['payload']
-                # Get CAN_ID_Inter_Arrival
-                current_index = can_id_indices[can_id]
-                can_id_inter_arrival = can_id_inter_arrivals[can_id][current_index]
-                can_id_indices[can_id] += 1
+            for timestamp, interface, can_id, payload, can_id_inter_arrival in zip(
+                    frame_timestamps, frame_interfaces, frame_can_ids, frame_payloads, frame_inter_arrivals.tolist()):
                 # Format to 5 decimal places
                 can_id_inter_arrival = f"{can_id_inter_arrival:.5f}"
 
@@ -160,7 +138,11 @@ def main():
     input_file_path = r"C:\Users\pc\OneDrive\Images\Bureau\VS_code_Projects\MLproject_Predictive_Maintenance_for_Vehicles_Using_CAN_Bus_Data\dataSet\raw\suspension\full_data_capture.log"
     output_file_path = r"C:\Users\pc\OneDrive\Images\Bureau\VS_code_Projects\MLproject_Predictive_Maintenance_for_Vehicles_Using_CAN_Bus_Data\dataSet\raw\suspension\normal_can_id_inter_arrival.csv"
     
-    convert_can_log_to_csv(input_file_path, output_file_path)
+    metrics_path = Path(output_file_path).with_suffix('.metrics.json')
+
+    metrics = Metrics()
+    convert_can_log_to_csv(input_file_path, output_file_path, metrics)
+    metrics.write(metrics_path)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""Shared CAN bus log parsing and feature extraction helpers.
+
+The notebooks and the per-attack scripts under ``dataSet/raw`` import from
+this package instead of keeping their own copies of the parsing code.
+"""
+
+from .features import (
+    FEATURE_COLUMNS,
+    compute_features,
+    compute_suspension_indicator,
+    compute_window_count,
+    suspension_indicator,
+    window_counts,
+)
+from .frames import (
+    CAN_EFF_FLAG,
+    CAN_EFF_MASK,
+    FRAME_COLUMNS,
+    CanFrames,
+    format_frame_table,
+    parse_can_id,
+    parse_can_ids,
+)
+from .injection import (
+    DEFAULT_SCENARIOS,
+    AttackScenario,
+    frames_digest,
+    inject_attacks,
+    labeled_features,
+    parallel_variants,
+    random_scenarios,
+    variant_key,
+)
+from .metrics import Metrics
+from .normal_stats import NormalStats, normal_stats_path, normalize_features
+from .parser import parse_can_bytes, parse_can_log
+from .payload import (
+    decode_hex_payloads,
+    payload_entropy,
+    payload_entropy_array,
+    payload_features,
+    payload_matrix,
+)
+from .sharding import parallel_features, parallel_features_for_logs, shard_ranges
+from .store import (
+    DEFAULT_FEATURE_PARAMS,
+    FeatureStore,
+    cached_features,
+    feature_key,
+    source_digest,
+)
+from .streaming import StreamingFeatureExtractor
+
+__all__ = [
+    'AttackScenario',
+    'CAN_EFF_FLAG',
+    'CAN_EFF_MASK',
+    'CanFrames',
+    'DEFAULT_FEATURE_PARAMS',
+    'DEFAULT_SCENARIOS',
+    'FEATURE_COLUMNS',
+    'FRAME_COLUMNS',
+    'FeatureStore',
+    'Metrics',
+    'NormalStats',
+    'StreamingFeatureExtractor',
+    'cached_features',
+    'compute_features',
+    'compute_suspension_indicator',
+    'compute_window_count',
+    'decode_hex_payloads',
+    'feature_key',
+    'format_frame_table',
+    'frames_digest',
+    'inject_attacks',
+    'labeled_features',
+    'normal_stats_path',
+    'normalize_features',
+    'parallel_features',
+    'parallel_features_for_logs',
+    'parallel_variants',
+    'parse_can_bytes',
+    'parse_can_id',
+    'parse_can_ids',
+    'parse_can_log',
+    'payload_entropy',
+    'payload_entropy_array',
+    'payload_features',
+    'payload_matrix',
+    'random_scenarios',
+    'shard_ranges',
+    'source_digest',
+    'suspension_indicator',
+    'variant_key',
+    'window_counts',
+]
@@ -0,0 +1,292 @@
+"""Window-level scoring: one summary row per CAN ID and time window.
+
+The per-frame model scores every frame on its own, although
+``CAN_ID_Window_Count`` and ``Suspension_Indicator`` already describe
+windows; during a DoS flood of 4 frames/ms on ID 000 it spends most of its
+time on near-identical rows. ``window_features`` instead cuts a normalized
+feature table into tumbling windows of ``window`` seconds and summarizes
+each CAN ID in each window as one row of ``WINDOW_FEATURES``:
+
+- the frame count and the min, mean and max inter-arrival;
+- the mean normalized inter-arrival and window count;
+- the min, mean and max payload entropy;
+- the share of frames whose payload differs from the previous frame of
+  the same ID, and the largest ``Suspension_Indicator``.
+
+A separate model (``train_window_model``, the training module's
+parameters, split hash and class weights) scores these rows. The row of
+every frame is returned with them, so ``verdicts[frame_windows]`` gives
+per-frame labels only when they are needed.
+
+A window is labeled with an attack once attack frames make up at least
+``ATTACK_SHARE`` of it (see ``window_labels``), and the class weights are
+taken from these window labels. Fuzzing and suspension still yield few
+windows: one fuzzed ID over a few seconds, or the second after a
+suspended ID resumes, is a handful of rows per capture against thousands
+of normal ones. Train on many captures before relying on window mode for
+those classes; ``benchmarks/bench_aggregate.py`` reports recall per class.
+From the notebooks directory::
+
+    python -m canbus.aggregate --store-key generated-... --model ../models/window_model.json
+    python -m canbus.aggregate --log ../dataSet/raw/dos/dosattack.log --model ../models/window_model.json \\
+        --output ../dataSet/dos_windows.csv --frames ../dataSet/dos_frame_predictions.csv
+
+``train_window_model`` saves ``normal_stats.npz`` next to the model, from
+the normal frames of its tables merged as ``train_out_of_core`` does;
+scoring reads it back, like the per-frame model does.
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from .features import compute_features, frame_payloads
+from .frames import format_can_ids, format_frame_table, parse_can_ids
+from .metrics import DETAIL, SUMMARY, Metrics
+from .baseline import TrafficStats, merge_stats
+from .normal_stats import normal_stats_path, normalize_features
+from .parser import parse_can_log
+from .service import load_model
+from .store import FeatureStore
+from .training import (
+    DEFAULT_PARAMS,
+    EARLY_STOPPING_ROUNDS,
+    LABEL_NAMES,
+    MAX_ROUNDS,
+    TEST,
+    TRAIN,
+    VALIDATION,
+    _scores,
+    class_weights,
+    split_rows,
+)
+from .trees import CompiledTrees, trees_path
+
+WINDOW_SECONDS = 1.0
+# Share of attack frames from which a window counts as an attack window.
+ATTACK_SHARE = 0.25
+WINDOW_FEATURES = [
+    'Frame_Count', 'Min_Inter_Arrival', 'Mean_Inter_Arrival', 'Max_Inter_Arrival',
+    'Mean_Norm_Inter_Arrival', 'Mean_Norm_Window_Count',
+    'Min_Payload_Entropy', 'Mean_Payload_Entropy', 'Max_Payload_Entropy',
+    'Payload_Change_Rate', 'Max_Suspension_Indicator',
+]
+REPORT_FILENAME = 'window_training_report.json'
+
+
+def window_features(df, window=WINDOW_SECONDS):
+    """``(summaries, frame_windows)`` of a time-ordered, normalized feature table.
+
+    ``summaries`` has ``CAN_ID``, ``Window_Start`` and ``WINDOW_FEATURES``,
+    one row per CAN ID and window in time order; ``frame_windows`` is
+    the summary row of each frame of ``df``.
+    """
+    timestamps = df['Timestamp'].to_numpy(np.float64)
+    can_ids = parse_can_ids(df['CAN_ID'].to_numpy())
+    if len(df) == 0:
+        columns = {'CAN_ID': np.empty(0, np.uint32), 'Window_Start': np.empty(0)}
+        return pd.DataFrame({**columns, **{name: np.empty(0) for name in WINDOW_FEATURES}}), np.empty(0, np.int64)
+    slots = np.floor(timestamps / window).astype(np.int64)
+    first = int(slots.min())
+    keys = ((slots - first).astype(np.uint64) << np.uint64(32)) | can_ids.astype(np.uint64)
+    keys, frame_windows = np.unique(keys, return_inverse=True)
+    frame_windows = frame_windows.reshape(-1)
+    order = np.argsort(frame_windows, kind='stable')
+    starts = np.flatnonzero(np.r_[True, np.diff(frame_windows[order]) != 0])
+    count = np.bincount(frame_windows, minlength=len(keys))
+
+    def mean(column):
+        return np.bincount(frame_windows, df[column].to_numpy(np.float64), minlength=len(keys)) / count
+
+    def reduce(function, column):
+        return function.reduceat(df[column].to_numpy(np.float64)[order], starts)
+
+    # A frame changed its payload when it differs from the previous frame of its ID.
+    payloads, dlcs = frame_payloads(df)
+    by_id = np.argsort(can_ids, kind='stable')
+    changed = np.zeros(len(df), dtype=np.float64)
+    changed[by_id[1:]] = ((can_ids[by_id[1:]] == can_ids[by_id[:-1]])
+                          & ((payloads[by_id[1:]] != payloads[by_id[:-1]]) | (dlcs[by_id[1:]] != dlcs[by_id[:-1]])))
+    summaries = pd.DataFrame({
+        'CAN_ID': (keys & np.uint64(0xFFFFFFFF)).astype(np.uint32),
+        'Window_Start': ((keys >> np.uint64(32)).astype(np.int64) + first) * window,
+        'Frame_Count': count.astype(np.float64),
+        'Min_Inter_Arrival': reduce(np.minimum, 'CAN_ID_Inter_Arrival'),
+        'Mean_Inter_Arrival': mean('CAN_ID_Inter_Arrival'),
+        'Max_Inter_Arrival': reduce(np.maximum, 'CAN_ID_Inter_Arrival'),
+        'Mean_Norm_Inter_Arrival': mean('Norm_Inter_Arrival'),
+        'Mean_Norm_Window_Count': mean('Norm_Window_Count'),
+        'Min_Payload_Entropy': reduce(np.minimum, 'Payload_Entropy'),
+        'Mean_Payload_Entropy': mean('Payload_Entropy'),
+        'Max_Payload_Entropy': reduce(np.maximum, 'Payload_Entropy'),
+        'Payload_Change_Rate': np.bincount(frame_windows, changed, minlength=len(keys)) / count,
+        'Max_Suspension_Indicator': reduce(np.maximum, 'Suspension_Indicator'),
+    })
+    return summaries, frame_windows
+
+
+def window_label_counts(labels, frame_windows, windows, num_class=len(LABEL_NAMES)):
+    """``(windows, num_class)`` frames of each label per window (see ``window_labels``)."""
+    cells = frame_windows * num_class + np.asarray(labels, dtype=np.int64)
+    return np.bincount(cells, minlength=windows * num_class).reshape(windows, num_class)
+
+
+def window_labels(frame_counts, attack_share=ATTACK_SHARE):
+    """Label of every window from its ``window_label_counts``.
+
+    A window whose attack frames (any label but 0) reach ``attack_share``
+    of its frames takes the attack label with the most frames, otherwise
+    Normal. A plain majority would drop attacks that cover part of a window.
+    """
+    attacks = frame_counts[:, 1:]
+    attack_frames = attacks.sum(axis=1)
+    is_attack = (attack_frames > 0) & (attack_frames >= attack_share * frame_counts.sum(axis=1))
+    return np.where(is_attack, attacks.argmax(axis=1) + 1, 0)
+
+
+def score_windows(booster, summaries):
+    """Predicted label of every summary row (xgboost booster or ``CompiledTrees``)."""
+    if len(summaries) == 0:
+        return np.empty(0, dtype=np.int64)
+    return booster.inplace_predict(summaries[WINDOW_FEATURES].to_numpy(dtype=np.float32)).argmax(axis=1)
+
+
+def labeled_windows(tables, window=WINDOW_SECONDS):
+    """``(summaries, frame_counts, traffic_stats)`` of labeled feature tables.
+
+    Summaries and per-label frame counts are concatenated over the tables;
+    ``traffic_stats`` are the merged ``TrafficStats`` of their normal frames.
+    """
+    parts, counts, stats = [], [], []
+    for df in tables:
+        summaries, frame_windows = window_features(df, window)
+        parts.append(summaries)
+        counts.append(window_label_counts(df['Label'].to_numpy(), frame_windows, len(summaries)))
+        stats.append(TrafficStats.from_features(df, label=0))
+    return pd.concat(parts, ignore_index=True), np.concatenate(counts), merge_stats(stats)
+
+
+def train_window_model(tables, model_path, window=WINDOW_SECONDS, params=None, max_rounds=MAX_ROUNDS,
+                       early_stopping_rounds=EARLY_STOPPING_ROUNDS, seed=0, attack_share=ATTACK_SHARE,
+                       metrics=None, report_path=None):
+    """Train the window model on labeled, normalized feature tables (DataFrames).
+
+    The tables should be normalized by the merged statistics of their
+    normal frames, the ``NormalStats`` saved next to the model.
+    Windows are labeled by ``window_labels``, split 70/15/15 by
+    ``training.split_rows`` and weighted by ``class_weights`` of the
+    window labels; boosting stops on the validation ``mlogloss``. The
+    report holds test scores per window and per frame (every frame taking
+    its window's verdict). Returns the booster and the report dict.
+    """
+    metrics = Metrics() if metrics is None else metrics
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    params.setdefault('nthread', os.cpu_count() or 1)
+    num_class = int(params['num_class'])
+    model_path = Path(model_path)
+    report_path = model_path.with_name(REPORT_FILENAME) if report_path is None else Path(report_path)
+
+    with metrics.stage('summarize') as stage:
+        summaries, frame_counts, traffic_stats = labeled_windows(tables, window)
+        stage['frames'] = int(frame_counts.sum())
+    labels = window_labels(frame_counts, attack_share)
+    splits, _ = split_rows(0, len(summaries), seed)
+    data = summaries[WINDOW_FEATURES].to_numpy(dtype=np.float32)
+    weights = class_weights(np.bincount(labels[splits == TRAIN], minlength=num_class))
+    metrics.log(f"{frame_counts.sum():,} frames in {len(summaries):,} windows of {window} s; window labels "
+                f"{np.bincount(labels, minlength=num_class).tolist()}")
+
+    matrices = [xgb.DMatrix(data[splits == split], label=labels[splits == split],
+                            weight=weights[labels[splits == split]], feature_names=WINDOW_FEATURES)
+                for split in (TRAIN, VALIDATION)]
+    with metrics.stage('training', frames=int((splits == TRAIN).sum())):
+        booster = xgb.train(params, matrices[0], max_rounds, evals=[(matrices[1], 'validation')],
+                            early_stopping_rounds=early_stopping_rounds, verbose_eval=metrics.verbosity >= DETAIL)
+    rounds, best_iteration = booster.num_boosted_rounds(), booster.best_iteration
+    booster = booster[:best_iteration + 1]
+    booster.set_attr(window_seconds=repr(float(window)))
+
+    test = splits == TEST
+    predicted = booster.inplace_predict(data[test]).argmax(axis=1)
+    window_confusion = np.bincount(labels[test] * num_class + predicted,
+                                   minlength=num_class * num_class).reshape(num_class, num_class)
+    # Every frame of a test window takes the window's verdict.
+    frame_confusion = np.zeros((num_class, num_class), dtype=np.int64)
+    np.add.at(frame_confusion.T, predicted, frame_counts[test])
+
+    model_path.parent.mkdir(parents=True, exist_ok=True)
+    booster.save_model(model_path)
+    traffic_stats.normal_stats().save(normal_stats_path(model_path))
+    CompiledTrees.from_json(model_path).save(trees_path(model_path))
+    report = {
+        'model': str(model_path),
+        'window_seconds': window,
+        'attack_share': attack_share,
+        'params': params,
+        'windows': int(len(summaries)),
+        'window_labels': np.bincount(labels, minlength=num_class).tolist(),
+        'frames': int(frame_counts.sum()),
+        'rounds': rounds,
+        'best_iteration': best_iteration,
+        'test_windows': _scores(window_confusion),
+        'test_frames': _scores(frame_confusion),
+        **metrics.to_dict(),
+    }
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'w') as output:
+        json.dump(report, output, indent=1)
+    metrics.log(f"Best round {best_iteration + 1} of {rounds}; test accuracy {report['test_windows']['accuracy']:.4f} "
+                f"per window, {report['test_frames']['accuracy']:.4f} per frame; report saved to {report_path}")
+    return booster, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train or apply the window-level model.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--store-key', action='append', help='train on this cached labeled table (repeat for several)')
+    source.add_argument('--log', help='score this candump log')
+    parser.add_argument('--store-root', help='FeatureStore directory (default dataSet/features)')
+    parser.add_argument('--model', required=True, help='window model JSON (or .trees.npz to score)')
+    parser.add_argument('--window', type=float, help=f'window length in seconds (default {WINDOW_SECONDS}, '
+                                                     'or the one the model was trained with)')
+    parser.add_argument('--output', help='write the scored windows to this CSV')
+    parser.add_argument('--frames', help='also write per-frame predictions (each frame takes its window\'s)')
+    parser.add_argument('--verbose', action='store_true', help='print the validation loss every round')
+    args = parser.parse_args()
+
+    if args.store_key:
+        store = FeatureStore(args.store_root) if args.store_root else FeatureStore()
+        train_window_model((store.load_dataframe(key) for key in args.store_key), args.model,
+                           args.window or WINDOW_SECONDS, metrics=Metrics(DETAIL if args.verbose else SUMMARY))
+        return
+
+    booster, normal_stats = load_model(args.model)
+    trained = booster.attr('window_seconds') if hasattr(booster, 'attr') else None
+    window = args.window or (float(trained) if trained else WINDOW_SECONDS)
+    parsed = parse_can_log(args.log)
+    print(f"Parsed {parsed.lines} lines, skipped {parsed.skipped} malformed lines.")
+    df = normalize_features(compute_features(parsed.frames.to_dataframe(compact=True)), normal_stats)
+    summaries, frame_windows = window_features(df, window)
+    summaries['Predicted_Label'] = score_windows(booster, summaries)
+    print(f"Scored {len(summaries):,} windows of {window} s instead of {len(df):,} frames "
+          f"({len(df) / max(len(summaries), 1):.1f}x fewer rows).")
+    frames = np.bincount(summaries['Predicted_Label'].to_numpy(), weights=summaries['Frame_Count'].to_numpy(),
+                         minlength=len(LABEL_NAMES))
+    print("Frames per predicted label: " + ", ".join(f"{name} {int(count):,}" for name, count in zip(LABEL_NAMES, frames)))
+    if args.output:
+        summaries.assign(CAN_ID=format_can_ids(summaries['CAN_ID'].to_numpy()).astype(object)).to_csv(
+            args.output, index=False)
+        print(f"Window predictions saved to {args.output}")
+    if args.frames:
+        df['Predicted_Label'] = summaries['Predicted_Label'].to_numpy()[frame_windows]
+        format_frame_table(df).to_csv(args.frames, index=False)
+        print(f"Frame predictions saved to {args.frames}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+"""Mergeable per-CAN-ID statistics of normal traffic.
+
+``normal_stats`` used to be a pandas ``groupby().agg('mean')`` over the
+whole labeled table, so one more normal capture, or a second vehicle,
+meant recomputing over every frame, and the ``Summary_statistics.csv``
+tables under ``dataSet/raw`` were put together by hand. ``TrafficStats``
+keeps, for every CAN ID and for each of ``STATS_FEATURES``:
+
+- the frame count, sum, sum of squared deviations from the mean (M2),
+  minimum and maximum;
+- a quantile sketch: counts over logarithmic buckets shared by every
+  sketch of that feature, so a quantile read back from it is within
+  ``RELATIVE_ACCURACY`` of a value of that rank (exact minimum and
+  maximum are kept beside it).
+
+Every field but M2 adds up (or takes the min or max) element-wise, and
+M2 merges with Chan et al.'s pairwise formula, so ``merge`` is
+associative and commutative (up to rounding for M2): statistics built per log, in parallel
+(``traffic_stats_for_logs``), merge into the statistics of all the logs,
+and adding a capture means building its statistics and merging them in.
+``normal_stats()`` gives the ``NormalStats`` used for normalization, and
+``describe()`` and ``summary_table`` the ``Summary_statistics.csv``
+layout, without reading the frames again. From the notebooks directory::
+
+    python -m canbus.baseline --logs ../dataSet/raw/full_data_capture.log --output ../dataSet/baseline.npz \\
+        --normal-stats ../models/normal_stats.npz --summary ../models/Summary_statistics.csv
+"""
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .features import compute_features
+from .frames import format_can_ids, parse_can_ids
+from .normal_stats import NormalStats
+from .parser import parse_can_log
+from .store import DEFAULT_FEATURE_PARAMS, FeatureStore, cached_features
+
+TRAFFIC_STATS_VERSION = 2
+TRAFFIC_STATS_FILENAME = 'traffic_stats.npz'
+STATS_FEATURES = ('CAN_ID_Inter_Arrival', 'CAN_ID_Window_Count', 'Payload_Entropy')
+# Sketched range of each feature: values at or below the low end share the
+# first bucket, values above the high end the last one.
+SKETCH_RANGES = ((1e-6, 1e4), (1.0, 1e7), (1e-3, 8.0))
+# Features whose values are whole numbers; their quantiles are rounded.
+INTEGER_FEATURES = (False, True, False)
+RELATIVE_ACCURACY = 0.01
+DESCRIBE_PERCENTILES = (0.25, 0.5, 0.75)
+
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = np.log(_GAMMA)
+_BUCKETS = tuple(int(np.ceil(np.log(high / low) / _LOG_GAMMA)) + 1 for low, high in SKETCH_RANGES)
+
+
+def _bucket(values, feature):
+    """Sketch bucket of each value of feature number ``feature``."""
+    low = SKETCH_RANGES[feature][0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        index = np.ceil(np.log(np.asarray(values, dtype=np.float64) / low) / _LOG_GAMMA)
+    return np.clip(np.nan_to_num(index, nan=0.0), 0, _BUCKETS[feature] - 1).astype(np.int64)
+
+
+def _bucket_values(feature):
+    """Value each bucket stands for, within ``RELATIVE_ACCURACY`` of all it holds.
+
+    The first bucket, holding everything down to zero, is read as the
+    minimum instead (see ``TrafficStats.quantiles``).
+    """
+    low = SKETCH_RANGES[feature][0]
+    return 2 * low * _GAMMA ** np.arange(_BUCKETS[feature]) / (_GAMMA + 1)
+
+
+class TrafficStats:
+    """Count, sum, M2, extremes and quantile sketches per CAN ID.
+
+    ``can_ids`` is a sorted uint32 array; ``count`` is aligned with it and
+    ``sums``, ``m2`` (sums of squared deviations from each ID's mean), ``minimum`` and ``maximum`` have one column per
+    ``STATS_FEATURES`` entry. ``sketches`` holds one int64 array of
+    ``(len(can_ids), buckets)`` counts per feature.
+    """
+
+    __slots__ = ('can_ids', 'count', 'sums', 'm2', 'minimum', 'maximum', 'sketches')
+
+    def __init__(self, can_ids, count, sums, m2, minimum, maximum, sketches):
+        self.can_ids = np.asarray(can_ids, dtype=np.uint32)
+        if (self.can_ids[1:] <= self.can_ids[:-1]).any():
+            raise ValueError("Traffic statistics need sorted, distinct CAN IDs.")
+        self.count = np.asarray(count, dtype=np.int64)
+        self.sums = np.asarray(sums, dtype=np.float64).reshape(-1, len(STATS_FEATURES))
+        self.m2 = np.asarray(m2, dtype=np.float64).reshape(-1, len(STATS_FEATURES))
+        self.minimum = np.asarray(minimum, dtype=np.float64).reshape(-1, len(STATS_FEATURES))
+        self.maximum = np.asarray(maximum, dtype=np.float64).reshape(-1, len(STATS_FEATURES))
+        self.sketches = [np.asarray(sketch, dtype=np.int64).reshape(-1, buckets)
+                         for sketch, buckets in zip(sketches, _BUCKETS)]
+
+    @classmethod
+    def empty(cls):
+        features = len(STATS_FEATURES)
+        return cls(np.empty(0), np.empty(0), np.empty((0, features)), np.empty((0, features)),
+                   np.empty((0, features)), np.empty((0, features)), [np.empty((0, buckets)) for buckets in _BUCKETS])
+
+    @classmethod
+    def from_arrays(cls, can_ids, values):
+        """Statistics of frames given as a CAN ID column and ``(frames, 3)`` feature values."""
+        ids, codes = np.unique(parse_can_ids(can_ids), return_inverse=True)
+        codes = codes.reshape(-1)
+        values = np.asarray(values, dtype=np.float64).reshape(len(codes), len(STATS_FEATURES))
+        count = np.bincount(codes, minlength=len(ids))
+        sums = np.empty((len(ids), len(STATS_FEATURES)))
+        m2 = np.empty_like(sums)
+        minimum = np.full_like(sums, np.inf)
+        maximum = np.full_like(sums, -np.inf)
+        sketches = []
+        for feature, buckets in enumerate(_BUCKETS):
+            column = values[:, feature]
+            sums[:, feature] = np.bincount(codes, column, minlength=len(ids))
+            deviations = column - sums[codes, feature] / count[codes]
+            m2[:, feature] = np.bincount(codes, deviations * deviations, minlength=len(ids))
+            np.minimum.at(minimum[:, feature], codes, column)
+            np.maximum.at(maximum[:, feature], codes, column)
+            cells = codes * buckets + _bucket(column, feature)
+            sketches.append(np.bincount(cells, minlength=len(ids) * buckets).reshape(len(ids), buckets))
+        return cls(ids, count, sums, m2, minimum, maximum, sketches)
+
+    @classmethod
+    def from_features(cls, df, label=None):
+        """Statistics of a feature table, of the rows with ``Label == label`` if given."""
+        if label is not None:
+            df = df[df['Label'].to_numpy() == label]
+        return cls.from_arrays(df['CAN_ID'].to_numpy(), df[list(STATS_FEATURES)].to_numpy(dtype=np.float64))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as saved:
+            meta = json.loads(str(saved['meta']))
+            if meta != _meta():
+                raise ValueError(f"{path} was saved with other features, ranges or accuracy: {meta}")
+            ids = saved['can_ids']
+            sketches = []
+            for feature, buckets in enumerate(_BUCKETS):
+                sketch = np.zeros(len(ids) * buckets, dtype=np.int64)
+                sketch[saved[f'sketch_{feature}_cells']] = saved[f'sketch_{feature}_counts']
+                sketches.append(sketch)
+            return cls(ids, saved['count'], saved['sums'], saved['m2'], saved['minimum'], saved['maximum'],
+                       sketches)
+
+    def save(self, path):
+        """Write the statistics, keeping only the non-empty sketch buckets."""
+        arrays = {}
+        for feature, sketch in enumerate(self.sketches):
+            cells = np.flatnonzero(sketch)
+            arrays[f'sketch_{feature}_cells'] = cells.astype(np.uint32)
+            arrays[f'sketch_{feature}_counts'] = sketch.reshape(-1)[cells]
+        # np.savez would append .npz to other suffixes; write through a handle.
+        with open(path, 'wb') as handle:
+            np.savez_compressed(handle, meta=np.array(json.dumps(_meta())), can_ids=self.can_ids, count=self.count,
+                                sums=self.sums, m2=self.m2, minimum=self.minimum, maximum=self.maximum,
+                                **arrays)
+
+    def __len__(self):
+        return len(self.can_ids)
+
+    def merge(self, other):
+        """Statistics of the frames of both; neither operand is changed."""
+        ids = np.union1d(self.can_ids, other.can_ids).astype(np.uint32)
+        mine, theirs = np.searchsorted(ids, self.can_ids), np.searchsorted(ids, other.can_ids)
+        fields = {}
+        for name, fill in (('count', 0), ('sums', 0.0), ('m2', 0.0), ('minimum', np.inf), ('maximum', -np.inf)):
+            ours = getattr(self, name)
+            fields[name] = np.full((len(ids),) + ours.shape[1:], fill, dtype=ours.dtype)
+            fields[name][mine] = ours
+        # Chan et al.: M2 of a union is both M2 plus delta^2 * n_a * n_b / (n_a + n_b),
+        # delta being the difference of the two means. Read before count and sums change.
+        before = fields['count'][theirs].astype(np.float64)[:, None]
+        added = other.count.astype(np.float64)[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = other.sums / added - fields['sums'][theirs] / before
+            correction = np.where(before * added > 0, delta * delta * before * added / (before + added), 0.0)
+        fields['m2'][theirs] += other.m2 + correction
+        fields['count'][theirs] += other.count
+        fields['sums'][theirs] += other.sums
+        fields['minimum'][theirs] = np.minimum(fields['minimum'][theirs], other.minimum)
+        fields['maximum'][theirs] = np.maximum(fields['maximum'][theirs], other.maximum)
+        sketches = []
+        for ours, their in zip(self.sketches, other.sketches):
+            total = np.zeros((len(ids), ours.shape[1]), dtype=np.int64)
+            total[mine] = ours
+            total[theirs] += their
+            sketches.append(total)
+        return TrafficStats(ids, *fields.values(), sketches)
+
+    def subset(self, can_ids):
+        """Statistics of the listed CAN IDs only (candump strings or integers)."""
+        rows = np.flatnonzero(np.isin(self.can_ids, parse_can_ids(np.atleast_1d(can_ids))))
+        return TrafficStats(self.can_ids[rows], self.count[rows], self.sums[rows], self.m2[rows],
+                            self.minimum[rows], self.maximum[rows], [sketch[rows] for sketch in self.sketches])
+
+    def normal_stats(self):
+        """The ``NormalStats`` (mean inter-arrival and window count per CAN ID) for normalization."""
+        count = np.maximum(self.count, 1)
+        return NormalStats(self.can_ids, self.sums[:, 0] / count, self.sums[:, 1] / count)
+
+    def quantiles(self, quantiles, feature):
+        """Quantiles of feature number ``feature`` over every frame, read from the sketches.
+
+        Ranks between two frames are interpolated linearly, as
+        ``Series.quantile`` does; NaN when there are no frames.
+        """
+        counts = self.sketches[feature].sum(axis=0)
+        total = int(counts.sum())
+        quantiles = np.asarray(quantiles, dtype=np.float64)
+        if total == 0:
+            return np.full(quantiles.shape, np.nan)
+        low, high = self.minimum[:, feature].min(), self.maximum[:, feature].max()
+        values = _bucket_values(feature)
+        values[0] = low
+        cumulative = np.cumsum(counts)
+        ranks = quantiles * (total - 1)
+        below = values[np.searchsorted(cumulative, np.floor(ranks), side='right')]
+        above = values[np.searchsorted(cumulative, np.ceil(ranks), side='right')]
+        estimates = np.clip(below + (ranks - np.floor(ranks)) * (above - below), low, high)
+        return np.round(estimates) if INTEGER_FEATURES[feature] else estimates
+
+    def describe(self, percentiles=DESCRIBE_PERCENTILES):
+        """``DataFrame.describe()`` of the feature columns of every frame, from the statistics alone."""
+        count = int(self.count.sum())
+        index = ['count', 'mean', 'std', 'min'] + [f'{percentile:.0%}' for percentile in percentiles] + ['max']
+        table = {}
+        for feature, name in enumerate(STATS_FEATURES):
+            mean = self.sums[:, feature].sum() / count if count else np.nan
+            # M2 over every ID: each ID's M2 plus its count times its mean's squared distance to the overall mean.
+            with np.errstate(divide='ignore', invalid='ignore'):
+                spread = self.count * (self.sums[:, feature] / self.count - mean) ** 2
+            m2 = self.m2[:, feature].sum() + spread[self.count > 0].sum()
+            # Sample standard deviation (ddof=1), as describe() reports.
+            std = np.sqrt(m2 / (count - 1)) if count > 1 else np.nan
+            extremes = (self.minimum[:, feature].min(), self.maximum[:, feature].max()) if count else (np.nan, np.nan)
+            table[name] = [float(count), mean, std, extremes[0], *self.quantiles(percentiles, feature), extremes[1]]
+        return pd.DataFrame(table, index=index)
+
+    def to_frame(self):
+        """Per-CAN-ID count, mean and standard deviation of each feature, with candump-style ID strings."""
+        count = self.count.astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = self.sums / count[:, None]
+            stds = np.sqrt(self.m2 / (count[:, None] - 1))
+        table = {'CAN_ID': format_can_ids(self.can_ids).astype(object), 'Count': self.count}
+        for feature, name in enumerate(STATS_FEATURES):
+            table[f'Mean_{name}'] = means[:, feature]
+            table[f'Std_{name}'] = stds[:, feature]
+            table[f'Min_{name}'] = self.minimum[:, feature]
+            table[f'Max_{name}'] = self.maximum[:, feature]
+        return pd.DataFrame(table)
+
+
+def _meta():
+    return {'version': TRAFFIC_STATS_VERSION, 'features': list(STATS_FEATURES),
+            'ranges': [list(bounds) for bounds in SKETCH_RANGES], 'relative_accuracy': RELATIVE_ACCURACY}
+
+
+def traffic_stats_path(model_path):
+    """Where ``train_out_of_core`` keeps the statistics for a model file: the same directory."""
+    return Path(model_path).with_name(TRAFFIC_STATS_FILENAME)
+
+
+def merge_stats(parts):
+    """``TrafficStats`` of all ``parts`` together (empty statistics for none)."""
+    return reduce(TrafficStats.merge, parts, TrafficStats.empty())
+
+
+def summary_table(populations, can_ids=()):
+    """The ``Summary_statistics.csv`` layout for named ``TrafficStats``.
+
+    ``populations`` maps a name such as ``'Normal'`` or ``'DoS'`` to its
+    statistics; every feature gets a ``<name>_<feature>`` column, then
+    ``<name>_<id>_<feature>`` columns for each of ``can_ids``. Rows are
+    those of ``describe()``.
+    """
+    columns = {}
+    for can_id in [None] + list(can_ids):
+        for name, stats in populations.items():
+            if can_id is not None:
+                name, stats = f'{name}_{can_id}', stats.subset(can_id)
+            for feature, values in stats.describe().items():
+                columns[f'{name}_{feature}'] = values
+    return pd.DataFrame(columns)
+
+
+def _log_stats(log_path, store_root, params):
+    if store_root is None:
+        df = compute_features(parse_can_log(log_path).frames.to_dataframe(compact=True), **params)
+    else:
+        df = cached_features(log_path, FeatureStore(store_root), **params)
+    return TrafficStats.from_features(df)
+
+
+def traffic_stats_for_logs(log_paths, workers=None, store=None, **params):
+    """``TrafficStats`` of every frame of each log, one log per worker process.
+
+    Only the statistics come back from the workers, not the feature tables.
+    With a ``FeatureStore`` the features are read from (or cached in) it.
+    Returns a dict mapping each path to its statistics; ``merge_stats``
+    combines them.
+    """
+    params = {**DEFAULT_FEATURE_PARAMS, **params}
+    log_paths = list(log_paths)
+    store_root = None if store is None else str(store.root)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = [pool.submit(_log_stats, path, store_root, params) for path in log_paths]
+        return {path: future.result() for path, future in zip(log_paths, futures)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build, merge and summarize per-CAN-ID normal-traffic statistics.')
+    parser.add_argument('--logs', nargs='*', default=[], help='normal-traffic candump logs to add')
+    parser.add_argument('--stats', nargs='*', default=[], help='saved statistics to merge in')
+    parser.add_argument('--output', help='save the merged statistics here')
+    parser.add_argument('--normal-stats', help='save the NormalStats for normalization here')
+    parser.add_argument('--summary', help='write the Summary_statistics.csv table here')
+    parser.add_argument('--name', default='Normal', help='column prefix of the merged statistics in --summary')
+    parser.add_argument('--compare', nargs='*', default=[], metavar='NAME=PATH',
+                        help='saved statistics to add as more --summary columns, such as DoS=dos.npz')
+    parser.add_argument('--can-ids', nargs='*', default=[], help='also summarize these CAN IDs on their own')
+    parser.add_argument('--workers', type=int, help='processes for --logs (default: one per core)')
+    parser.add_argument('--store-root', help='FeatureStore to read and cache the features of --logs')
+    args = parser.parse_args()
+
+    parts = [TrafficStats.load(path) for path in args.stats]
+    if args.logs:
+        store = FeatureStore(args.store_root) if args.store_root else None
+        for path, stats in traffic_stats_for_logs(args.logs, args.workers, store).items():
+            print(f"{path}: {int(stats.count.sum()):,} frames of {len(stats)} CAN IDs.")
+            parts.append(stats)
+    stats = merge_stats(parts)
+    print(f"Merged statistics: {int(stats.count.sum()):,} frames of {len(stats)} CAN IDs.")
+    if args.output:
+        stats.save(args.output)
+        print(f"Statistics saved to {args.output}")
+    if args.normal_stats:
+        stats.normal_stats().save(args.normal_stats)
+        print(f"Normal statistics saved to {args.normal_stats}")
+    if args.summary:
+        populations = {args.name: stats}
+        for entry in args.compare:
+            name, path = entry.split('=', 1)
+            populations[name] = TrafficStats.load(path)
+        summary_table(populations, args.can_ids).to_csv(args.summary)
+        print(f"Summary table written to {args.summary}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""Per-frame features computed over whole columns at once."""
+
+import numpy as np
+import pandas as pd
+
+from .payload import decode_hex_payloads, payload_features
+
+# Model inputs, in the order model_training.ipynb trains on them.
+FEATURE_COLUMNS = [
+    'CAN_ID_Inter_Arrival', 'CAN_ID_Window_Count', 'Payload_Entropy',
+    'Norm_Inter_Arrival', 'Norm_Window_Count', 'Norm_Payload_Entropy',
+    'Norm_Payload_Decimal', 'Suspension_Indicator',
+]
+
+# Inter-arrival given to the first frame of each CAN ID.
+FIRST_INTER_ARRIVAL = 0.010
+MAX_PAYLOAD_DECIMAL = 2**64 - 1
+MAX_ENTROPY = 8.0
+
+
+def inter_arrivals(timestamps, can_ids, first=FIRST_INTER_ARRIVAL):
+    """Seconds since the previous frame of the same CAN ID, in row order.
+
+    Same as ``groupby(can_ids).diff()`` on the timestamps, with ``first``
+    for the first frame of every ID.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    codes, _ = pd.factorize(np.asarray(can_ids))
+    order = np.argsort(codes, kind='stable')
+    same_id = codes[order][1:] == codes[order][:-1]
+    gaps = np.full(len(timestamps), first, dtype=np.float64)
+    gaps[order[1:][same_id]] = np.diff(timestamps[order])[same_id]
+    return gaps
+
+
+def _ordered(timestamps):
+    """Stable sort order of ``timestamps``, or None when already sorted."""
+    if len(timestamps) < 2 or (timestamps[1:] >= timestamps[:-1]).all():
+        return None
+    return np.argsort(timestamps, kind='stable')
+
+
+def _lowest_reaching(targets, window):
+    """Smallest float ``c`` per target with ``c + window >= target``.
+
+    Together with the next function this turns the comparisons the original
+    loop made (``t_i >= t_j - window`` and ``t_i <= t_j + window``, rounded
+    the same way) into exact ``searchsorted`` bounds.
+    """
+    bounds = targets - window
+    while True:
+        low = bounds + window < targets
+        if not low.any():
+            break
+        bounds[low] = np.nextafter(bounds[low], np.inf)
+    while True:
+        below = np.nextafter(bounds, -np.inf)
+        high = below + window >= targets
+        if not high.any():
+            break
+        bounds[high] = below[high]
+    return bounds
+
+
+def _highest_reaching(targets, window):
+    """Largest float ``d`` per target with ``d - window <= target``."""
+    bounds = targets + window
+    while True:
+        high = bounds - window > targets
+        if not high.any():
+            break
+        bounds[high] = np.nextafter(bounds[high], -np.inf)
+    while True:
+        above = np.nextafter(bounds, np.inf)
+        low = above - window <= targets
+        if not low.any():
+            break
+        bounds[low] = above[low]
+    return bounds
+
+
+def suspension_indicator(timestamps, can_ids, inter_arrivals, threshold=2.0, window=0.5, total_can_ids=None):
+    """Share of CAN IDs with a gap above ``threshold`` within ``window`` s of each frame.
+
+    For every frame, counts the distinct ``can_ids`` among frames within
+    ``[t - window, t + window]`` whose inter-arrival exceeds ``threshold``,
+    divided by the number of distinct IDs overall (or ``total_can_ids``
+    when given). ``can_ids`` may be any hashable labels or integer codes. Values come back in input row order
+    and are bit-identical to the original per-frame loop.
+
+    Instead of scanning all frames per row, each large-gap frame marks the
+    contiguous run of rows whose window contains it. Runs of the same ID are
+    merged so an ID counts once, then a prefix sum over run starts and ends
+    gives the per-row count: O(n log n) for the sort, linear otherwise.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    codes, uniques = pd.factorize(np.asarray(can_ids))
+    inter_arrivals = np.asarray(inter_arrivals, dtype=np.float64)
+    if total_can_ids is None:
+        total_can_ids = len(uniques) + int((codes < 0).any())
+    if total_can_ids == 0:
+        return np.zeros(len(timestamps))
+
+    order = _ordered(timestamps)
+    if order is not None:
+        timestamps = timestamps[order]
+        codes = codes[order]
+        inter_arrivals = inter_arrivals[order]
+
+    gaps = np.flatnonzero(inter_arrivals > threshold)
+    gap_times = timestamps[gaps]
+    # Rows [starts, ends) have this large-gap frame inside their window.
+    starts = np.searchsorted(timestamps, _lowest_reaching(gap_times, window), side='left')
+    ends = np.searchsorted(timestamps, _highest_reaching(gap_times, window), side='right')
+
+    # Both bounds grow with time, so within one ID a run overlaps the
+    # previous one exactly when it starts before the previous one ends.
+    by_id = np.argsort(codes[gaps], kind='stable')
+    gap_codes = codes[gaps][by_id]
+    starts = starts[by_id]
+    ends = ends[by_id]
+    new_run = np.ones(len(by_id), dtype=bool)
+    new_run[1:] = (gap_codes[1:] != gap_codes[:-1]) | (starts[1:] > ends[:-1])
+    run_last = np.ones(len(by_id), dtype=bool)
+    run_last[:-1] = new_run[1:]
+    run_starts = starts[new_run]
+    run_ends = ends[run_last]
+
+    size = len(timestamps) + 1
+    changes = np.bincount(run_starts, minlength=size) - np.bincount(run_ends, minlength=size)
+    indicators = np.cumsum(changes[:-1]) / total_can_ids
+
+    if order is not None:
+        indicators[order] = indicators.copy()
+    return indicators
+
+
+def window_counts(timestamps, can_ids, window_sizes=(5.0,), tumbling=False):
+    """Frames of the same CAN ID per window, for several window sizes at once.
+
+    Sliding windows count same-ID frames with ``t - size <= t_j <= t``
+    (frames sharing the current timestamp included). Tumbling windows count
+    same-ID frames in the same ``t // size`` bucket. Returns a dict mapping
+    each size to an int64 array in input row order.
+
+    Rows are sorted once by (CAN ID, timestamp rank) into a single int64
+    key, so every window bound for every ID is one ``searchsorted`` call.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    codes, _ = pd.factorize(np.asarray(can_ids))
+    codes = codes.astype(np.int64) + 1  # missing IDs (-1) form a group too
+    if tumbling:
+        return {size: _tumbling_counts(timestamps, codes, size) for size in window_sizes}
+
+    # Timestamps are replaced by their rank among the distinct timestamps;
+    # a window bound maps to the rank of the first timestamp >= it. Working
+    # in key order keeps every searchsorted query sequence monotone.
+    ranked = np.unique(timestamps)
+    group_base = codes * np.int64(len(ranked) + 1)
+    keys = group_base + np.searchsorted(ranked, timestamps)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    group_base = group_base[order]
+    timestamps = timestamps[order]
+    upper = np.searchsorted(keys, keys, side='right')
+    counts = {}
+    for size in window_sizes:
+        lower = np.searchsorted(keys, group_base + np.searchsorted(ranked, timestamps - size), side='left')
+        counts[size] = np.empty(len(keys), dtype=np.int64)
+        counts[size][order] = upper - lower
+    return counts
+
+
+def _tumbling_counts(timestamps, codes, size):
+    buckets = np.floor_divide(timestamps, size)
+    order = np.lexsort((buckets, codes))
+    sorted_buckets = buckets[order]
+    sorted_codes = codes[order]
+    boundary = np.ones(len(order) + 1, dtype=bool)
+    boundary[1:-1] = (sorted_codes[1:] != sorted_codes[:-1]) | (sorted_buckets[1:] != sorted_buckets[:-1])
+    starts = np.flatnonzero(boundary)
+    counts = np.empty(len(order), dtype=np.int64)
+    counts[order] = np.repeat(np.diff(starts), np.diff(starts))
+    return counts
+
+
+def compute_window_count(df, window_size=5.0, tumbling=False):
+    """``CAN_ID_Window_Count`` for every row of a frame table, in row order."""
+    return window_counts(df['Timestamp'].to_numpy(), df['CAN_ID'].to_numpy(), (window_size,), tumbling)[window_size]
+
+
+def compute_suspension_indicator(df, threshold=2.0, window=0.5):
+    """``suspension_indicator`` over a frame table with ``Timestamp``,
+    ``CAN_ID`` and ``CAN_ID_Inter_Arrival`` columns."""
+    return suspension_indicator(
+        df['Timestamp'].to_numpy(),
+        df['CAN_ID'].to_numpy(),
+        df['CAN_ID_Inter_Arrival'].to_numpy(),
+        threshold=threshold,
+        window=window,
+    )
+
+
+def frame_payloads(df):
+    """uint64 payloads and DLCs of a frame table, decoding hex ``Payload`` strings if needed."""
+    if df['Payload'].dtype.kind in 'iu':
+        return df['Payload'].to_numpy(np.uint64), df['DLC'].to_numpy(np.uint8)
+    return decode_hex_payloads(df['Payload'])
+
+
+def compute_features(df, window_size=5.0, threshold=2.0, suspension_window=0.5):
+    """Sort a parsed frame table by time and add the per-frame feature columns.
+
+    Adds everything in ``FEATURE_COLUMNS`` except the two columns normalized
+    by the normal-traffic statistics (``Norm_Inter_Arrival`` and
+    ``Norm_Window_Count``), plus ``Payload_Decimal``. Takes the compact
+    frame table (``CanFrames.to_dataframe(compact=True)``) or the string one.
+    """
+    df = df.sort_values('Timestamp', kind='stable').reset_index(drop=True)
+    df['CAN_ID_Inter_Arrival'] = inter_arrivals(df['Timestamp'].to_numpy(), df['CAN_ID'].to_numpy())
+    df['CAN_ID_Window_Count'] = compute_window_count(df, window_size)
+    df['Payload_Entropy'], df['Payload_Decimal'] = payload_features(*frame_payloads(df))
+    df['Norm_Payload_Decimal'] = df['Payload_Decimal'].to_numpy(np.float64) / float(MAX_PAYLOAD_DECIMAL)
+    df['Norm_Payload_Entropy'] = df['Payload_Entropy'] / MAX_ENTROPY
+    df['Suspension_Indicator'] = compute_suspension_indicator(df, threshold, suspension_window)
+    return df
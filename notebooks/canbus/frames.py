@@ -0,0 +1,199 @@
+"""Columnar container for parsed CAN frames.
+
+Frames stay numeric from the parser to the model: a compact frame table
+(``CanFrames.to_dataframe(compact=True)``) holds ``Timestamp`` as float64
+seconds, ``Interface`` as a categorical, ``CAN_ID`` as a uint32 (with
+``CAN_EFF_FLAG`` for 29-bit IDs), ``DLC`` as a uint8 and ``Payload`` as
+the uint64 value of the data bytes: 22 bytes per frame, against several
+hundred for the same columns as Python strings. ``format_frame_table``
+turns such a table back into candump hex strings, which is only needed
+when writing CSV or other output for people to read.
+"""
+
+import numpy as np
+import pandas as pd
+
+# SocketCAN convention: extended (29-bit) identifiers carry this flag so that
+# 0x123 and 0x00000123 stay distinct and are written back with 8 hex digits.
+CAN_EFF_FLAG = 0x80000000
+CAN_EFF_MASK = 0x1FFFFFFF
+
+FRAME_COLUMNS = ['Timestamp', 'Interface', 'CAN_ID', 'DLC', 'Payload']
+
+_HEX_DIGITS = np.frombuffer(b'0123456789ABCDEF', dtype=np.uint8)
+
+
+def _format_hex(values, widths, max_width):
+    """Format uint64 values as upper-case hex strings of per-row widths."""
+    values = np.asarray(values, dtype=np.uint64)
+    widths = np.asarray(widths, dtype=np.int64)
+    if len(values) == 0:
+        return np.array([], dtype=f'U{max_width}')
+    positions = np.arange(max_width, dtype=np.int64)
+    shifts = 4 * (widths[:, None] - 1 - positions)
+    valid = shifts >= 0
+    nibbles = (values[:, None] >> np.where(valid, shifts, 0).astype(np.uint64)) & np.uint64(0xF)
+    chars = np.where(valid, _HEX_DIGITS[nibbles.astype(np.intp)], 0).astype(np.uint8)
+    # Trailing NUL bytes are dropped by the fixed-width bytes dtype.
+    return np.ascontiguousarray(chars).view(f'S{max_width}').ravel().astype(f'U{max_width}')
+
+
+def format_can_ids(can_id):
+    """Render integer CAN IDs the way candump writes them (3 or 8 hex digits)."""
+    can_id = np.asarray(can_id, dtype=np.uint32)
+    extended = (can_id & np.uint32(CAN_EFF_FLAG)) != 0
+    return _format_hex(can_id & np.uint32(CAN_EFF_MASK), np.where(extended, 8, 3), 8)
+
+
+def parse_can_id(text):
+    """Integer form of a candump CAN ID string such as ``'2C6'`` or ``'18DAF110'``.
+
+    Quote characters and a leading ``=`` are ignored, since the feature
+    scripts write IDs to CSV as ``="2C6"`` or ``"2C6"``.
+    """
+    text = str(text).strip().lstrip('=').strip('"')
+    value = int(text, 16)
+    return value | CAN_EFF_FLAG if len(text) > 3 else value
+
+
+def parse_can_ids(values):
+    """uint32 form of a column of CAN IDs, parsing each distinct string once.
+
+    Integer columns are taken as already parsed.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in 'iu':
+        return values.astype(np.uint32)
+    codes, uniques = pd.factorize(values)
+    if (codes < 0).any():
+        raise ValueError("CAN ID column has missing values.")
+    return np.array([parse_can_id(value) for value in uniques], dtype=np.uint32)[codes]
+
+
+def format_payloads(payload, dlc):
+    """Render uint64 payloads as hex strings of ``2 * dlc`` digits."""
+    return _format_hex(payload, 2 * np.asarray(dlc, dtype=np.int64), 16)
+
+
+class CanFrames:
+    """Parsed frames held as parallel NumPy arrays.
+
+    ``timestamp`` is float64 seconds, ``can_id`` a uint32 (with
+    ``CAN_EFF_FLAG`` set for extended IDs), ``payload`` the big-endian uint64
+    value of the data bytes (what ``int(payload, 16)`` used to return),
+    ``dlc`` the number of data bytes and ``interface`` a uint8 index into
+    ``interfaces``.
+    """
+
+    __slots__ = ('timestamp', 'can_id', 'payload', 'dlc', 'interface', 'interfaces')
+
+    def __init__(self, timestamp, can_id, payload, dlc, interface, interfaces):
+        self.timestamp = timestamp
+        self.can_id = can_id
+        self.payload = payload
+        self.dlc = dlc
+        self.interface = interface
+        self.interfaces = list(interfaces)
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.uint32),
+            np.empty(0, dtype=np.uint64),
+            np.empty(0, dtype=np.uint8),
+            np.empty(0, dtype=np.uint8),
+            [],
+        )
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Join several frame blocks, remapping interface codes as needed."""
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls.empty()
+        interfaces = []
+        codes = []
+        for part in parts:
+            remap = np.empty(max(len(part.interfaces), 1), dtype=np.uint8)
+            for code, name in enumerate(part.interfaces):
+                if name not in interfaces:
+                    interfaces.append(name)
+                remap[code] = interfaces.index(name)
+            codes.append(remap[part.interface])
+        return cls(
+            np.concatenate([part.timestamp for part in parts]),
+            np.concatenate([part.can_id for part in parts]),
+            np.concatenate([part.payload for part in parts]),
+            np.concatenate([part.dlc for part in parts]),
+            np.concatenate(codes),
+            interfaces,
+        )
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ('timestamp', 'can_id', 'payload', 'dlc', 'interface'))
+
+    def take(self, indices):
+        """Return the frames at ``indices`` (an index array or boolean mask)."""
+        return CanFrames(
+            self.timestamp[indices],
+            self.can_id[indices],
+            self.payload[indices],
+            self.dlc[indices],
+            self.interface[indices],
+            self.interfaces,
+        )
+
+    def can_id_strings(self):
+        return format_can_ids(self.can_id)
+
+    def payload_strings(self):
+        return format_payloads(self.payload, self.dlc)
+
+    def interface_strings(self):
+        names = np.array(self.interfaces if self.interfaces else [''], dtype=str)
+        return names[self.interface]
+
+    def to_dataframe(self, compact=False):
+        """The frames as a DataFrame.
+
+        ``compact=True`` gives the numeric frame table (``FRAME_COLUMNS``);
+        otherwise the string columns the notebooks have always used.
+        """
+        if compact:
+            return pd.DataFrame({
+                'Timestamp': self.timestamp,
+                'Interface': pd.Categorical.from_codes(self.interface, self.interfaces or ['']),
+                'CAN_ID': self.can_id,
+                'DLC': self.dlc,
+                'Payload': self.payload,
+            })
+        return pd.DataFrame({
+            'Timestamp': self.timestamp,
+            'Interface': self.interface_strings().astype(object),
+            'CAN_ID': self.can_id_strings().astype(object),
+            'Payload': self.payload_strings().astype(object),
+        })
+
+
+def format_frame_table(df):
+    """Copy of a frame or feature table with ``CAN_ID`` and ``Payload`` as hex strings.
+
+    Numeric ``CAN_ID`` columns become candump IDs and numeric ``Payload``
+    columns ``2 * DLC`` hex digits (the ``DLC`` column is dropped, the
+    string holds it); a categorical ``Interface`` becomes plain strings.
+    Tables that already hold strings are returned unchanged. Call it at
+    output time only: the string columns are what makes a table large.
+    """
+    df = df.copy()
+    if 'CAN_ID' in df and df['CAN_ID'].dtype.kind in 'iu':
+        df['CAN_ID'] = format_can_ids(df['CAN_ID'].to_numpy()).astype(object)
+    if 'Payload' in df and df['Payload'].dtype.kind in 'iu':
+        df['Payload'] = format_payloads(df['Payload'].to_numpy(), df.pop('DLC').to_numpy()).astype(object)
+    if 'Interface' in df and isinstance(df['Interface'].dtype, pd.CategoricalDtype):
+        df['Interface'] = np.asarray(df['Interface'].astype(str)).astype(object)
+    return df
@@ -0,0 +1,253 @@
+"""Resumable feature extraction and scoring over a growing candump log.
+
+``candump -l`` keeps appending to its log, and ``compute_features`` or
+``cached_features`` would parse and recompute the whole file on every run.
+``incremental_features`` instead keeps a ``LogCheckpoint`` next to the log
+(``<log>.checkpoint.npz``) holding:
+
+- the byte offset parsed so far, with digests of the first and last bytes
+  before it, so a rotated or rewritten log starts over from the beginning;
+- the last timestamp of every CAN ID, which gives the first inter-arrival
+  of each ID in the new bytes (as ``sharding`` does across shards);
+- the frames of the last few seconds with their inter-arrivals, the
+  window buffers for ``CAN_ID_Window_Count`` and ``Suspension_Indicator``;
+- the frames whose features are not final yet: the indicator looks
+  ``suspension_window`` seconds ahead, so frames that close to the end of
+  the log are held back until a later run (or ``final=True``).
+
+Each run parses only the complete lines appended since the offset, so
+its cost depends on the new data, not on the size of the log. The rows it
+returns are the ones ``compute_features`` on the whole log would give
+them, bit for bit, as long as the log is in timestamp order and no CAN ID
+first appears after rows were returned (the indicator divides by the
+number of IDs; pass ``total_can_ids`` to fix it, as for the service).
+
+From the notebooks directory, append each run's features to a CSV, or
+score them with a model and append the predictions::
+
+    python -m canbus.incremental --log capture.log --csv capture_features.csv
+    python -m canbus.incremental --log capture.log --model ../models/xgboost_model.json --predictions out.csv
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from .features import FEATURE_COLUMNS, FIRST_INTER_ARRIVAL, inter_arrivals
+from .frames import CanFrames, format_frame_table
+from .normal_stats import NormalStats, normalize_features
+from .parser import parse_can_log
+from .payload import payload_features
+from .sharding import HALO, _frames_dataframe, _is_ordered, _shard_windows
+from .store import DEFAULT_FEATURE_PARAMS
+
+CHECKPOINT_SUFFIX = '.checkpoint.npz'
+# Bytes hashed at the start of the log and just before the offset.
+DIGEST_BYTES = 4096
+_TAIL_ARRAYS = ('timestamp', 'can_id', 'payload', 'dlc', 'interface')
+
+
+def checkpoint_path(log_path):
+    """Default checkpoint of a log: ``<log>.checkpoint.npz`` next to it."""
+    log_path = Path(log_path)
+    return log_path.with_name(log_path.name + CHECKPOINT_SUFFIX)
+
+
+def _digest(log_file, start, stop):
+    log_file.seek(start)
+    return hashlib.blake2b(log_file.read(stop - start), digest_size=16).hexdigest()
+
+
+def _complete_end(log_path, offset, step=1 << 16):
+    """Offset just past the last newline at or after ``offset``, or ``offset`` if there is none."""
+    end = os.path.getsize(log_path)
+    with open(log_path, 'rb') as log_file:
+        while end > offset:
+            start = max(offset, end - step)
+            log_file.seek(start)
+            found = log_file.read(end - start).rfind(b'\n')
+            if found >= 0:
+                return start + found + 1
+            end = start
+    return offset
+
+
+class LogCheckpoint:
+    """State carried from one run over a log to the next; see the module docstring."""
+
+    __slots__ = ('params', 'offset', 'head_digest', 'tail_digest', 'lines', 'skipped', 'rows',
+                 'last_ids', 'last_times', 'tail', 'tail_gaps', 'pending')
+
+    def __init__(self, params=None):
+        self.params = {**DEFAULT_FEATURE_PARAMS, **(params or {})}
+        self.offset = 0
+        self.head_digest = self.tail_digest = None
+        self.lines = self.skipped = self.rows = 0
+        self.last_ids = np.empty(0, dtype=np.uint32)
+        self.last_times = np.empty(0, dtype=np.float64)
+        self.tail = CanFrames.empty()
+        self.tail_gaps = np.empty(0, dtype=np.float64)
+        # Rows of ``tail`` from this index on have not been returned yet.
+        self.pending = 0
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as saved:
+            meta = json.loads(str(saved['meta']))
+            checkpoint = cls(meta['params'])
+            for name in ('offset', 'head_digest', 'tail_digest', 'lines', 'skipped', 'rows', 'pending'):
+                setattr(checkpoint, name, meta[name])
+            for name in ('last_ids', 'last_times', 'tail_gaps'):
+                setattr(checkpoint, name, saved[name])
+            checkpoint.tail = CanFrames(*(saved[f'tail_{name}'] for name in _TAIL_ARRAYS), meta['interfaces'])
+        return checkpoint
+
+    def save(self, path):
+        """Write the checkpoint atomically, so an interrupted run leaves the previous one."""
+        path = Path(path)
+        meta = {name: getattr(self, name) for name in
+                ('params', 'offset', 'head_digest', 'tail_digest', 'lines', 'skipped', 'rows', 'pending')}
+        meta['interfaces'] = self.tail.interfaces
+        arrays = {f'tail_{name}': getattr(self.tail, name) for name in _TAIL_ARRAYS}
+        arrays.update({name: getattr(self, name) for name in
+                       ('last_ids', 'last_times', 'tail_gaps')})
+        handle, staging = tempfile.mkstemp(prefix=f'.{path.name}-', dir=path.parent)
+        with os.fdopen(handle, 'wb') as output:
+            np.savez(output, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(staging, path)
+
+    def matches(self, log_path, params=None):
+        """Whether ``log_path`` still starts with the bytes this checkpoint has read."""
+        if params is not None and {**DEFAULT_FEATURE_PARAMS, **params} != self.params:
+            return False
+        if self.offset == 0:
+            return True
+        if os.path.getsize(log_path) < self.offset:
+            return False
+        with open(log_path, 'rb') as log_file:
+            return (_digest(log_file, 0, min(self.offset, DIGEST_BYTES)) == self.head_digest
+                    and _digest(log_file, max(0, self.offset - DIGEST_BYTES), self.offset) == self.tail_digest)
+
+    def update(self, frames, final=False, total_can_ids=None):
+        """Features of the rows that became final with ``frames`` appended; advances the state.
+
+        ``frames`` must continue the log in timestamp order. With
+        ``final=True`` every held-back row is returned too, for a log that
+        will not grow any more.
+        """
+        window_size, threshold, suspension_window = (
+            self.params['window_size'], self.params['threshold'], self.params['suspension_window'])
+        if not _is_ordered(frames.timestamp) or (
+                len(frames) and len(self.tail) and frames.timestamp[0] < self.tail.timestamp[-1]):
+            raise ValueError("Timestamps go backwards; incremental mode needs a log in timestamp order.")
+
+        # First inter-arrival of each ID from its last timestamp in earlier runs.
+        gaps = inter_arrivals(frames.timestamp, frames.can_id, first=np.nan)
+        open_rows = np.flatnonzero(np.isnan(gaps))
+        gaps[open_rows] = FIRST_INTER_ARRIVAL
+        if len(self.last_ids):
+            open_ids = frames.can_id[open_rows]
+            positions = np.minimum(np.searchsorted(self.last_ids, open_ids), len(self.last_ids) - 1)
+            seen = self.last_ids[positions] == open_ids
+            gaps[open_rows[seen]] = frames.timestamp[open_rows[seen]] - self.last_times[positions[seen]]
+        # The newest timestamp of every ID: the first of each in reversed order, new frames first.
+        ids = np.concatenate([frames.can_id[::-1], self.last_ids])
+        times = np.concatenate([frames.timestamp[::-1], self.last_times])
+        self.last_ids, first = np.unique(ids, return_index=True)
+        self.last_times = times[first]
+
+        combined = CanFrames.concatenate([self.tail, frames])
+        gaps = np.concatenate([self.tail_gaps, gaps])
+        timestamps = combined.timestamp
+        start = self.pending
+        if len(combined) == start:
+            return _frames_dataframe(CanFrames.empty(), np.empty(0), np.empty(0, dtype=np.int64), np.empty(0),
+                                     np.empty(0))
+        counts, indicators = _shard_windows(timestamps, combined.can_id, gaps, (start, len(combined)), window_size,
+                                            threshold, suspension_window, total_can_ids or len(self.last_ids))
+        # A row is final once a later frame lies past its suspension window.
+        stop = len(combined) if final else start + int((timestamps[start:] + suspension_window < timestamps[-1]).sum())
+        ready = combined.take(slice(start, stop))
+        entropy, _ = payload_features(ready.payload, ready.dlc)
+        df = _frames_dataframe(ready, gaps[start:stop], counts[:stop - start], entropy, indicators[:stop - start])
+        self.rows += len(ready)
+
+        # Keep every row not returned yet and enough history for their windows.
+        reach = max(window_size, suspension_window) + suspension_window + HALO
+        horizon = (timestamps[stop] if stop < len(combined) else timestamps[-1]) - reach
+        keep = min(int(np.searchsorted(timestamps, horizon, side='left')), stop)
+        self.tail = combined.take(slice(keep, None))
+        self.tail_gaps = gaps[keep:]
+        self.pending = stop - keep
+        return df
+
+
+def incremental_features(log_path, checkpoint=None, final=False, total_can_ids=None, **params):
+    """``compute_features`` rows of the lines appended to ``log_path`` since the last run.
+
+    ``checkpoint`` is the checkpoint file (``<log>.checkpoint.npz`` by
+    default); it is created on the first run and replaced after every run.
+    Returns the new rows, in the compact frame-table layout of
+    ``compute_features``; ``params`` default to ``DEFAULT_FEATURE_PARAMS``.
+    """
+    checkpoint = checkpoint_path(log_path) if checkpoint is None else Path(checkpoint)
+    state = LogCheckpoint.load(checkpoint) if checkpoint.is_file() else None
+    if state is None or not state.matches(log_path, params):
+        if state is not None:
+            print(f"{log_path} was rewritten or the feature parameters changed; starting over.")
+        state = LogCheckpoint(params)
+    end = _complete_end(log_path, state.offset)
+    parsed = parse_can_log(log_path, start=state.offset, end=end)
+    df = state.update(parsed.frames, final, total_can_ids)
+    state.lines += parsed.lines
+    state.skipped += parsed.skipped
+    if end > state.offset or state.head_digest is None:
+        state.offset = end
+        with open(log_path, 'rb') as log_file:
+            state.head_digest = _digest(log_file, 0, min(end, DIGEST_BYTES))
+            state.tail_digest = _digest(log_file, max(0, end - DIGEST_BYTES), end)
+    state.save(checkpoint)
+    print(f"Parsed {parsed.lines} new lines up to byte {end:,}, skipped {parsed.skipped} malformed lines; "
+          f"{len(df)} rows final, {len(state.tail) - state.pending} held back.")
+    return df
+
+
+def _append_csv(df, path):
+    path = Path(path)
+    format_frame_table(df).to_csv(path, mode='a', header=not path.is_file() or path.stat().st_size == 0, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract features (and predictions) for the new tail of a candump log.')
+    parser.add_argument('--log', required=True, help='candump log that keeps growing')
+    parser.add_argument('--checkpoint', help=f'checkpoint file (default <log>{CHECKPOINT_SUFFIX})')
+    parser.add_argument('--csv', help='append the new feature rows to this CSV')
+    parser.add_argument('--model', help='score the new rows with this model JSON or .trees.npz')
+    parser.add_argument('--predictions', help='append the scored rows to this CSV (with --model)')
+    parser.add_argument('--final', action='store_true', help='the log is complete: return the held-back rows too')
+    parser.add_argument('--total-can-ids', type=int, help='CAN ID count for Suspension_Indicator')
+    args = parser.parse_args()
+    if args.predictions and not args.model:
+        parser.error('--predictions needs --model')
+
+    df = incremental_features(args.log, args.checkpoint, args.final, args.total_can_ids)
+    if args.csv:
+        _append_csv(df, args.csv)
+    if args.model and len(df):
+        from .service import load_model
+
+        booster, normal_stats = load_model(args.model)
+        df = normalize_features(df, normal_stats if normal_stats is not None else NormalStats([], [], []))
+        df['Predicted_Label'] = booster.inplace_predict(df[FEATURE_COLUMNS].to_numpy(dtype=np.float32)).argmax(axis=1)
+        print(f"Predicted labels: {np.bincount(df['Predicted_Label'], minlength=4).tolist()}")
+        if args.predictions:
+            _append_csv(df, args.predictions)
+
+
+if __name__ == '__main__':
+    main()
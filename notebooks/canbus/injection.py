@@ -0,0 +1,303 @@
+"""Declarative DoS, fuzzing and suspension injection on parsed frame arrays.
+
+A scenario is a dict such as::
+
+    {'attack': 'dos', 'can_id': '000', 'start': 1508687520.0, 'duration': 10.0,
+     'rate': 4000, 'payload': 'zeros'}
+
+``start`` is an absolute timestamp; ``offset`` (seconds after the first
+frame) can be given instead. Per attack:
+
+- ``dos`` clears the bus for the window (as data_processing.ipynb did) and
+  sends ``can_id`` at ``rate`` frames/s, at most ``count`` frames;
+- ``fuzzing`` replaces the payloads of the first ``count`` frames of
+  ``can_id`` in the window, adding evenly spaced frames when there are too
+  few; with a ``rate`` it injects frames at that rate instead. Only the
+  tampered frames are labeled: the old notebook labeled every frame of
+  ``can_id`` in the window, payload replaced or not, and left the
+  existing payloads alone when it had to add frames;
+- ``suspension`` removes ``can_id`` for the window and labels its first
+  ``count`` frames after it resumes, adding frames at the ID's usual period
+  when the capture ends too soon.
+
+``payload`` is ``'zeros'``, ``'random'`` (uniform bytes) or a hex string
+sent unchanged; ``dlc`` (0 to 8, by default 8) sets the length of zero and
+random payloads, and must match a hex payload's length when given.
+
+``inject_attacks`` applies a whole scenario list with one keep mask, one
+concatenation and one sort, drawing every payload in bulk from a seeded
+``numpy.random.Generator``. Labels follow the notebooks: 0 Normal, 1 DoS,
+2 Fuzzing, 3 Suspension.
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .features import compute_features
+from .frames import CanFrames, parse_can_id
+from .store import FEATURE_STORE_VERSION
+
+ATTACK_LABELS = {'dos': 1, 'fuzzing': 2, 'suspension': 3}
+DOS_RATE = 4000.0
+DEFAULT_COUNT = {'dos': None, 'fuzzing': 2222, 'suspension': 2222}
+# Spacing of added suspension frames for IDs seen fewer than twice.
+DEFAULT_PERIOD = 0.010
+# The attacks data_processing.ipynb has always injected into full_data_capture.log.
+DEFAULT_SCENARIOS = [
+    {'attack': 'dos', 'can_id': '000', 'start': 1508687520.0, 'duration': 9.99975,
+     'rate': DOS_RATE, 'count': 40001, 'payload': 'zeros'},
+    {'attack': 'fuzzing', 'can_id': '18A', 'start': 1508687510.0, 'duration': 5.9995,
+     'count': 2222, 'payload': 'random'},
+    {'attack': 'suspension', 'can_id': '2C6', 'start': 1508687486.0, 'duration': 20.0, 'count': 2222},
+]
+
+
+class AttackScenario:
+    """One validated scenario; see the module docstring for the fields."""
+
+    __slots__ = ('attack', 'can_id', 'start', 'offset', 'duration', 'rate', 'payload', 'dlc', 'count', 'clear')
+
+    def __init__(self, attack, duration, can_id=None, start=None, offset=None, rate=None,
+                 payload=None, dlc=None, count=None, clear=None):
+        if attack not in ATTACK_LABELS:
+            raise ValueError(f"Unknown attack {attack!r}; expected one of {sorted(ATTACK_LABELS)}.")
+        if (start is None) == (offset is None):
+            raise ValueError(f"A {attack} scenario needs exactly one of start and offset.")
+        if can_id is None and attack != 'dos':
+            raise ValueError(f"A {attack} scenario needs a can_id.")
+        self.attack = attack
+        self.can_id = parse_can_id(can_id) if isinstance(can_id, str) else int(can_id or 0)
+        self.start = start
+        self.offset = offset
+        self.duration = float(duration)
+        self.rate = DOS_RATE if rate is None and attack == 'dos' else rate
+        self.payload = payload or ('random' if attack == 'fuzzing' else 'zeros')
+        if self.payload in ('zeros', 'random'):
+            self.dlc = 8 if dlc is None else int(dlc)
+            if not 0 <= self.dlc <= 8:
+                raise ValueError(f"DLC {dlc} is outside 0 to 8.")
+        else:
+            try:
+                int(self.payload, 16)
+            except ValueError:
+                raise ValueError(f"Payload {self.payload!r} is not 'zeros', 'random' or a hex string.") from None
+            if len(self.payload) % 2 or len(self.payload) > 16:
+                raise ValueError(f"Payload {self.payload!r} is not up to 8 whole hex bytes.")
+            self.dlc = len(self.payload) // 2
+            if dlc is not None and int(dlc) != self.dlc:
+                raise ValueError(f"Payload {self.payload!r} has {self.dlc} bytes but the DLC is {dlc}.")
+        self.count = DEFAULT_COUNT[attack] if count is None else count
+        self.clear = attack == 'dos' if clear is None else clear
+
+    @classmethod
+    def from_dict(cls, scenario):
+        return scenario if isinstance(scenario, cls) else cls(**scenario)
+
+    def window(self, first_timestamp):
+        start = self.start if self.start is not None else first_timestamp + self.offset
+        return start, start + self.duration
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+
+def _payloads(scenario, size, rng):
+    """``size`` payloads and their DLC for ``scenario``'s payload model."""
+    model = scenario.payload
+    if model == 'zeros' or scenario.dlc == 0:
+        return np.zeros(size, dtype=np.uint64), np.full(size, scenario.dlc, dtype=np.uint8)
+    if model == 'random':
+        values = rng.integers(0, 2**64, size, dtype=np.uint64, endpoint=False)
+        values >>= np.uint64(8 * (8 - scenario.dlc))
+        return values, np.full(size, scenario.dlc, dtype=np.uint8)
+    return np.full(size, int(model, 16), dtype=np.uint64), np.full(size, scenario.dlc, dtype=np.uint8)
+
+
+class _IdIndex:
+    """Row positions of every CAN ID, in time order, from one stable sort."""
+
+    def __init__(self, timestamps, can_ids):
+        self.timestamps = timestamps
+        self.order = np.argsort(can_ids, kind='stable')
+        sorted_ids = can_ids[self.order]
+        self.ids, self.starts = np.unique(sorted_ids, return_index=True)
+        self.ends = np.append(self.starts[1:], len(sorted_ids))
+
+    def rows(self, can_id):
+        position = np.searchsorted(self.ids, can_id)
+        if position == len(self.ids) or self.ids[position] != can_id:
+            return np.empty(0, dtype=np.intp)
+        return self.order[self.starts[position]:self.ends[position]]
+
+    def between(self, can_id, start, end):
+        """Rows of ``can_id`` with ``start <= t <= end``."""
+        rows = self.rows(can_id)
+        times = self.timestamps[rows]
+        return rows[np.searchsorted(times, start, side='left'):np.searchsorted(times, end, side='right')]
+
+
+def inject_attacks(frames, scenarios, seed=None):
+    """Apply ``scenarios`` to ``frames``; returns time-ordered frames and int8 labels."""
+    scenarios = [AttackScenario.from_dict(scenario) for scenario in scenarios]
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+    order = np.argsort(frames.timestamp, kind='stable')
+    timestamps = frames.timestamp[order]
+    can_ids = frames.can_id[order]
+    payloads = frames.payload[order].copy()
+    dlcs = frames.dlc[order].copy()
+    interfaces = frames.interface[order]
+    labels = np.zeros(len(timestamps), dtype=np.int8)
+    keep = np.ones(len(timestamps), dtype=bool)
+    index = _IdIndex(timestamps, can_ids)
+    first = timestamps[0] if len(timestamps) else 0.0
+    added = []
+
+    def add(times, can_id, label, payload, dlc):
+        added.append((times, np.full(len(times), can_id, dtype=np.uint32), payload, dlc,
+                      np.full(len(times), label, dtype=np.int8)))
+
+    for scenario in scenarios:
+        start, end = scenario.window(first)
+        label = ATTACK_LABELS[scenario.attack]
+        if scenario.clear:
+            keep[np.searchsorted(timestamps, start, side='left'):np.searchsorted(timestamps, end, side='right')] = False
+        if scenario.attack == 'suspension':
+            keep[index.between(scenario.can_id, start, end)] = False
+            rows = index.rows(scenario.can_id)
+            resumed = rows[(timestamps[rows] > end) & keep[rows]][:scenario.count]
+            labels[resumed] = label
+            missing = (scenario.count or 0) - len(resumed)
+            if missing > 0:
+                period = np.median(np.diff(timestamps[rows])) if len(rows) > 1 else DEFAULT_PERIOD
+                last = timestamps[resumed[-1]] if len(resumed) else end
+                add(last + period * np.arange(1, missing + 1), scenario.can_id, label, *_payloads(scenario, missing, rng))
+        elif scenario.attack == 'fuzzing' and scenario.rate is None:
+            targets = index.between(scenario.can_id, start, end)
+            targets = targets[keep[targets]][:scenario.count]
+            payloads[targets], dlcs[targets] = _payloads(scenario, len(targets), rng)
+            labels[targets] = label
+            missing = (scenario.count or 0) - len(targets)
+            if missing > 0:
+                add(np.linspace(start, end, missing), scenario.can_id, label, *_payloads(scenario, missing, rng))
+        else:
+            size = int(round(scenario.duration * scenario.rate)) + 1
+            if scenario.count is not None:
+                size = min(size, scenario.count)
+            add(start + np.arange(size) / scenario.rate, scenario.can_id, label, *_payloads(scenario, size, rng))
+
+    columns = [timestamps[keep], can_ids[keep], payloads[keep], dlcs[keep], labels[keep]]
+    if added:
+        columns = [np.concatenate([column] + [block[field] for block in added]) for field, column in enumerate(columns)]
+    # Injected frames use the first interface of the capture.
+    interface = np.concatenate([interfaces[keep], np.zeros(len(columns[0]) - int(keep.sum()), dtype=np.uint8)])
+    order = np.argsort(columns[0], kind='stable')
+    injected = CanFrames(columns[0][order], columns[1][order], columns[2][order], columns[3][order],
+                         interface[order], frames.interfaces or ['slcan0'])
+    return injected, columns[4][order]
+
+
+def labeled_features(frames, scenarios, seed=None, **params):
+    """``compute_features`` of the injected capture, with a ``Label`` column."""
+    injected, labels = inject_attacks(frames, scenarios, seed)
+    df = injected.to_dataframe(compact=True)
+    df['Label'] = labels
+    return compute_features(df, **params)
+
+
+def random_scenarios(frames, variants, seed=None, attacks=('dos', 'fuzzing', 'suspension'),
+                     durations=(5.0, 20.0), counts=(500, 3000)):
+    """``variants`` scenario lists with random IDs, windows and counts.
+
+    Every list holds one scenario per attack in ``attacks``, placed between
+    10% and 90% of the capture; fuzzing and suspension target IDs that
+    appear in ``frames``.
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.unique(frames.can_id)
+    first, last = float(frames.timestamp.min()), float(frames.timestamp.max())
+    span = last - first
+    sets = []
+    for _ in range(variants):
+        scenarios = []
+        for attack in attacks:
+            duration = float(rng.uniform(*durations))
+            offset = float(rng.uniform(0.1 * span, max(0.1 * span, 0.9 * span - duration)))
+            scenario = {'attack': attack, 'offset': offset, 'duration': duration}
+            if attack == 'dos':
+                scenario['rate'] = float(rng.choice([1000.0, 2000.0, DOS_RATE]))
+            else:
+                scenario['can_id'] = int(rng.choice(ids))
+                scenario['count'] = int(rng.integers(*counts))
+            scenarios.append(scenario)
+        sets.append(scenarios)
+    return sets
+
+
+_base_frames = None
+
+
+def _set_base_frames(frames):
+    global _base_frames
+    _base_frames = frames
+
+
+def frames_digest(frames):
+    """BLAKE2b hex digest of the contents of a ``CanFrames``."""
+    digest = hashlib.blake2b(digest_size=20)
+    for name in ('timestamp', 'can_id', 'payload', 'dlc', 'interface'):
+        digest.update(np.ascontiguousarray(getattr(frames, name)).tobytes())
+    digest.update(json.dumps(list(frames.interfaces or [])).encode())
+    return digest.hexdigest()
+
+
+def variant_key(base_digest, scenarios, seed, params, prefix='variant'):
+    """Store key of the variant built from frames with ``base_digest``, ``scenarios``, ``seed`` and ``params``.
+
+    ``seed`` is the variant's ``SeedSequence``; like ``feature_key``, the
+    key changes whenever anything the table depends on does.
+    """
+    description = json.dumps({
+        'version': FEATURE_STORE_VERSION,
+        'frames': base_digest,
+        'scenarios': [AttackScenario.from_dict(scenario).to_dict() for scenario in scenarios],
+        'seed': [seed.entropy, list(seed.spawn_key)],
+        'params': params,
+    }, sort_keys=True)
+    return f"{prefix}-{hashlib.blake2b(description.encode(), digest_size=16).hexdigest()}"
+
+
+def _variant(scenarios, seed, params, store, key):
+    df = labeled_features(_base_frames, scenarios, np.random.default_rng(seed), **params)
+    if store is None:
+        return df
+    store.save(key, df, scenarios=[AttackScenario.from_dict(s).to_dict() for s in scenarios], params=params)
+    return key
+
+
+def parallel_variants(frames, scenario_sets, workers=None, seed=0, store=None, prefix='variant', **params):
+    """``labeled_features`` for many scenario lists on a process pool.
+
+    The base frames are sent to each worker once. Variant ``i`` draws from
+    its own child of ``SeedSequence(seed)``, so results do not depend on
+    the worker count. With a ``FeatureStore`` each table is saved under its
+    ``variant_key`` and the keys are returned, which keeps hundreds of
+    variants out of the parent's memory; variants already in the store are
+    not built again. Otherwise the DataFrames are returned.
+    """
+    workers = workers or os.cpu_count() or 1
+    seeds = np.random.SeedSequence(seed).spawn(len(scenario_sets))
+    base_digest = None if store is None else frames_digest(frames)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_set_base_frames, initargs=(frames,)) as pool:
+        results = []
+        for scenarios, child in zip(scenario_sets, seeds):
+            key = None if store is None else variant_key(base_digest, scenarios, child, params, prefix)
+            if key is not None and key in store:
+                results.append(key)
+            else:
+                results.append(pool.submit(_variant, scenarios, child, params, store, key))
+        return [result if isinstance(result, str) else result.result() for result in results]
+
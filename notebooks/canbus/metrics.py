@@ -0,0 +1,139 @@
+"""Stage timings and aggregated counters for the preprocessing and training runs.
+
+A ``Metrics`` object collects, for every stage run under ``stage()``, the
+wall and CPU time, frames processed, frames dropped or malformed and peak
+RSS, plus named counters with optional labels (large gaps per CAN ID, for
+example) that replace per-frame log lines. ``write()`` saves everything as
+JSON or, for a ``.prom`` path, in the Prometheus text format.
+
+``verbosity`` decides what reaches the console: ``QUIET`` prints nothing,
+``SUMMARY`` one line per stage, ``DETAIL`` also the tables and per-ID
+listings the notebooks used to print unconditionally.
+"""
+
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+QUIET, SUMMARY, DETAIL = 0, 1, 2
+METRICS_PREFIX = 'canbus'
+
+# Peak so far of every stage still open in this process, outermost first. A
+# nested stage resets the high-water mark, so it first folds the current one
+# into these; stages of other Metrics objects count too.
+_open_peaks = []
+
+
+def reset_peak_rss():
+    """Restart the peak-RSS high-water mark (Linux only); False if unsupported."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MiB (since the last reset on Linux)."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux, bytes on macOS, and never goes down.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class Metrics:
+    """Per-stage records and labeled counters of one run."""
+
+    def __init__(self, verbosity=SUMMARY):
+        self.verbosity = verbosity
+        self.stages = []
+        self.counters = {}
+
+    def log(self, message, level=SUMMARY):
+        """Print ``message`` when the verbosity is at least ``level``."""
+        if self.verbosity >= level:
+            print(message)
+
+    @contextmanager
+    def stage(self, name, frames=None, dropped=0):
+        """Time the enclosed block as stage ``name``.
+
+        Yields the stage record; set its ``frames`` and ``dropped`` entries
+        inside the block when they are only known there.
+        """
+        record = {'stage': name, 'frames': frames, 'dropped': dropped}
+        if _open_peaks:
+            current = peak_rss_mb()
+            _open_peaks[:] = [max(peak, current) for peak in _open_peaks]
+        reset_peak_rss()
+        _open_peaks.append(0.0)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = round(time.perf_counter() - wall, 6)
+            record['cpu_s'] = round(time.process_time() - cpu, 6)
+            record['peak_rss_mb'] = round(max(peak_rss_mb(), _open_peaks.pop()), 1)
+            self.stages.append(record)
+            frames = record['frames']
+            rate = f", {frames / record['wall_s']:,.0f} frames/s" if frames and record['wall_s'] else ''
+            dropped = f", {record['dropped']:,} dropped" if record['dropped'] else ''
+            counted = f", {frames:,} frames" if frames is not None else ''
+            self.log(f"[{name}] {record['wall_s']:.3f} s wall, {record['cpu_s']:.3f} s CPU{counted}{dropped}{rate}, "
+                     f"peak {record['peak_rss_mb']:.0f} MB")
+
+    def count(self, name, value=1, **labels):
+        """Add ``value`` to counter ``name`` with the given labels."""
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def counter(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def to_dict(self):
+        counters = {}
+        for (name, labels), value in sorted(self.counters.items()):
+            counters.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        return {'stages': self.stages, 'counters': counters}
+
+    def to_prometheus(self):
+        """The stages and counters in the Prometheus text exposition format."""
+        lines = []
+        fields = (('wall_s', 'stage_wall_seconds'), ('cpu_s', 'stage_cpu_seconds'), ('frames', 'stage_frames'),
+                  ('dropped', 'stage_dropped_frames'), ('peak_rss_mb', 'stage_peak_rss_megabytes'))
+        for field, metric in fields:
+            lines.append(f'# TYPE {METRICS_PREFIX}_{metric} gauge')
+            for record in self.stages:
+                if record[field] is not None:
+                    lines.append(f'{METRICS_PREFIX}_{metric}{{stage="{record["stage"]}"}} {record[field]}')
+        names = sorted({name for name, _ in self.counters})
+        for name in names:
+            metric = f'{METRICS_PREFIX}_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            for (counter, labels), value in sorted(self.counters.items()):
+                if counter == name:
+                    rendered = ','.join(f'{key}="{label}"' for key, label in labels)
+                    lines.append(f'{metric}{{{rendered}}} {value}' if rendered else f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Save as Prometheus text for ``.prom`` paths, JSON otherwise."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as output:
+            if path.suffix == '.prom':
+                output.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), output, indent=1)
+        self.log(f"Metrics saved to {path}")
+        return path
@@ -0,0 +1,121 @@
+"""Per-CAN-ID normal-traffic means used to normalize the timing features.
+
+``NormalStats`` is the compiled form of the ``normal_stats`` table from
+model_training.ipynb: sorted integer CAN IDs with dense arrays of mean
+inter-arrival and mean window count. A column of IDs maps to row codes with
+one ``searchsorted``, so normalizing a whole frame table is a gather and a
+divide. IDs that were not in normal traffic, and means of zero, normalize
+to ``DEFAULT_NORMALIZED`` as the notebooks' row-wise version did.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .frames import format_can_ids, parse_can_ids
+
+DEFAULT_NORMALIZED = 1.0
+NORMAL_STATS_FILENAME = 'normal_stats.npz'
+
+
+class NormalStats:
+    """Mean ``CAN_ID_Inter_Arrival`` and ``CAN_ID_Window_Count`` per CAN ID.
+
+    ``can_ids`` is a sorted uint32 array (see ``CanFrames``);
+    ``mean_inter_arrival`` and ``mean_window_count`` are float64 arrays
+    aligned with it.
+    """
+
+    __slots__ = ('can_ids', 'mean_inter_arrival', 'mean_window_count')
+
+    def __init__(self, can_ids, mean_inter_arrival, mean_window_count):
+        can_ids = np.asarray(can_ids, dtype=np.uint32)
+        order = np.argsort(can_ids, kind='stable')
+        self.can_ids = can_ids[order]
+        if (self.can_ids[1:] == self.can_ids[:-1]).any():
+            raise ValueError("Normal statistics list a CAN ID more than once.")
+        self.mean_inter_arrival = np.asarray(mean_inter_arrival, dtype=np.float64)[order]
+        self.mean_window_count = np.asarray(mean_window_count, dtype=np.float64)[order]
+
+    @classmethod
+    def from_frame(cls, normal_stats):
+        """Compile a table with ``CAN_ID``, ``Mean_Inter_Arrival`` and ``Mean_Window_Count``."""
+        return cls(
+            parse_can_ids(normal_stats['CAN_ID'].to_numpy()),
+            normal_stats['Mean_Inter_Arrival'].to_numpy(),
+            normal_stats['Mean_Window_Count'].to_numpy(),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as table:
+            return cls(table['can_ids'], table['mean_inter_arrival'], table['mean_window_count'])
+
+    def save(self, path):
+        # np.savez would append .npz to other suffixes; write through a handle.
+        with open(path, 'wb') as handle:
+            np.savez(handle, can_ids=self.can_ids, mean_inter_arrival=self.mean_inter_arrival,
+                     mean_window_count=self.mean_window_count)
+
+    def __len__(self):
+        return len(self.can_ids)
+
+    def codes(self, can_ids):
+        """Row of each CAN ID in the table, or -1 for IDs it does not list."""
+        can_ids = parse_can_ids(can_ids)
+        if len(self.can_ids) == 0:
+            return np.full(len(can_ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.can_ids, can_ids), len(self.can_ids) - 1)
+        return np.where(self.can_ids[positions] == can_ids, positions, -1)
+
+    def normalize(self, can_ids, inter_arrivals, window_counts):
+        """``Norm_Inter_Arrival`` and ``Norm_Window_Count`` for whole columns."""
+        codes = self.codes(can_ids)
+        return (
+            _normalized(inter_arrivals, self.mean_inter_arrival, codes),
+            _normalized(window_counts, self.mean_window_count, codes),
+        )
+
+    def get(self, can_id):
+        """``(mean_inter_arrival, mean_window_count)`` of one integer CAN ID, or None."""
+        position = int(np.searchsorted(self.can_ids, can_id))
+        if position < len(self.can_ids) and self.can_ids[position] == can_id:
+            return float(self.mean_inter_arrival[position]), float(self.mean_window_count[position])
+        return None
+
+    def to_frame(self):
+        """The table as the notebooks build it, with candump-style ID strings."""
+        return pd.DataFrame({
+            'CAN_ID': format_can_ids(self.can_ids).astype(object),
+            'Mean_Inter_Arrival': self.mean_inter_arrival,
+            'Mean_Window_Count': self.mean_window_count,
+        })
+
+
+def _normalized(values, means, codes):
+    values = np.asarray(values, dtype=np.float64)
+    # Unknown IDs gather slot 0 and are then replaced by the default.
+    row_means = means[np.maximum(codes, 0)] if len(means) else np.zeros(len(values))
+    usable = (codes >= 0) & (row_means != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = values / row_means
+    return np.where(usable, ratios, DEFAULT_NORMALIZED)
+
+
+def normal_stats_path(model_path):
+    """Where the compiled table is kept for a model file: the same directory."""
+    return Path(model_path).with_name(NORMAL_STATS_FILENAME)
+
+
+def normalize_features(df, normal_stats):
+    """Add ``Norm_Inter_Arrival`` and ``Norm_Window_Count`` to a feature table.
+
+    ``normal_stats`` is a ``NormalStats`` or the notebooks' DataFrame form.
+    """
+    if not isinstance(normal_stats, NormalStats):
+        normal_stats = NormalStats.from_frame(normal_stats)
+    df['Norm_Inter_Arrival'], df['Norm_Window_Count'] = normal_stats.normalize(
+        df['CAN_ID'].to_numpy(), df['CAN_ID_Inter_Arrival'].to_numpy(), df['CAN_ID_Window_Count'].to_numpy()
+    )
+    return df
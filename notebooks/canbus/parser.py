@@ -0,0 +1,436 @@
+"""Vectorized parser for ``candump -l`` logs.
+
+Lines look like ``(1508687283.891357) slcan0 12E#C680027FD0FFFF00``. The log
+is read in large byte chunks and every chunk is decoded with array operations
+straight into the columns of a ``CanFrames`` block, so no per-frame Python
+objects are ever created.
+
+Each chunk is first matched against candump's fixed layout (a ``%010d.%06d``
+timestamp and the same interface name as the first line), which needs no
+searching at all. Lines that do not fit it, such as hand-edited logs, other
+timestamp widths (integer seconds included) or runs of spaces and tabs
+between the fields, go through a general path that locates the separators
+with binary searches. Anything still malformed is counted.
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+from .frames import CAN_EFF_FLAG, CanFrames
+
+# Every chunk goes through a few dozen passes over (n, 8-24) matrices; at a
+# few MiB they stay in cache, and larger chunks parse markedly slower.
+CHUNK_SIZE = 4 * 1024 * 1024
+
+MAX_TIMESTAMP_CHARS = 24
+MAX_INTERFACE_CHARS = 16
+MAX_ID_CHARS = 8
+MAX_PAYLOAD_CHARS = 16
+
+_PADDING = 64
+_NEWLINE = ord('\n')
+_SPACE = ord(' ')
+_TAB = ord('\t')
+
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[list(b' \t\r\n\v\f')] = True
+
+
+class ParseResult:
+    """Frames decoded from a log plus how many lines had to be dropped."""
+
+    __slots__ = ('frames', 'lines', 'skipped')
+
+    def __init__(self, frames, lines, skipped):
+        self.frames = frames
+        self.lines = lines
+        self.skipped = skipped
+
+
+def _windows(buf, width):
+    return np.lib.stride_tricks.sliding_window_view(buf, width)
+
+
+def _words(buf):
+    """Little-endian uint64 starting at every byte offset of ``buf``."""
+    return np.ndarray((len(buf) - 7,), dtype='<u8', buffer=buf, strides=(1,))
+
+
+# Fields are gathered once into (n, 8k) uint8 matrices and then handled with
+# flat elementwise arithmetic, bit packing and uint64 views. Broadcasting,
+# np.where, lookup tables and reductions along the short axis all pay a
+# per-row overhead that dominates at these widths.
+
+_LOW_BITS = np.array([(1 << bits) - 1 for bits in range(65)], dtype=np.uint64)
+_ASCII_ZEROS = np.uint64(0x3030303030303030)
+_HIGH_BITS = np.uint64(0x8080808080808080)
+_NINES = np.uint64(0x7676767676767676)
+
+
+def _hex_field(chars, lengths):
+    """Decode right-aligned hex digits in an (n, 8k) matrix.
+
+    Only the last ``lengths`` columns of each row belong to the field.
+    Returns the big-endian values and a validity mask.
+    """
+    width = chars.shape[1]
+    # Non-digits wrap around to >= 10 in the first term and non-letters to
+    # >= 16 in the second, so the minimum is the nibble or something >= 16.
+    nibbles = np.minimum(chars - np.uint8(ord('0')), (chars | np.uint8(0x20)) - np.uint8(ord('a') - 10))
+    bad = np.packbits(nibbles.ravel() >= 16).view(f'>u{width // 8}').astype(np.uint64)
+    valid = (bad & _LOW_BITS[lengths]) == 0
+    nibbles &= np.uint8(0xF)
+    pairs = nibbles.view('<u2')
+    packed = (((pairs & np.uint16(0xF)) << np.uint16(4)) | (pairs >> np.uint16(8))).astype(np.uint8)
+    values = packed.view(f'>u{width // 2}').ravel().astype(np.uint64)
+    return values & _LOW_BITS[4 * lengths], valid
+
+
+def _decimal_words(digits):
+    """Value of eight ASCII digits per uint64 (first char most significant).
+
+    Works in place on ``digits`` and returns it together with a mask of the
+    words that held only digits. This is the classic SWAR trick: three
+    multiplies per eight digits.
+    """
+    digits ^= _ASCII_ZEROS
+    bad = digits + _NINES
+    bad |= digits
+    bad &= _HIGH_BITS
+    for shift, mask in ((8, 0x00FF00FF00FF00FF), (16, 0x0000FFFF0000FFFF), (32, 0xFFFFFFFF)):
+        carry = digits >> np.uint64(shift)
+        digits *= np.uint64(10 ** (shift // 8))
+        digits += carry
+        digits &= np.uint64(mask)
+    return digits, bad == 0
+
+
+def _candump_timestamps(head, middle, tail):
+    """Decode ``(%010d.%06d)`` timestamps from the line's first three words.
+
+    ``head``, ``middle`` and ``tail`` hold bytes 0-7, 8-15 and 16-23 of each
+    line. The sixteen digits are regrouped into two eight-digit words,
+    accumulated into an integer and divided once by 1e6, which is correctly
+    rounded (identical to ``float()``) while the integer stays below 2**53.
+    Returns the values and a validity mask.
+    """
+    seconds = head >> np.uint64(8)
+    seconds |= middle << np.uint64(56)
+    # Seconds digits 9-10 followed by the six fraction digits, minus the dot.
+    fraction = (middle >> np.uint64(8)) & np.uint64(0xFFFF)
+    fraction |= (middle >> np.uint64(32)) << np.uint64(16)
+    fraction |= tail << np.uint64(48)
+    seconds, valid = _decimal_words(seconds)
+    fraction, fraction_ok = _decimal_words(fraction)
+    valid &= fraction_ok
+    seconds *= np.uint64(10 ** 8)
+    seconds += fraction
+    valid &= seconds < np.uint64(2 ** 53)
+    return seconds.astype(np.float64) / 1e6, valid
+
+
+def _general_timestamps(chars, lengths):
+    """Decode right-aligned ``seconds[.fraction]`` text of any width.
+
+    Same integer-then-divide scheme as the candump path; values with more
+    than sixteen significant digits fall back to Python's ``float``.
+    """
+    width = chars.shape[1]
+    columns = np.arange(width)
+    chars = chars * (columns >= (width - lengths)[:, None])
+    is_dot = chars == ord('.')
+    has_dot = is_dot.any(axis=1)
+    dot_column = np.where(has_dot, is_dot.argmax(axis=1), width)
+    fraction_digits = np.where(has_dot, width - 1 - dot_column, 0)
+
+    # Drop the dot by shifting everything left of it one column to the right;
+    # a second dot survives the shift and is caught as a stray character.
+    # Integer seconds have no dot and are used as they are.
+    shifted = np.zeros_like(chars)
+    shifted[:, 1:] = chars[:, :-1]
+    text = np.where(columns <= np.where(has_dot, dot_column, -1)[:, None], shifted, chars)
+    digits = text - np.uint8(ord('0'))
+    is_digit = digits < 10
+    valid = ~((text != 0) & ~is_digit).any(axis=1) & is_digit.any(axis=1)
+    digits = np.where(is_digit, digits, 0).astype(np.uint8)
+
+    exact = valid & ~digits[:, :width - 16].any(axis=1)
+    words = np.ascontiguousarray(digits[:, width - 16:]).view('<u8') | _ASCII_ZEROS
+    values, _ = _decimal_words(words)
+    mantissa = values[:, 0] * np.uint64(10 ** 8) + values[:, 1]
+    exact &= mantissa < np.uint64(2 ** 53)
+    timestamp = mantissa.astype(np.float64) / 10.0 ** fraction_digits
+
+    fallback = np.flatnonzero(valid & ~exact)
+    if len(fallback):
+        timestamp[fallback] = [float(bytes(row).lstrip(b'\0')) for row in chars[fallback]]
+    return timestamp, valid
+
+
+def _next_position(positions, after, limit):
+    """Position of the first marker ``>= after``, or ``limit`` if there is none."""
+    index = np.searchsorted(positions, after)
+    found = np.full(len(after), limit, dtype=np.int64)
+    inside = index < len(positions)
+    found[inside] = positions[index[inside]]
+    return found
+
+
+def _skip_whitespace(buf, positions, ends):
+    """Advance every position past whitespace, stopping at ``ends``."""
+    while True:
+        move = (positions < ends) & _WHITESPACE[buf[positions]]
+        if not move.any():
+            return positions
+        positions = positions + move
+
+
+def _template_interface(buf, starts, ends):
+    """Interface name of the first candump-layout line among the first few, or None."""
+    for start, end in zip(starts[:16].tolist(), ends[:16].tolist()):
+        line = buf[start:end].tobytes()
+        name_end = line.find(b' ', 20)
+        if line[:1] == b'(' and line[18:20] == b') ' and 20 < name_end <= 20 + MAX_INTERFACE_CHARS:
+            return line[20:name_end]
+    return None
+
+
+def _layout_pattern(name):
+    """(values, masks) words matching ``(dddddddddd.dddddd) <name> `` byte for byte."""
+    layout = b'(' + b'\0' * 10 + b'.' + b'\0' * 6 + b') ' + name + b' '
+    care = bytes(0 if byte == 0 else 0xFF for byte in layout)
+    padding = -len(layout) % 8
+    layout += b'\0' * padding
+    care += b'\0' * padding
+    return (
+        np.frombuffer(layout, dtype='<u8'),
+        np.frombuffer(care, dtype='<u8'),
+    )
+
+
+def _parse_candump_layout(buf, starts, ends, name):
+    """Decode lines in exact candump layout on interface ``name``.
+
+    Returns (ok, timestamp, can_id, payload, dlc) for every line; rows with
+    ``ok`` False must go through the general path.
+    """
+    words = _words(buf)
+    values, masks = _layout_pattern(name)
+    heads = [words[starts + 8 * index] for index in range(len(values))]
+    ok = np.ones(len(starts), dtype=bool)
+    for word, value, mask in zip(heads, values, masks):
+        ok &= (word & mask) == value
+
+    id_starts = starts + 21 + len(name)
+    rest = ends - id_starts
+    # rest = len(id) + 1 + len(payload) and the payload length is even, so
+    # its parity tells 3-digit standard IDs from 8-digit extended ones.
+    extended = (rest & 1).astype(bool)
+    id_lengths = np.where(extended, 8, 3)
+    hashes = id_starts + id_lengths
+    payload_lengths = ends - hashes - 1
+    ok &= (payload_lengths >= 0) & (payload_lengths <= MAX_PAYLOAD_CHARS)
+    ok &= buf[hashes] == ord('#')
+    payload_lengths = np.clip(payload_lengths, 0, MAX_PAYLOAD_CHARS)
+
+    timestamp, timestamp_ok = _candump_timestamps(*heads[:3])
+    id_chars = words[hashes - MAX_ID_CHARS].view(np.uint8).reshape(-1, MAX_ID_CHARS)
+    can_id, id_ok = _hex_field(id_chars, id_lengths)
+    payload, payload_ok = _hex_field(_windows(buf, MAX_PAYLOAD_CHARS)[ends - MAX_PAYLOAD_CHARS], payload_lengths)
+    ok &= timestamp_ok & id_ok & payload_ok
+    can_id = can_id.astype(np.uint32)
+    can_id[extended] |= np.uint32(CAN_EFF_FLAG)
+    return ok, timestamp, can_id, payload, (payload_lengths // 2).astype(np.uint8)
+
+
+def _parse_general(buf, starts, ends, limit, interfaces):
+    """Decode arbitrary lines, locating the separators with binary searches.
+
+    Returns (blank, ok, timestamp, can_id, payload, dlc, interface).
+    """
+    # Equivalent of line.strip(): usually zero or one pass each.
+    starts = _skip_whitespace(buf, starts, ends)
+    while True:
+        move = (ends > starts) & _WHITESPACE[buf[ends - 1]]
+        if not move.any():
+            break
+        ends = ends - move
+
+    # Fields are split on runs of spaces and tabs, like str.split(); the
+    # space after the closing parenthesis is optional.
+    closes = _next_position(np.flatnonzero(buf == ord(')')), starts, limit)
+    space_positions = np.flatnonzero((buf == _SPACE) | (buf == _TAB))
+    interface_starts = _skip_whitespace(buf, closes + 1, ends)
+    interface_ends = _next_position(space_positions, interface_starts, limit)
+    id_starts = _skip_whitespace(buf, interface_ends, ends)
+    hashes = _next_position(np.flatnonzero(buf == ord('#')), id_starts, limit)
+    extra_spaces = _next_position(space_positions, id_starts, limit)
+
+    timestamp_lengths = closes - starts - 1
+    interface_lengths = interface_ends - interface_starts
+    id_lengths = hashes - id_starts
+    payload_lengths = ends - hashes - 1
+
+    blank = ends == starts
+    ok = (
+        ~blank
+        & (buf[starts] == ord('('))
+        & (hashes < ends)
+        & (extra_spaces >= hashes)
+        & (timestamp_lengths >= 1) & (timestamp_lengths <= MAX_TIMESTAMP_CHARS)
+        & (interface_lengths >= 1) & (interface_lengths <= MAX_INTERFACE_CHARS)
+        & (id_lengths >= 1) & (id_lengths <= MAX_ID_CHARS)
+        & (payload_lengths >= 0) & (payload_lengths <= MAX_PAYLOAD_CHARS)
+        & (payload_lengths % 2 == 0)
+    )
+    # Park rejected rows on empty fields before gathering.
+    timestamp_lengths = np.where(ok, timestamp_lengths, 0)
+    interface_lengths = np.where(ok, interface_lengths, 0)
+    id_lengths = np.where(ok, id_lengths, 0)
+    payload_lengths = np.where(ok, payload_lengths, 0)
+    closes = np.where(ok, closes, starts)
+    hashes = np.where(ok, hashes, starts)
+    interface_starts = np.where(ok, interface_starts, starts)
+    ends = np.where(ok, ends, starts)
+
+    timestamp, timestamp_ok = _general_timestamps(
+        _windows(buf, MAX_TIMESTAMP_CHARS)[closes - MAX_TIMESTAMP_CHARS], timestamp_lengths
+    )
+    can_id, id_ok = _hex_field(_windows(buf, MAX_ID_CHARS)[hashes - MAX_ID_CHARS], id_lengths)
+    payload, payload_ok = _hex_field(_windows(buf, MAX_PAYLOAD_CHARS)[ends - MAX_PAYLOAD_CHARS], payload_lengths)
+    ok &= timestamp_ok & id_ok & payload_ok
+    can_id = can_id.astype(np.uint32)
+    can_id[id_lengths > 3] |= np.uint32(CAN_EFF_FLAG)
+
+    names = _windows(buf, MAX_INTERFACE_CHARS)[interface_starts]
+    names = names * (np.arange(MAX_INTERFACE_CHARS) < interface_lengths[:, None])
+    names = names.astype(np.uint8).view(f'S{MAX_INTERFACE_CHARS}').ravel()
+    unique_names, inverse = np.unique(names[ok], return_inverse=True)
+    remap = np.array([
+        interfaces.setdefault(name.decode('ascii', errors='replace'), len(interfaces))
+        for name in unique_names
+    ], dtype=np.uint8)
+    interface = np.zeros(len(starts), dtype=np.uint8)
+    interface[ok] = remap[inverse.ravel()]
+    dlc = (payload_lengths // 2).astype(np.uint8)
+    return blank, ok, timestamp, can_id, payload, dlc, interface
+
+
+def _parse_padded(buf, size, interfaces):
+    """Parse ``size`` bytes of complete lines stored at ``buf[_PADDING:]``."""
+    limit = _PADDING + size
+    newlines = np.flatnonzero(buf[_PADDING:limit] == _NEWLINE) + _PADDING
+    starts = np.concatenate(([_PADDING], newlines + 1))
+    ends = np.concatenate((newlines, [limit]))
+    if buf[limit - 1] == _NEWLINE:
+        # No empty last line, so a clean chunk needs no take() at the end.
+        starts, ends = starts[:-1], ends[:-1]
+    ends -= buf[ends - 1] == ord('\r')
+    nonblank = ends > starts
+    lines = int(np.count_nonzero(nonblank))
+
+    name = _template_interface(buf, starts, ends)
+    if name is not None:
+        code = interfaces.setdefault(name.decode('ascii', errors='replace'), len(interfaces))
+        ok, timestamp, can_id, payload, dlc = _parse_candump_layout(buf, starts, ends, name)
+        interface = np.full(len(starts), code, dtype=np.uint8)
+    else:
+        ok = np.zeros(len(starts), dtype=bool)
+        timestamp = np.zeros(len(starts), dtype=np.float64)
+        can_id = np.zeros(len(starts), dtype=np.uint32)
+        payload = np.zeros(len(starts), dtype=np.uint64)
+        dlc = np.zeros(len(starts), dtype=np.uint8)
+        interface = np.zeros(len(starts), dtype=np.uint8)
+
+    rest = np.flatnonzero(~ok & nonblank)
+    if len(rest):
+        blank, *parsed = _parse_general(buf, starts[rest], ends[rest], limit, interfaces)
+        lines -= int(np.count_nonzero(blank))
+        for column, values in zip((ok, timestamp, can_id, payload, dlc, interface), parsed):
+            column[rest] = values
+
+    frames = CanFrames(timestamp, can_id, payload, dlc, interface, list(interfaces))
+    if not ok.all():
+        frames = frames.take(ok)
+    return ParseResult(frames, lines, lines - len(frames))
+
+
+def _last_newline(view, start, end, step=4096):
+    """Offset of the last newline in ``view[start:end]``, or ``start - 1``."""
+    while end > start:
+        block_start = max(start, end - step)
+        found = bytes(view[block_start:end]).rfind(b'\n')
+        if found >= 0:
+            return block_start + found
+        end = block_start
+    return start - 1
+
+
+def parse_can_bytes(data, interfaces=None):
+    """Parse a buffer of complete candump lines.
+
+    ``interfaces`` is an optional ``{name: code}`` dict shared between calls
+    so that interface codes stay stable across chunks. Returns a
+    ``ParseResult``; blank lines are ignored and any other line that does not
+    match the candump layout is counted in ``skipped``.
+    """
+    if interfaces is None:
+        interfaces = {}
+    if not data:
+        return ParseResult(CanFrames.empty(), 0, 0)
+    # Pad both ends so every fixed-width window stays inside the buffer.
+    buf = np.zeros(len(data) + 2 * _PADDING, dtype=np.uint8)
+    buf[_PADDING:_PADDING + len(data)] = np.frombuffer(data, dtype=np.uint8)
+    return _parse_padded(buf, len(data), interfaces)
+
+
+def parse_can_log(input_file_path, chunk_size=CHUNK_SIZE, start=0, end=None):
+    """Parse a whole candump log file into a single ``ParseResult``.
+
+    The file is read with ``readinto`` straight into one padded buffer that
+    is reused for every chunk; a partial last line is carried over to the
+    next read. ``start`` and ``end`` restrict parsing to a byte range, which
+    should begin at a line start (see ``sharding.shard_ranges``).
+    """
+    input_file_path = Path(input_file_path)
+    interfaces = {}
+    blocks = []
+    lines = skipped = 0
+    buf = np.zeros(chunk_size + 2 * _PADDING, dtype=np.uint8)
+    view = memoryview(buf)
+    carried = 0
+    with open(input_file_path, 'rb') as log_file:
+        log_file.seek(start)
+        remaining = float('inf') if end is None else end - start
+        while True:
+            room = chunk_size - carried
+            if room == 0:
+                # A single line longer than the whole chunk: grow the buffer.
+                chunk_size *= 2
+                grown = np.zeros(chunk_size + 2 * _PADDING, dtype=np.uint8)
+                grown[:len(buf)] = buf
+                buf, view = grown, memoryview(grown)
+                room = chunk_size - carried
+            room = int(min(room, remaining))
+            read = log_file.readinto(view[_PADDING + carried:_PADDING + carried + room])
+            remaining -= read
+            filled = carried + read
+            if read == 0:
+                cut = filled
+            else:
+                cut = _last_newline(view, _PADDING, _PADDING + filled) + 1 - _PADDING
+            remainder = buf[_PADDING + cut:_PADDING + filled].copy()
+            if cut:
+                # Past ``filled`` the buffer is still zero from the last chunk.
+                buf[_PADDING + cut:_PADDING + filled] = 0
+                result = _parse_padded(buf, cut, interfaces)
+                blocks.append(result.frames)
+                lines += result.lines
+                skipped += result.skipped
+            if read == 0:
+                break
+            carried = len(remainder)
+            buf[_PADDING:_PADDING + cut + carried] = 0
+            buf[_PADDING:_PADDING + carried] = remainder
+    return ParseResult(CanFrames.concatenate(blocks), lines, skipped)
@@ -0,0 +1,445 @@
+"""Parallel hyperparameter search on cached, quantized training data.
+
+The notebook's ``max_depth=6``, ``learning_rate=0.1`` and 200 rounds were
+picked by hand. A grid search over ``XGBClassifier`` would rebuild the
+DMatrix from pandas for every trial; here the data is prepared once:
+
+1. ``quantize_splits`` runs the split and subsampling of
+   ``canbus.training`` over a chunk source, asks xgboost for the quantile
+   cuts of the (weighted) training rows and stores every training and
+   validation row as ``uint8`` bin codes, one byte per feature, in
+   ``.npy`` files. A later search with the same source, seed and
+   settings reuses them.
+   xgboost cannot save a ``QuantileDMatrix``, but a ``QuantileDMatrix``
+   built on the codes has one bin per code, so it splits the data exactly
+   where one built on the raw features would.
+2. ``search`` runs the trials on a process pool of ``workers`` processes
+   with ``threads_per_trial`` xgboost threads each. Every worker maps the
+   codes and builds its train and validation matrices once, then reuses
+   them for all of its trials.
+3. A trial stops at early stopping on the validation ``mlogloss`` or when
+   it is hopeless: from ``PRUNE_WARMUP`` rounds on, every ``PRUNE_EVERY``
+   rounds its loss and its worst F1 of the rare Fuzzing and Suspension
+   classes are compared with those of the other trials at the same round;
+   a trial below the median on both is pruned.
+
+The first trial is always the notebook's configuration, for reference.
+The report lists every trial with its validation scores, training time
+and inference cost (trees, microseconds per frame in batches and per
+single frame); the best one is the complete trial with the lowest loss.
+The trial models split on bin codes, so ``--model`` retrains the best
+configuration on the raw features with ``train_out_of_core``. From the
+notebooks directory::
+
+    python -m canbus.search --store-key generated-... --trials 40 --model ../models/xgboost_model.json
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import xgboost as xgb
+
+from .features import FEATURE_COLUMNS
+from .metrics import SUMMARY, Metrics
+from .store import FeatureStore
+from .training import (
+    CHUNK_ROWS,
+    DEFAULT_PARAMS,
+    EARLY_STOPPING_ROUNDS,
+    LABEL_NAMES,
+    MAX_ROUNDS,
+    TRAIN,
+    VALIDATION,
+    _scan,
+    _with_splits,
+    class_weights,
+    csv_chunks,
+    sampling_rates,
+    store_chunks,
+    train_out_of_core,
+)
+
+DEFAULT_WORK_DIR = Path(__file__).resolve().parents[2] / 'dataSet' / 'search'
+REPORT_FILENAME = 'search_report.json'
+MAX_BIN = 255
+MISSING_CODE = 255
+# Each worker holds its own matrices plus gradients (about 75 bytes per
+# training row), so the search trains on a smaller sample than the final model.
+MAX_TRAIN_ROWS = 2_000_000
+SKETCH_ROWS = 1_000_000
+RARE_CLASSES = (2, 3)
+PRUNE_WARMUP = 30
+PRUNE_EVERY = 10
+PRUNE_MIN_TRIALS = 3
+INFERENCE_BATCH = 4096
+# (kind, low, high) of every searched parameter; the rest come from DEFAULT_PARAMS.
+SEARCH_SPACE = {
+    'max_depth': ('int', 3, 10),
+    'eta': ('log', 0.02, 0.3),
+    'min_child_weight': ('log', 0.5, 50.0),
+    'subsample': ('uniform', 0.5, 1.0),
+    'colsample_bytree': ('uniform', 0.5, 1.0),
+    'lambda': ('log', 0.1, 10.0),
+}
+# The notebook's configuration (xgboost defaults for the rest), always trial 0.
+NOTEBOOK_PARAMS = {'max_depth': 6, 'eta': 0.1, 'min_child_weight': 1.0, 'subsample': 1.0, 'colsample_bytree': 1.0,
+                   'lambda': 1.0}
+
+
+def quantize_splits(chunks, directory, source=None, seed=0, max_bin=MAX_BIN, max_train_rows=MAX_TRAIN_ROWS,
+                    metrics=None):
+    """Write the training and validation rows of ``chunks`` as bin codes under ``directory``.
+
+    Returns the metadata dict (also saved as ``meta.json``). When the
+    directory already holds codes for the same ``source`` (any JSON value
+    naming the data, such as the store keys), seed and settings they are
+    reused; ``source=None`` always rebuilds.
+    """
+    if max_bin > MISSING_CODE:
+        raise ValueError(f'max_bin must be at most {MISSING_CODE}, got {max_bin}')
+    metrics = Metrics() if metrics is None else metrics
+    directory = Path(directory)
+    settings = {'source': source, 'seed': seed, 'max_bin': max_bin, 'max_train_rows': max_train_rows}
+    meta_path = directory / 'meta.json'
+    if source is not None and meta_path.exists():
+        with open(meta_path) as handle:
+            meta = json.load(handle)
+        if all(meta.get(name) == value for name, value in settings.items()):
+            metrics.log(f"Reusing quantized data in {directory}")
+            return meta
+
+    num_class = len(LABEL_NAMES)
+    with metrics.stage('scan') as stage:
+        counts, _ = _scan(chunks, seed, num_class)
+        stage['frames'] = int(counts.sum())
+    weights = class_weights(counts[TRAIN])
+    rates = sampling_rates(counts[TRAIN], max_train_rows)
+    sketch_rate = min(1.0, SKETCH_ROWS / max(float((counts[TRAIN] * rates).sum()), 1.0))
+
+    with metrics.stage('sketch') as stage:
+        rows = np.zeros(2, dtype=np.int64)
+        sample, sample_labels = [], []
+        for features, labels, _, splits, draws in _with_splits(chunks, seed):
+            kept = (splits <= VALIDATION) & (draws < rates[labels])
+            rows += np.bincount(splits[kept], minlength=3)[:2]
+            sketch = kept & (splits == TRAIN) & (draws < rates[labels] * sketch_rate)
+            sample.append(features[sketch])
+            sample_labels.append(labels[sketch])
+        sample_labels = np.concatenate(sample_labels)
+        stage['frames'] = len(sample_labels)
+        # xgboost's own weighted sketch; the first value of each feature is its minimum.
+        indptr, values = xgb.QuantileDMatrix(np.concatenate(sample), weight=weights[sample_labels] / rates[sample_labels],
+                                             max_bin=max_bin).get_quantile_cut()
+        cuts = [values[indptr[column] + 1:indptr[column + 1]] for column in range(len(FEATURE_COLUMNS))]
+        del sample, sample_labels
+
+    shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir(parents=True)
+    with metrics.stage('quantize', frames=int(rows.sum())):
+        outputs = {}
+        for split, name in ((TRAIN, 'train'), (VALIDATION, 'validation')):
+            outputs[split] = (
+                np.lib.format.open_memmap(directory / f'{name}.codes.npy', 'w+', np.uint8, (int(rows[split]), len(cuts))),
+                np.lib.format.open_memmap(directory / f'{name}.labels.npy', 'w+', np.int8, (int(rows[split]),)),
+            )
+        filled = [0, 0]
+        for features, labels, _, splits, draws in _with_splits(chunks, seed):
+            kept = draws < rates[labels]
+            for split in (TRAIN, VALIDATION):
+                selected = kept & (splits == split)
+                start, stop = filled[split], filled[split] + int(selected.sum())
+                codes, split_labels = outputs[split]
+                codes[start:stop] = encode(features[selected], cuts)
+                split_labels[start:stop] = labels[selected]
+                filled[split] = stop
+        for codes, split_labels in outputs.values():
+            codes.flush()
+            split_labels.flush()
+        del outputs
+
+    meta = {
+        **settings,
+        'feature_names': FEATURE_COLUMNS,
+        'cuts': [column.tolist() for column in cuts],
+        'frames': counts.tolist(),
+        'rows': {'train': int(rows[TRAIN]), 'validation': int(rows[VALIDATION])},
+        'class_weights': weights.tolist(),
+        'sampling_rates': rates.tolist(),
+    }
+    with open(meta_path, 'w') as handle:
+        json.dump(meta, handle)
+    metrics.log(f"Quantized {rows[TRAIN]:,} training and {rows[VALIDATION]:,} validation frames "
+                f"into {directory} ({max_bin} bins per feature)")
+    return meta
+
+
+def encode(features, cuts):
+    """Bin codes of ``features``: the bin xgboost would put each value in, ``MISSING_CODE`` for NaN."""
+    codes = np.empty(features.shape, dtype=np.uint8)
+    for column, column_cuts in enumerate(cuts):
+        values = features[:, column]
+        bins = np.minimum(np.searchsorted(column_cuts, values, side='right'), len(column_cuts) - 1)
+        codes[:, column] = np.where(np.isnan(values), MISSING_CODE, bins)
+    return codes
+
+
+class CodesIter(xgb.DataIter):
+    """Feeds stored bin codes to a ``QuantileDMatrix`` without a float copy of the whole split."""
+
+    def __init__(self, codes, labels, weights, chunk_rows=CHUNK_ROWS):
+        self._codes = codes
+        self._labels = labels
+        self._weights = weights
+        self._chunk_rows = chunk_rows
+        self._start = 0
+        super().__init__()
+
+    def reset(self):
+        self._start = 0
+
+    def next(self, input_data):
+        if self._start >= len(self._labels):
+            return False
+        rows = slice(self._start, self._start + self._chunk_rows)
+        features = self._codes[rows].astype(np.float32)
+        features[self._codes[rows] == MISSING_CODE] = np.nan
+        labels = np.asarray(self._labels[rows], dtype=np.int32)
+        input_data(data=features, label=labels, weight=self._weights[labels], feature_names=FEATURE_COLUMNS)
+        self._start += self._chunk_rows
+        return True
+
+
+def sample_params(rng, space=SEARCH_SPACE):
+    """One configuration drawn from ``space``; log-scaled ranges are sampled uniformly in log."""
+    params = {}
+    for name, (kind, low, high) in space.items():
+        if kind == 'int':
+            params[name] = int(rng.integers(low, high + 1))
+        elif kind == 'log':
+            params[name] = round(float(math.exp(rng.uniform(math.log(low), math.log(high)))), 6)
+        else:
+            params[name] = round(float(rng.uniform(low, high)), 6)
+    return params
+
+
+def _rare_f1(labels, frame_weights):
+    """Custom metric: the lowest F1 of the rare classes, each frame counted once."""
+    num_class = len(LABEL_NAMES)
+
+    def metric(predictions, _):
+        predicted = predictions.reshape(len(labels), -1).argmax(axis=1)
+        confusion = np.bincount(labels * num_class + predicted, frame_weights,
+                                minlength=num_class * num_class).reshape(num_class, num_class)
+        scores = []
+        for label in RARE_CLASSES:
+            true_positive = confusion[label, label]
+            denominator = confusion[label].sum() + confusion[:, label].sum()
+            scores.append(2 * true_positive / denominator if denominator else 1.0)
+        return 'rare-f1', float(min(scores))
+    return metric
+
+
+class MedianPruner(xgb.callback.TrainingCallback):
+    """Stops a trial that is below the median of the other trials on loss and rare-class F1.
+
+    ``curves`` is shared by all workers (a ``multiprocessing.Manager``
+    dict): trial -> list of ``(loss, rare_f1)`` at every checkpoint.
+    """
+
+    def __init__(self, trial, curves, warmup=PRUNE_WARMUP, every=PRUNE_EVERY, min_trials=PRUNE_MIN_TRIALS):
+        self.trial = trial
+        self.curves = curves
+        self.warmup = warmup
+        self.every = every
+        self.min_trials = min_trials
+        self.pruned_at = None
+        self._curve = []
+        super().__init__()
+
+    def after_iteration(self, model, epoch, evals_log):
+        rounds = epoch + 1
+        if rounds < self.warmup or (rounds - self.warmup) % self.every:
+            return False
+        scores = evals_log['validation']
+        self._curve.append((scores['mlogloss'][-1], scores['rare-f1'][-1]))
+        self.curves[self.trial] = self._curve
+        checkpoint = len(self._curve) - 1
+        others = [curve[checkpoint] for trial, curve in self.curves.items()
+                  if trial != self.trial and len(curve) > checkpoint]
+        if len(others) < self.min_trials:
+            return False
+        loss, rare_f1 = self._curve[-1]
+        if loss > np.median([other[0] for other in others]) and rare_f1 < np.median([other[1] for other in others]):
+            self.pruned_at = rounds
+            return True
+        return False
+
+
+_worker = None
+
+
+def _load_worker(directory, threads, curves):
+    """Process pool initializer: maps the codes and builds this worker's matrices once."""
+    global _worker
+    directory = Path(directory)
+    with open(directory / 'meta.json') as handle:
+        meta = json.load(handle)
+    weights = np.asarray(meta['class_weights'], dtype=np.float32)
+    rates = np.asarray(meta['sampling_rates'], dtype=np.float32)
+    matrices = {}
+    for name in ('train', 'validation'):
+        codes = np.load(directory / f'{name}.codes.npy', mmap_mode='r')
+        labels = np.load(directory / f'{name}.labels.npy', mmap_mode='r')
+        # Kept rows stand for the ones sampled away, as in training.ChunkIter.
+        matrices[name] = xgb.QuantileDMatrix(CodesIter(codes, labels, weights / rates),
+                                             max_bin=MISSING_CODE + 1, ref=matrices.get('train'), nthread=threads)
+    labels = np.asarray(np.load(directory / 'validation.labels.npy'), dtype=np.int64)
+    codes = np.load(directory / 'validation.codes.npy', mmap_mode='r')[:INFERENCE_BATCH].astype(np.float32)
+    _worker = {
+        'threads': threads,
+        'curves': curves,
+        'train': matrices['train'],
+        'validation': matrices['validation'],
+        'metric': _rare_f1(labels, (1.0 / rates)[labels]),
+        'inference_rows': codes,
+    }
+
+
+def _latency(predict, rows, repeats=20):
+    predict(rows)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict(rows)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def _run_trial(trial, params, max_rounds, early_stopping_rounds):
+    params = {**DEFAULT_PARAMS, **params, 'nthread': _worker['threads']}
+    pruner = MedianPruner(trial, _worker['curves'])
+    stopping = xgb.callback.EarlyStopping(rounds=early_stopping_rounds, metric_name='mlogloss',
+                                          data_name='validation')
+    history = {}
+    start = time.perf_counter()
+    booster = xgb.train(params, _worker['train'], max_rounds, evals=[(_worker['validation'], 'validation')],
+                        custom_metric=_worker['metric'], callbacks=[stopping, pruner], evals_result=history,
+                        verbose_eval=False)
+    train_seconds = time.perf_counter() - start
+    rounds = booster.num_boosted_rounds()
+    losses = history['validation']['mlogloss']
+    best_iteration = int(np.argmin(losses))
+    booster = booster[:best_iteration + 1]
+    rows = _worker['inference_rows']
+    return {
+        'trial': trial,
+        'params': {name: params[name] for name in SEARCH_SPACE},
+        'status': 'pruned' if pruner.pruned_at else 'complete',
+        'rounds': rounds,
+        'best_iteration': best_iteration,
+        'mlogloss': losses[best_iteration],
+        'rare_f1': history['validation']['rare-f1'][best_iteration],
+        'train_s': round(train_seconds, 3),
+        'trees': best_iteration + 1,
+        'inference_us_per_frame': round(_latency(booster.inplace_predict, rows) / len(rows) * 1e6, 3),
+        'inference_us_single_frame': round(_latency(booster.inplace_predict, rows[:1]) * 1e6, 1),
+    }
+
+
+def search(directory, trials=20, workers=None, threads_per_trial=1, max_rounds=MAX_ROUNDS,
+           early_stopping_rounds=EARLY_STOPPING_ROUNDS, seed=0, metrics=None):
+    """Run ``trials`` configurations on the codes in ``directory``; see the module docstring.
+
+    ``workers`` defaults to as many processes as fit ``threads_per_trial``
+    threads each on the machine. Returns the report dict.
+    """
+    metrics = Metrics() if metrics is None else metrics
+    workers = workers or max(1, (os.cpu_count() or 1) // threads_per_trial)
+    rng = np.random.default_rng(seed)
+    configurations = [NOTEBOOK_PARAMS] + [sample_params(rng) for _ in range(trials - 1)]
+    results = []
+    with metrics.stage('search') as stage, multiprocessing.Manager() as manager:
+        curves = manager.dict()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_load_worker,
+                                 initargs=(str(directory), threads_per_trial, curves)) as pool:
+            futures = [pool.submit(_run_trial, trial, params, max_rounds, early_stopping_rounds)
+                       for trial, params in enumerate(configurations)]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                metrics.count('search_trials', status=result['status'])
+                metrics.log(f"Trial {result['trial']:3d} {result['status']:<8} {result['rounds']:4d} rounds, "
+                            f"mlogloss {result['mlogloss']:.5f}, rare F1 {result['rare_f1']:.4f}, "
+                            f"{result['train_s']:7.1f} s, {result['inference_us_per_frame']:.2f} us/frame")
+        stage['trials'] = len(results)
+    results.sort(key=lambda result: result['trial'])
+    complete = [result for result in results if result['status'] == 'complete'] or results
+    best = min(complete, key=lambda result: result['mlogloss'])
+    metrics.log(f"Best trial {best['trial']}: {best['params']} ({best['trees']} trees, "
+                f"mlogloss {best['mlogloss']:.5f}, rare F1 {best['rare_f1']:.4f}, {best['train_s']:.1f} s to train, "
+                f"{best['inference_us_per_frame']:.2f} us/frame)")
+    return {
+        'workers': workers,
+        'threads_per_trial': threads_per_trial,
+        'max_rounds': max_rounds,
+        'early_stopping_rounds': early_stopping_rounds,
+        'seed': seed,
+        'best': best,
+        'trials': results,
+        **metrics.to_dict(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search XGBoost hyperparameters on cached quantized data.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--store-key', action='append', help='cached feature table (repeat for several)')
+    source.add_argument('--csv', action='append', help='labeled CSV export (repeat for several)')
+    parser.add_argument('--store-root', help='FeatureStore directory (default dataSet/features)')
+    parser.add_argument('--work-dir', default=str(DEFAULT_WORK_DIR), help='where the quantized data is kept')
+    parser.add_argument('--report', help=f'JSON report (default {REPORT_FILENAME} in the work directory)')
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--workers', type=int, help='trials run at once (default: CPUs / threads per trial)')
+    parser.add_argument('--threads-per-trial', type=int, default=1)
+    parser.add_argument('--max-rounds', type=int, default=MAX_ROUNDS)
+    parser.add_argument('--early-stopping-rounds', type=int, default=EARLY_STOPPING_ROUNDS)
+    parser.add_argument('--max-train-rows', type=int, default=MAX_TRAIN_ROWS,
+                        help='subsample the largest classes above this many training rows (0 for no limit)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--seed', type=int, default=0, help='seed of the train/validation/test split')
+    parser.add_argument('--search-seed', type=int, default=0, help='seed of the sampled configurations')
+    parser.add_argument('--model', help='retrain the best configuration on the raw features and save it here')
+    args = parser.parse_args()
+
+    if args.store_key:
+        store = FeatureStore(args.store_root) if args.store_root else FeatureStore()
+        chunks = store_chunks(store, args.store_key, args.chunk_rows)
+        source = {'store': str(store.root), 'keys': args.store_key}
+    else:
+        chunks = csv_chunks(args.csv, args.chunk_rows)
+        source = {'csv': [[str(Path(path).resolve()), os.path.getsize(path), os.path.getmtime(path)]
+                          for path in args.csv]}
+    metrics = Metrics(SUMMARY)
+    quantize_splits(chunks, args.work_dir, source, args.seed, max_train_rows=args.max_train_rows or None,
+                    metrics=metrics)
+    report = search(args.work_dir, args.trials, args.workers, args.threads_per_trial, args.max_rounds,
+                    args.early_stopping_rounds, args.search_seed, metrics)
+    report_path = Path(args.report) if args.report else Path(args.work_dir) / REPORT_FILENAME
+    with open(report_path, 'w') as output:
+        json.dump(report, output, indent=1)
+    print(f"Report saved to {report_path}")
+    if args.model:
+        train_out_of_core(chunks, args.model, params=report['best']['params'], max_rounds=args.max_rounds,
+                          early_stopping_rounds=args.early_stopping_rounds, seed=args.seed, metrics=metrics)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+"""Local inference service scoring raw candump lines as they arrive.
+
+Run from the notebooks directory::
+
+    python -m canbus.service --model ../models/xgboost_model.json
+
+Clients connect over TCP on localhost (or a Unix socket with ``--unix``)
+and send candump lines. Each connection is one bus: its frames go through
+its own ``StreamingFeatureExtractor``, and every frame whose features are
+final joins a shared micro-batch. A batch is scored with one
+``inplace_predict`` call once it holds ``batch_size`` frames or its oldest
+frame has waited ``max_delay`` seconds. Each scored frame is answered with
+one line::
+
+    <timestamp> <CAN ID> <predicted label>
+
+with the label as the notebooks number it (0 Normal, 1 DoS, 2 Fuzzing,
+3 Suspension).
+
+Lines starting with ``#`` are commands: ``#flush`` scores everything the
+extractor still holds (end of a capture) and answers ``#flushed``;
+``#stats`` answers with a JSON line of the service counters. A client that
+closes its side without ``#flush`` still gets every answer before the
+connection is closed.
+
+Errors are answered with a ``#error ...`` line and the connection keeps
+being served: unknown commands, blocks of lines that would take a frame's
+timestamp back in time (dropped whole) and batches the model failed to
+score (their frames are counted in ``frames_failed``).
+
+The model and the normal-stats table saved next to it are loaded once at
+startup. Passing the ``.trees.npz`` written by ``python -m canbus.trees``
+instead of the JSON model skips importing xgboost.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+
+import numpy as np
+
+from .frames import format_can_ids
+from .normal_stats import NormalStats, normal_stats_path
+from .parser import parse_can_bytes
+from .streaming import StreamingFeatureExtractor
+from .trees import TREES_SUFFIX, CompiledTrees
+
+READ_SIZE = 1 << 16
+LATENCY_SAMPLES = 100_000
+
+
+def load_model(model_path):
+    """``(booster, normal_stats)`` for a model file; ``normal_stats`` is None when none was saved.
+
+    A ``.trees.npz`` from ``canbus.trees`` is scored with NumPy alone,
+    without importing xgboost.
+    """
+    if str(model_path).endswith(TREES_SUFFIX):
+        booster = CompiledTrees.load(model_path)
+    else:
+        import xgboost as xgb
+
+        booster = xgb.Booster(model_file=str(model_path))
+    stats_path = normal_stats_path(model_path)
+    if stats_path.is_file():
+        normal_stats = NormalStats.load(stats_path)
+    else:
+        print(f"Warning: {stats_path} not found; Norm_Inter_Arrival and Norm_Window_Count will be 1.0.")
+        normal_stats = None
+    return booster, normal_stats
+
+
+class ServiceMetrics:
+    """Counters and recent per-frame latencies (arrival to answer)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.connections = 0
+        self.frames_received = 0
+        self.frames_scored = 0
+        self.lines_skipped = 0
+        self.frames_failed = 0
+        self.batches = 0
+        self.scoring_seconds = 0.0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def to_dict(self):
+        uptime = time.perf_counter() - self.started
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return {
+            'uptime_s': round(uptime, 3),
+            'connections': self.connections,
+            'frames_received': self.frames_received,
+            'frames_scored': self.frames_scored,
+            'lines_skipped': self.lines_skipped,
+            'frames_failed': self.frames_failed,
+            'batches': self.batches,
+            'mean_batch_size': round(self.frames_scored / self.batches, 1) if self.batches else 0.0,
+            'scoring_s': round(self.scoring_seconds, 3),
+            # Over the time spent scoring batches; idle time between frames does not count.
+            'throughput_fps': round(self.frames_scored / self.scoring_seconds, 1) if self.scoring_seconds else 0.0,
+            'latency_p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 3),
+            'latency_p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 3),
+        }
+
+
+class _Connection:
+    """Stream state and pending answers of one client."""
+
+    def __init__(self, service, writer):
+        self.writer = writer
+        self.extractor = StreamingFeatureExtractor(service.normal_stats, **service.feature_params)
+        self.interfaces = {}
+        self.arrivals = deque()
+        self.outstanding = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+
+class InferenceService:
+    """Micro-batching scorer around an XGBoost booster."""
+
+    def __init__(self, booster, normal_stats=None, batch_size=1024, max_delay=0.005, **feature_params):
+        self.booster = booster
+        self.normal_stats = normal_stats
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.feature_params = feature_params
+        self.metrics = ServiceMetrics()
+        self._queue = None
+
+    @classmethod
+    def from_model(cls, model_path, **options):
+        """Load the booster and, when present, the normal-stats table saved next to it (see ``load_model``)."""
+        return cls(*load_model(model_path), **options)
+
+    async def serve(self, host='127.0.0.1', port=8765, unix_path=None):
+        self._queue = asyncio.Queue()
+        batcher = asyncio.create_task(self._batch_loop())
+        if unix_path:
+            server = await asyncio.start_unix_server(self._handle, path=unix_path)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+        print(f"Serving on {unix_path or f'{host}:{port}'} "
+              f"(batch_size={self.batch_size}, max_delay={self.max_delay * 1000:g} ms)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+    async def _handle(self, reader, writer):
+        connection = _Connection(self, writer)
+        self.metrics.connections += 1
+        carried = b''
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                data = carried + data
+                cut = data.rfind(b'\n') + 1
+                carried = data[cut:]
+                await self._receive(connection, data[:cut])
+            if carried:
+                await self._receive(connection, carried + b'\n')
+            # End of input ends the capture: answer every frame still held.
+            self._enqueue(connection, connection.extractor.flush())
+            await connection.idle.wait()
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _receive(self, connection, block):
+        """Handle a block of complete lines, running commands in order."""
+        if not block.startswith(b'#') and b'\n#' not in block:
+            self._push(connection, block)
+            return
+        lines = block.split(b'\n')
+        frames_start = 0
+        for index, line in enumerate(lines):
+            if line.startswith(b'#'):
+                self._push(connection, b'\n'.join(lines[frames_start:index]) + b'\n')
+                frames_start = index + 1
+                await self._command(connection, line.strip().decode('ascii', 'replace'))
+        self._push(connection, b'\n'.join(lines[frames_start:]))
+
+    def _push(self, connection, block):
+        result = parse_can_bytes(block, connection.interfaces)
+        if not result.lines:
+            return
+        arrival = time.perf_counter()
+        try:
+            rows = connection.extractor.push_frames(result.frames)
+        except ValueError as error:
+            # Out-of-order frames: the extractor took none of the block.
+            self.metrics.lines_skipped += result.lines
+            connection.writer.write(f'#error {error}\n'.encode())
+            return
+        self.metrics.frames_received += len(result.frames)
+        self.metrics.lines_skipped += result.skipped
+        connection.arrivals.extend([arrival] * len(result.frames))
+        self._enqueue(connection, rows)
+
+    def _enqueue(self, connection, rows):
+        if not rows:
+            return
+        arrivals = [connection.arrivals.popleft() for _ in rows]
+        connection.outstanding += len(rows)
+        connection.idle.clear()
+        self._queue.put_nowait((connection, rows, arrivals))
+
+    async def _command(self, connection, command):
+        if command == '#flush':
+            self._enqueue(connection, connection.extractor.flush())
+            await connection.idle.wait()
+            connection.writer.write(b'#flushed\n')
+        elif command == '#stats':
+            connection.writer.write(json.dumps(self.metrics.to_dict()).encode() + b'\n')
+        else:
+            connection.writer.write(f'#error unknown command {command}\n'.encode())
+        await connection.writer.drain()
+
+    async def _batch_loop(self):
+        queue = self._queue
+        while True:
+            items = [await queue.get()]
+            size = len(items[0][1])
+            deadline = time.perf_counter() + self.max_delay
+            while size < self.batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 and queue.empty():
+                    break
+                try:
+                    item = queue.get_nowait() if not queue.empty() else await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                items.append(item)
+                size += len(item[1])
+            try:
+                answers = self._score(items)
+            except Exception as error:
+                # A failed batch must not stop the batcher or leave #flush waiting.
+                print(f"Scoring a batch of {size} frames failed: {error!r}")
+                self.metrics.frames_failed += size
+                answers = [f'#error scoring {len(rows)} frames failed: {error}\n' for _, rows, _ in items]
+            for (connection, rows, _), answer in zip(items, answers):
+                connection.writer.write(answer.encode())
+                connection.outstanding -= len(rows)
+                if connection.outstanding == 0:
+                    connection.idle.set()
+
+    def _score(self, items):
+        """The answer text of every item of a batch."""
+        start = time.perf_counter()
+        features = np.array([row[4] for _, rows, _ in items for row in rows], dtype=np.float32)
+        labels = self.booster.inplace_predict(features).argmax(axis=1).tolist()
+        answers = []
+        position = 0
+        for _, rows, _ in items:
+            can_ids = format_can_ids([row[1] for row in rows]).tolist()
+            answers.append(''.join(
+                f'{row[0]:.6f} {can_id} {label}\n'
+                for row, can_id, label in zip(rows, can_ids, labels[position:position + len(rows)])
+            ))
+            position += len(rows)
+        done = time.perf_counter()
+        self.metrics.batches += 1
+        self.metrics.frames_scored += len(labels)
+        self.metrics.scoring_seconds += done - start
+        for _, _, arrivals in items:
+            self.metrics.latencies.extend(done - arrival for arrival in arrivals)
+        return answers
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score candump lines sent over a local socket.')
+    parser.add_argument('--model', required=True, help='XGBoost model JSON or compiled .trees.npz (normal_stats.npz is read next to it)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='serve on this Unix socket path instead of TCP')
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--max-delay-ms', type=float, default=5.0)
+    parser.add_argument('--total-can-ids', type=int, help='CAN ID count for Suspension_Indicator')
+    args = parser.parse_args()
+
+    service = InferenceService.from_model(
+        args.model, batch_size=args.batch_size, max_delay=args.max_delay_ms / 1000,
+        total_can_ids=args.total_can_ids,
+    )
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        print(json.dumps(service.metrics.to_dict()))
+
+
+if __name__ == '__main__':
+    main()
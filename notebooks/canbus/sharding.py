@@ -0,0 +1,169 @@
+"""Multi-process feature extraction over byte-range shards of candump logs.
+
+A log is cut into shards at line boundaries and processed in two parallel
+passes with a cheap serial step in between:
+
+1. Each worker parses its shard, computes the payload features and the
+   inter-arrivals it can see, leaving the first frame of every CAN ID
+   open, and reports the last timestamp of each ID.
+2. The parent walks the shards in order and fills in those first
+   inter-arrivals from the previous shards' last timestamps.
+3. Each worker computes the window counts and Suspension_Indicator for
+   its rows from a slice that extends ``HALO`` seconds plus the window
+   sizes past both shard edges, with the CAN ID count of the whole log.
+
+Every row therefore sees exactly the frames it would in one serial pass,
+and the result equals ``compute_features`` on the whole log. This needs a
+log whose timestamps never decrease across the file, which candump
+writes; anything else is handled by the serial path.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .features import (
+    FIRST_INTER_ARRIVAL,
+    MAX_ENTROPY,
+    MAX_PAYLOAD_DECIMAL,
+    compute_features,
+    inter_arrivals,
+    suspension_indicator,
+    window_counts,
+)
+from .frames import CanFrames
+from .parser import parse_can_log
+from .payload import payload_features
+
+# Extra seconds of neighbouring frames given to each shard; any margin
+# works since frames outside a row's windows never change its features.
+HALO = 1.0
+MIN_SHARD_BYTES = 1 << 20
+
+
+def shard_ranges(path, shards):
+    """Up to ``shards`` ``(start, end)`` byte ranges of a file, cut after newlines."""
+    size = os.path.getsize(path)
+    cuts = [0]
+    with open(path, 'rb') as log_file:
+        for index in range(1, shards):
+            position = size * index // shards
+            if position <= cuts[-1]:
+                continue
+            # The line holding byte position - 1 ends the previous shard.
+            log_file.seek(position - 1)
+            cut = position - 1 + len(log_file.readline())
+            if cuts[-1] < cut < size:
+                cuts.append(cut)
+    cuts.append(size)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def _parse_shard(path, start, end):
+    parsed = parse_can_log(path, start=start, end=end)
+    frames = parsed.frames
+    entropy, _ = payload_features(frames.payload, frames.dlc)
+    gaps = inter_arrivals(frames.timestamp, frames.can_id, first=np.nan)
+    # Last frame of each ID: the first of each in reversed order.
+    reversed_ids = frames.can_id[::-1]
+    last_ids, last_positions = np.unique(reversed_ids, return_index=True)
+    last_times = frames.timestamp[::-1][last_positions]
+    return parsed, entropy, gaps, last_ids, last_times
+
+
+def _shard_windows(timestamps, can_ids, gaps, core, window_size, threshold, suspension_window, total_can_ids):
+    counts = window_counts(timestamps, can_ids, (window_size,))[window_size]
+    indicators = suspension_indicator(timestamps, can_ids, gaps, threshold, suspension_window, total_can_ids)
+    return counts[core[0]:core[1]], indicators[core[0]:core[1]]
+
+
+def _is_ordered(timestamps):
+    return len(timestamps) < 2 or bool((timestamps[1:] >= timestamps[:-1]).all())
+
+
+def _frames_dataframe(frames, gaps, counts, entropy, suspension):
+    """The table ``compute_features`` returns, from already computed columns."""
+    df = frames.to_dataframe(compact=True)
+    df['CAN_ID_Inter_Arrival'] = gaps
+    df['CAN_ID_Window_Count'] = counts
+    df['Payload_Entropy'] = entropy
+    df['Payload_Decimal'] = frames.payload.copy()
+    df['Norm_Payload_Decimal'] = frames.payload.astype(np.float64) / float(MAX_PAYLOAD_DECIMAL)
+    df['Norm_Payload_Entropy'] = df['Payload_Entropy'] / MAX_ENTROPY
+    df['Suspension_Indicator'] = suspension
+    return df
+
+
+def parallel_features_for_logs(log_paths, workers=None, window_size=5.0, threshold=2.0, suspension_window=0.5):
+    """``compute_features`` for several logs, sharing one process pool.
+
+    Returns a dict mapping each path to its feature DataFrame.
+    """
+    workers = workers or os.cpu_count() or 1
+    log_paths = list(log_paths)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Pass 1: parse every shard of every log.
+        parsing = {}
+        for path in log_paths:
+            shards = max(1, min(2 * workers, os.path.getsize(path) // MIN_SHARD_BYTES))
+            parsing[path] = [pool.submit(_parse_shard, path, start, end) for start, end in shard_ranges(path, shards)]
+
+        windowing = {}
+        for path in log_paths:
+            shards = [future.result() for future in parsing[path]]
+            frames = CanFrames.concatenate([shard[0].frames for shard in shards])
+            lines = sum(shard[0].lines for shard in shards)
+            skipped = sum(shard[0].skipped for shard in shards)
+            print(f"{path}: parsed {lines} lines in {len(shards)} shards, skipped {skipped} malformed lines.")
+            timestamps = frames.timestamp
+            if not _is_ordered(timestamps):
+                print(f"{path}: timestamps go backwards, computing features serially.")
+                results[path] = compute_features(frames.to_dataframe(compact=True), window_size, threshold, suspension_window)
+                continue
+
+            # Fill each shard's open first inter-arrivals from earlier shards.
+            last_seen = {}
+            shard_gaps = []
+            for parsed, _, gaps, last_ids, last_times in shards:
+                open_rows = np.flatnonzero(np.isnan(gaps))
+                previous = [last_seen.get(can_id) for can_id in parsed.frames.can_id[open_rows].tolist()]
+                gaps[open_rows] = [
+                    timestamp - last if last is not None else FIRST_INTER_ARRIVAL
+                    for timestamp, last in zip(parsed.frames.timestamp[open_rows].tolist(), previous)
+                ]
+                last_seen.update(zip(last_ids.tolist(), last_times.tolist()))
+                shard_gaps.append(gaps)
+            gaps = np.concatenate(shard_gaps) if shard_gaps else np.empty(0)
+            entropy = np.concatenate([shard[1] for shard in shards]) if shards else np.empty(0)
+            total_can_ids = len(last_seen)
+
+            # Pass 2: windowed features with a halo around every shard.
+            reach = max(window_size, suspension_window) + suspension_window + HALO
+            futures = []
+            offset = 0
+            for parsed, *_ in shards:
+                low, high = offset, offset + len(parsed.frames)
+                offset = high
+                if low == high:
+                    continue
+                first = np.searchsorted(timestamps, timestamps[low] - reach, side='left')
+                last = np.searchsorted(timestamps, timestamps[high - 1] + reach, side='right')
+                futures.append(pool.submit(
+                    _shard_windows, timestamps[first:last], frames.can_id[first:last], gaps[first:last],
+                    (low - first, high - first), window_size, threshold, suspension_window, total_can_ids,
+                ))
+            windowing[path] = (frames, gaps, entropy, futures)
+
+        for path, (frames, gaps, entropy, futures) in windowing.items():
+            parts = [future.result() for future in futures]
+            counts = np.concatenate([part[0] for part in parts]) if parts else np.empty(0, dtype=np.int64)
+            suspension = np.concatenate([part[1] for part in parts]) if parts else np.empty(0)
+            results[path] = _frames_dataframe(frames, gaps, counts, entropy, suspension)
+    return {path: results[path] for path in log_paths}
+
+
+def parallel_features(log_path, workers=None, **params):
+    """``compute_features`` for one log using ``workers`` processes."""
+    return parallel_features_for_logs([log_path], workers, **params)[log_path]
@@ -0,0 +1,191 @@
+"""On-disk columnar cache for feature tables.
+
+Each table is a directory of ``.npy`` files, one per column, plus a
+``meta.json`` describing them. Numeric columns, which include ``CAN_ID``
+and ``Payload`` of the compact frame tables, are stored in the smallest
+integer type that holds them (floats as they are); string and categorical
+columns such as ``Interface`` are stored as integer codes into a table of
+their distinct values. ``load`` memory-maps the files, so reading a cached
+table costs no parsing and no copy.
+
+Tables are keyed by a hash of the source log's bytes and the parameters
+that produced them (``feature_key``), so a changed capture or a different
+window size misses the cache instead of returning stale features.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .features import compute_features
+from .parser import CHUNK_SIZE, parse_can_log
+from .sharding import parallel_features
+
+# Bump when the stored layout or the feature definitions change.
+FEATURE_STORE_VERSION = 2
+DEFAULT_STORE_ROOT = Path(__file__).resolve().parents[2] / 'dataSet' / 'features'
+# Parameters of compute_features, shared by the notebooks' cache keys.
+DEFAULT_FEATURE_PARAMS = {'window_size': 5.0, 'threshold': 2.0, 'suspension_window': 0.5}
+
+_META_FILE = 'meta.json'
+_digests = {}
+
+
+def source_digest(path):
+    """BLAKE2b hex digest of a file's contents, remembered per size and mtime."""
+    stat = os.stat(path)
+    signature = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if signature not in _digests:
+        digest = hashlib.blake2b(digest_size=20)
+        with open(path, 'rb') as source:
+            while True:
+                block = source.read(CHUNK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+        _digests[signature] = digest.hexdigest()
+    return _digests[signature]
+
+
+def feature_key(source_path, stage='features', **params):
+    """Cache key for the table ``stage`` built from ``source_path`` with ``params``."""
+    description = json.dumps({
+        'version': FEATURE_STORE_VERSION,
+        'source': source_digest(source_path),
+        'stage': stage,
+        'params': params,
+    }, sort_keys=True)
+    return f"{stage}-{hashlib.blake2b(description.encode(), digest_size=16).hexdigest()}"
+
+
+def _compact_integers(values):
+    """Smallest integer dtype holding every value (the array itself if empty)."""
+    if len(values) == 0:
+        return values
+    low, high = values.min(), values.max()
+    for dtype in (np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return values.astype(dtype)
+    return values
+
+
+class FeatureStore:
+    """Directory of cached tables, one subdirectory per key."""
+
+    def __init__(self, root=DEFAULT_STORE_ROOT):
+        self.root = Path(root)
+
+    def path(self, key):
+        return self.root / key
+
+    def __contains__(self, key):
+        return (self.path(key) / _META_FILE).is_file()
+
+    def save(self, key, df, **info):
+        """Write a DataFrame under ``key``; extra ``info`` is kept in the metadata."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=f'.{key}-', dir=self.root))
+        columns = []
+        for index, (name, series) in enumerate(df.items()):
+            entry = {'name': name, 'file': f'{index}.npy', 'dtype': str(series.dtype)}
+            values = series.to_numpy()
+            if values.dtype.kind in 'biuf':
+                stored = _compact_integers(values) if values.dtype.kind in 'iu' else values
+            else:
+                codes, uniques = pd.factorize(series)
+                if (codes < 0).any() or not all(isinstance(value, str) for value in uniques):
+                    raise ValueError(f"Column {name!r} must be numeric or hold only strings.")
+                stored = _compact_integers(codes)
+                entry['values'] = f'{index}.values.npy'
+                try:
+                    # Hex IDs and payloads fit in one byte per character.
+                    values = np.array(uniques, dtype=bytes)
+                except UnicodeEncodeError:
+                    values = np.array(uniques, dtype=str)
+                np.save(staging / entry['values'], values)
+            np.save(staging / entry['file'], np.ascontiguousarray(stored))
+            columns.append(entry)
+        meta = {'version': FEATURE_STORE_VERSION, 'key': key, 'rows': len(df), 'columns': columns, 'info': info}
+        with open(staging / _META_FILE, 'w') as meta_file:
+            json.dump(meta, meta_file, indent=1)
+        # Publish in one rename so readers never see a half-written table.
+        target = self.path(key)
+        if target.exists():
+            shutil.rmtree(target)
+        os.replace(staging, target)
+        return target
+
+    def meta(self, key):
+        with open(self.path(key) / _META_FILE) as meta_file:
+            return json.load(meta_file)
+
+    def load(self, key, columns=None):
+        """Memory-mapped stored arrays by column name.
+
+        String columns come back as ``(codes, values)`` pairs; everything
+        else in its compact stored dtype.
+        """
+        directory = self.path(key)
+        arrays = {}
+        for entry in self.meta(key)['columns']:
+            if columns is not None and entry['name'] not in columns:
+                continue
+            stored = np.load(directory / entry['file'], mmap_mode='r')
+            if 'values' in entry:
+                stored = (stored, np.load(directory / entry['values']))
+            arrays[entry['name']] = stored
+        return arrays
+
+    def load_dataframe(self, key, columns=None):
+        """The saved DataFrame with its original column dtypes."""
+        arrays = self.load(key, columns)
+        data = {}
+        for entry in self.meta(key)['columns']:
+            name = entry['name']
+            if name not in arrays:
+                continue
+            if 'values' in entry:
+                codes, values = arrays[name]
+                if values.dtype.kind == 'S':
+                    values = np.char.decode(values, 'ascii')
+                if entry['dtype'] == 'category':
+                    data[name] = pd.Categorical.from_codes(np.asarray(codes, dtype=np.int64), values.astype(str))
+                else:
+                    data[name] = values.astype(object)[codes]
+            else:
+                data[name] = np.asarray(arrays[name]).astype(entry['dtype'])
+        return pd.DataFrame(data)
+
+    def remove(self, key):
+        shutil.rmtree(self.path(key), ignore_errors=True)
+
+
+def cached_features(log_path, store=None, workers=1, **params):
+    """``compute_features`` for a candump log, read from ``store`` when cached.
+
+    ``params`` default to ``DEFAULT_FEATURE_PARAMS``. With ``workers`` other
+    than 1 a cache miss is extracted by ``parallel_features`` (``None`` uses
+    every core); the stored table is the same either way.
+    """
+    store = FeatureStore() if store is None else store
+    params = {**DEFAULT_FEATURE_PARAMS, **params}
+    key = feature_key(log_path, **params)
+    if key in store:
+        print(f"Loaded cached features {key}.")
+        return store.load_dataframe(key)
+    if workers == 1:
+        parsed = parse_can_log(log_path)
+        print(f"Parsed {parsed.lines} lines, skipped {parsed.skipped} malformed lines.")
+        df = compute_features(parsed.frames.to_dataframe(compact=True), **params)
+    else:
+        df = parallel_features(log_path, workers, **params)
+    store.save(key, df, source=str(log_path), params=params)
+    print(f"Cached features as {key}.")
+    return df
@@ -0,0 +1,170 @@
+"""Incremental feature extraction for live CAN traffic.
+
+``StreamingFeatureExtractor`` takes frames one at a time (or a parsed block)
+in timestamp order and emits the same eight model features the batch path
+produces, keeping only per-CAN-ID state and the frames of the last few
+seconds. Each frame costs amortized constant time.
+
+The Suspension_Indicator looks ``suspension_window`` seconds into the
+future, so a frame is emitted once a later frame shows that its window has
+closed; ``flush()`` emits whatever is left at the end of a capture.
+"""
+
+from collections import deque
+
+import numpy as np
+
+from .features import (
+    FIRST_INTER_ARRIVAL,
+    MAX_ENTROPY,
+    MAX_PAYLOAD_DECIMAL,
+)
+from .normal_stats import NormalStats
+from .payload import payload_entropy
+
+# Indices into a pending row.
+_TIMESTAMP, _CAN_ID, _PAYLOAD, _DLC, _INTER_ARRIVAL, _WINDOW_COUNT, _ENTROPY = range(7)
+
+
+class StreamingFeatureExtractor:
+    """Per-frame features from O(1) incremental state.
+
+    ``normal_stats`` is a ``NormalStats`` or the table built in
+    model_training.ipynb (``CAN_ID``, ``Mean_Inter_Arrival``,
+    ``Mean_Window_Count``); IDs missing from it get normalized values of 1.0. The indicator divides by ``total_can_ids``
+    when given, otherwise by the number of CAN IDs seen so far.
+
+    ``push`` and ``flush`` return emitted rows as
+    ``(timestamp, can_id, payload, dlc, features)`` tuples, with ``can_id``
+    and ``payload`` as integers (see ``CanFrames``) and ``features`` ordered
+    like ``FEATURE_COLUMNS``.
+    """
+
+    def __init__(self, normal_stats=None, window_size=5.0, threshold=2.0,
+                 suspension_window=0.5, total_can_ids=None):
+        self.window_size = window_size
+        self.threshold = threshold
+        self.suspension_window = suspension_window
+        self.total_can_ids = total_can_ids
+        self._normal = {}
+        if normal_stats is not None:
+            if not isinstance(normal_stats, NormalStats):
+                normal_stats = NormalStats.from_frame(normal_stats)
+            self._normal = dict(zip(
+                normal_stats.can_ids.tolist(),
+                zip(normal_stats.mean_inter_arrival.tolist(), normal_stats.mean_window_count.tolist()),
+            ))
+        # CAN ID -> [last timestamp, timestamps inside the count window,
+        #            pending rows sharing the last timestamp]
+        self._ids = {}
+        self._pending = deque()
+        # Large-gap frames not yet inside the window of the next row to emit,
+        # those inside it, and how many of the latter each CAN ID has.
+        self._upcoming_gaps = deque()
+        self._active_gaps = deque()
+        self._gap_ids = {}
+        self._last_timestamp = float('-inf')
+
+    def push(self, timestamp, can_id, payload, dlc):
+        """Add one frame; returns the rows whose features are now final."""
+        if timestamp < self._last_timestamp:
+            raise ValueError(f"Frame at {timestamp} arrived after {self._last_timestamp}; frames must be in timestamp order.")
+        self._last_timestamp = timestamp
+        emitted = []
+        pending = self._pending
+        while pending and pending[0][_TIMESTAMP] + self.suspension_window < timestamp:
+            emitted.append(self._emit(pending.popleft()))
+
+        state = self._ids.get(can_id)
+        if state is None:
+            inter_arrival = FIRST_INTER_ARRIVAL
+            state = self._ids[can_id] = [timestamp, deque(), []]
+        else:
+            inter_arrival = timestamp - state[0]
+            state[0] = timestamp
+        window = state[1]
+        window_start = timestamp - self.window_size
+        while window and window[0] < window_start:
+            window.popleft()
+        window.append(timestamp)
+        window_count = len(window)
+
+        row = [timestamp, can_id, payload, dlc, inter_arrival, window_count,
+               payload_entropy(payload, dlc)]
+        # Frames of this ID sharing the timestamp all count each other.
+        ties = state[2]
+        if ties and ties[0][_TIMESTAMP] == timestamp:
+            for tie in ties:
+                tie[_WINDOW_COUNT] = window_count
+            ties.append(row)
+        else:
+            state[2] = [row]
+
+        if inter_arrival > self.threshold:
+            self._upcoming_gaps.append((timestamp, can_id))
+        pending.append(row)
+        return emitted
+
+    def push_frames(self, frames):
+        """Push every frame of a ``CanFrames`` block.
+
+        Out-of-order timestamps raise ``ValueError`` before any frame of the
+        block is pushed, so the extractor is left as it was.
+        """
+        timestamps = frames.timestamp
+        previous = np.concatenate(([self._last_timestamp], timestamps[:-1]))
+        late = np.flatnonzero(timestamps < previous)
+        if len(late):
+            raise ValueError(f"Frame at {timestamps[late[0]]} arrived after {previous[late[0]]}; "
+                             "frames must be in timestamp order.")
+        emitted = []
+        for frame in zip(frames.timestamp.tolist(), frames.can_id.tolist(),
+                         frames.payload.tolist(), frames.dlc.tolist()):
+            emitted.extend(self.push(*frame))
+        return emitted
+
+    def flush(self):
+        """Emit every pending row, treating the stream as finished."""
+        emitted = [self._emit(row) for row in self._pending]
+        self._pending.clear()
+        return emitted
+
+    def _emit(self, row):
+        timestamp = row[_TIMESTAMP]
+        upcoming, active, gap_ids = self._upcoming_gaps, self._active_gaps, self._gap_ids
+        window_end = timestamp + self.suspension_window
+        while upcoming and upcoming[0][0] <= window_end:
+            gap = upcoming.popleft()
+            active.append(gap)
+            gap_ids[gap[1]] = gap_ids.get(gap[1], 0) + 1
+        window_start = timestamp - self.suspension_window
+        while active and active[0][0] < window_start:
+            gap_id = active.popleft()[1]
+            if gap_ids[gap_id] == 1:
+                del gap_ids[gap_id]
+            else:
+                gap_ids[gap_id] -= 1
+        total_can_ids = self.total_can_ids or len(self._ids)
+        suspension_indicator = len(gap_ids) / total_can_ids
+
+        inter_arrival = row[_INTER_ARRIVAL]
+        window_count = row[_WINDOW_COUNT]
+        entropy = row[_ENTROPY]
+        normal = self._normal.get(row[_CAN_ID])
+        if normal is None:
+            norm_inter_arrival = norm_window_count = 1.0
+        else:
+            mean_inter_arrival, mean_window_count = normal
+            norm_inter_arrival = inter_arrival / mean_inter_arrival if mean_inter_arrival != 0 else 1.0
+            norm_window_count = window_count / mean_window_count if mean_window_count != 0 else 1.0
+        features = (
+            inter_arrival,
+            window_count,
+            entropy,
+            norm_inter_arrival,
+            norm_window_count,
+            entropy / MAX_ENTROPY,
+            float(row[_PAYLOAD]) / float(MAX_PAYLOAD_DECIMAL),
+            suspension_indicator,
+        )
+        return row[_TIMESTAMP], row[_CAN_ID], row[_PAYLOAD], row[_DLC], features
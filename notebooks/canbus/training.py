@@ -0,0 +1,378 @@
+"""Out-of-core XGBoost training from chunked feature tables.
+
+model_training.ipynb used to read the whole labeled table into pandas,
+copy it through two ``train_test_split`` calls and train 200 fixed rounds,
+never looking at its validation split. ``train_out_of_core`` instead reads
+the table ``chunk_rows`` rows at a time from a ``FeatureStore`` (memory
+mapped) or from CSV files, so the data never has to fit in RAM:
+
+1. one pass counts the labels of every split and accumulates the
+   per-CAN-ID normal-traffic ``TrafficStats`` (see ``canbus.baseline``);
+2. the training rows are streamed through an ``xgb.DataIter`` into an
+   ``ExtMemQuantileDMatrix`` (quantized pages cached on disk) or, with
+   ``external_memory=False`` or before xgboost 3.0, an in-memory
+   ``QuantileDMatrix``; the validation rows likewise, sharing the
+   training quantiles;
+3. ``hist`` boosting on all cores stops once the validation ``mlogloss``
+   has not improved for ``early_stopping_rounds`` rounds, and the model
+   is cut back to its best round;
+4. the test rows are streamed through the model into a confusion matrix.
+
+Rows are assigned to the train, validation and test splits (70/15/15, as
+the notebook's splits) by a hash of their position and ``seed``, so the
+split does not depend on the chunk size and needs no shuffle; every class
+is split in the same proportions on average. Training rows keep the
+notebook's class weights, ``n_samples / (n_classes * class_count)``, and
+validation rows get the same weights so early stopping follows the loss
+being minimized.
+
+External memory keeps the feature pages on disk, but xgboost still holds
+gradients and predictions for every training row in RAM. Above
+``max_train_rows`` the largest classes (normal traffic, in practice) are
+therefore subsampled by the same hash, and the kept rows are weighted up
+by the inverse rate, so each class keeps its total weight and peak memory
+stops growing with the dataset; the test split is always scored in full.
+
+The model, ``normal_stats.npz``, ``traffic_stats.npz`` and the compiled
+``.trees.npz`` are written next to each other, and a JSON report holds the stage timings, split sizes,
+validation curve and test scores. From the notebooks directory::
+
+    python -m canbus.training --store-key generated-... --model ../models/xgboost_model.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from .baseline import STATS_FEATURES, TrafficStats, merge_stats, traffic_stats_path
+from .features import FEATURE_COLUMNS
+from .frames import parse_can_ids
+from .metrics import DETAIL, SUMMARY, Metrics
+from .normal_stats import normal_stats_path
+from .store import FeatureStore
+from .trees import CompiledTrees, trees_path
+
+LABEL_NAMES = ['Normal', 'DoS', 'Fuzzing', 'Suspension']
+TRAIN, VALIDATION, TEST = 0, 1, 2
+SPLIT_NAMES = ['train', 'validation', 'test']
+CHUNK_ROWS = 1 << 20
+TEST_SIZE = 0.15
+VALIDATION_SIZE = 0.15
+MAX_ROUNDS = 1000
+EARLY_STOPPING_ROUNDS = 20
+MAX_BIN = 256
+# Training rows kept in memory: xgboost holds gradients and predictions for
+# every row (about 65 bytes each with four classes) even with external memory.
+MAX_TRAIN_ROWS = 10_000_000
+# The notebook's XGBClassifier settings.
+DEFAULT_PARAMS = {
+    'objective': 'multi:softprob',
+    'num_class': len(LABEL_NAMES),
+    'max_depth': 6,
+    'eta': 0.1,
+    'eval_metric': 'mlogloss',
+    'tree_method': 'hist',
+    'seed': 42,
+}
+REPORT_FILENAME = 'training_report.json'
+_STATS_COLUMNS = [FEATURE_COLUMNS.index(name) for name in STATS_FEATURES]
+
+
+def store_chunks(store, keys, chunk_rows=CHUNK_ROWS):
+    """Chunk source over cached tables: ``(features, labels, can_ids)`` per chunk.
+
+    Returns a function that starts a new pass over ``keys`` each time it
+    is called; columns are sliced from the memory-mapped files.
+    """
+    keys = [keys] if isinstance(keys, str) else list(keys)
+
+    def chunks():
+        for key in keys:
+            arrays = store.load(key, FEATURE_COLUMNS + ['Label', 'CAN_ID'])
+            if isinstance(arrays['CAN_ID'], tuple):
+                # Tables saved with candump ID strings.
+                codes, values = arrays['CAN_ID']
+                ids = parse_can_ids(np.char.decode(values, 'ascii') if values.dtype.kind == 'S' else values)
+            else:
+                codes, ids = arrays['CAN_ID'], None
+            rows = store.meta(key)['rows']
+            for start in range(0, rows, chunk_rows):
+                stop = min(start + chunk_rows, rows)
+                features = np.empty((stop - start, len(FEATURE_COLUMNS)), dtype=np.float32)
+                for column, name in enumerate(FEATURE_COLUMNS):
+                    features[:, column] = arrays[name][start:stop]
+                can_ids = codes[start:stop].astype(np.uint32) if ids is None else ids[codes[start:stop]]
+                yield features, np.asarray(arrays['Label'][start:stop], dtype=np.int32), can_ids
+    return chunks
+
+
+def csv_chunks(paths, chunk_rows=CHUNK_ROWS):
+    """Chunk source over labeled CSV exports such as ``generated.csv``."""
+    paths = [paths] if isinstance(paths, (str, os.PathLike)) else list(paths)
+
+    def chunks():
+        for path in paths:
+            reader = pd.read_csv(path, usecols=FEATURE_COLUMNS + ['Label', 'CAN_ID'], dtype={'CAN_ID': str},
+                                 chunksize=chunk_rows)
+            for df in reader:
+                yield (df[FEATURE_COLUMNS].to_numpy(dtype=np.float32), df['Label'].to_numpy(dtype=np.int32),
+                       parse_can_ids(df['CAN_ID'].to_numpy()))
+    return chunks
+
+
+def split_rows(start, count, seed=0, test_size=TEST_SIZE, validation_size=VALIDATION_SIZE):
+    """``(splits, draws)`` for rows ``start .. start + count``.
+
+    A splitmix64 hash of the row position and ``seed`` gives each row a
+    uniform draw, so a row's split does not depend on how it was chunked.
+    ``splits`` holds ``TRAIN``, ``VALIDATION`` or ``TEST``; ``draws`` is the
+    draw rescaled to [0, 1) within the row's split, used for subsampling.
+    """
+    state = np.arange(start, start + count, dtype=np.uint64)
+    state += np.full(1, seed, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    state ^= state >> np.uint64(30)
+    state *= np.uint64(0xBF58476D1CE4E5B9)
+    state ^= state >> np.uint64(27)
+    state *= np.uint64(0x94D049BB133111EB)
+    state ^= state >> np.uint64(31)
+    uniform = (state >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+    splits = np.full(count, TRAIN, dtype=np.int8)
+    splits[uniform < test_size + validation_size] = VALIDATION
+    splits[uniform < test_size] = TEST
+    bounds = np.array([test_size + validation_size, test_size, 0.0])
+    widths = np.array([1 - test_size - validation_size, validation_size, test_size])
+    return splits, (uniform - bounds[splits]) / widths[splits]
+
+
+def _with_splits(chunks, seed):
+    start = 0
+    for features, labels, can_ids in chunks():
+        yield (features, labels, can_ids, *split_rows(start, len(labels), seed))
+        start += len(labels)
+
+
+def sampling_rates(train_counts, max_rows):
+    """Per-class share of training rows kept so that at most ``max_rows`` remain.
+
+    The largest classes are cut first, down to a common per-class cap;
+    classes under the cap are kept whole.
+    """
+    rates = np.ones(len(train_counts))
+    if max_rows is None or train_counts.sum() <= max_rows:
+        return rates
+    counts = np.sort(train_counts)
+    # Largest cap c with sum(min(count, c)) <= max_rows.
+    below = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    caps = (max_rows - below) / (len(counts) - np.arange(len(counts)))
+    cap = caps[np.searchsorted(caps <= counts, True)]
+    return np.minimum(1.0, cap / np.maximum(train_counts, 1))
+
+
+class ChunkIter(xgb.DataIter):
+    """Feeds the rows of one split, chunk by chunk, to a quantile DMatrix."""
+
+    def __init__(self, chunks, split, seed=0, class_weights=None, rates=None, cache_prefix=None):
+        self._chunks = chunks
+        self._split = split
+        self._seed = seed
+        self._class_weights = class_weights
+        self._rates = rates
+        self._iterator = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def reset(self):
+        self._iterator = None
+
+    def next(self, input_data):
+        if self._iterator is None:
+            self._iterator = _with_splits(self._chunks, self._seed)
+        for features, labels, _, splits, draws in self._iterator:
+            rows = splits == self._split
+            if self._rates is not None:
+                rows &= draws < self._rates[labels]
+            if not rows.any():
+                continue
+            labels = labels[rows]
+            weight = None if self._class_weights is None else self._class_weights[labels]
+            if self._rates is not None:
+                # Kept rows stand for the ones sampled away.
+                weight = (1.0 if weight is None else weight) / self._rates[labels]
+            input_data(data=features[rows], label=labels, weight=weight, feature_names=FEATURE_COLUMNS)
+            return True
+        return False
+
+
+def _scan(chunks, seed, num_class):
+    """Label counts per split and the ``TrafficStats`` of the normal rows."""
+    counts = np.zeros((len(SPLIT_NAMES), num_class), dtype=np.int64)
+    parts = []
+    for features, labels, can_ids, splits, _ in _with_splits(chunks, seed):
+        counts += np.bincount(splits.astype(np.int64) * num_class + labels,
+                              minlength=counts.size).reshape(counts.shape)
+        normal = labels == 0
+        parts.append(TrafficStats.from_arrays(can_ids[normal], features[normal][:, _STATS_COLUMNS]))
+    return counts, merge_stats(parts)
+
+
+def class_weights(train_counts):
+    """The notebook's ``n_samples / (n_classes * count)``, counting absent classes once."""
+    present = int((train_counts > 0).sum())
+    return (train_counts.sum() / (present * np.maximum(train_counts, 1))).astype(np.float32)
+
+
+def _scores(confusion):
+    """Accuracy and per-class precision, recall and F1 from a confusion matrix."""
+    true_positive = np.diag(confusion).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.nan_to_num(true_positive / confusion.sum(axis=0))
+        recall = np.nan_to_num(true_positive / confusion.sum(axis=1))
+        f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+    return {
+        'accuracy': float(true_positive.sum() / max(confusion.sum(), 1)),
+        'confusion_matrix': confusion.tolist(),
+        'classes': {
+            name: {'precision': round(float(p), 6), 'recall': round(float(r), 6), 'f1': round(float(f), 6),
+                   'support': int(support)}
+            for name, p, r, f, support in zip(LABEL_NAMES, precision, recall, f1, confusion.sum(axis=1))
+        },
+    }
+
+
+def train_out_of_core(chunks, model_path, params=None, max_rounds=MAX_ROUNDS,
+                      early_stopping_rounds=EARLY_STOPPING_ROUNDS, seed=0, external_memory=True,
+                      max_train_rows=MAX_TRAIN_ROWS, max_bin=MAX_BIN, cache_dir=None, metrics=None, report_path=None):
+    """Train on a chunk source (``store_chunks`` or ``csv_chunks``); see the module docstring.
+
+    Returns the booster, cut back to its best round, and the report dict
+    written to ``report_path`` (``training_report.json`` next to the
+    model by default). ``max_train_rows=None`` trains on every row.
+    """
+    metrics = Metrics() if metrics is None else metrics
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    params.setdefault('nthread', os.cpu_count() or 1)
+    num_class = int(params['num_class'])
+    model_path = Path(model_path)
+    report_path = model_path.with_name(REPORT_FILENAME) if report_path is None else Path(report_path)
+
+    with metrics.stage('scan') as stage:
+        counts, traffic_stats = _scan(chunks, seed, num_class)
+        stage['frames'] = int(counts.sum())
+    for split, name in enumerate(SPLIT_NAMES):
+        for label in range(num_class):
+            metrics.count('labeled_frames', int(counts[split, label]), split=name, label=label)
+    weights = class_weights(counts[TRAIN])
+    rates = sampling_rates(counts[TRAIN], max_train_rows)
+    sampled = np.floor(counts[:VALIDATION + 1] * rates).astype(np.int64)
+    metrics.log(f"Split {', '.join(f'{name} {int(counts[split].sum()):,}' for split, name in enumerate(SPLIT_NAMES))} "
+                f"frames; class weights {[round(float(weight), 3) for weight in weights]}")
+    if (rates < 1).any():
+        metrics.log(f"Sampling {sampled[TRAIN].sum():,} training and {sampled[VALIDATION].sum():,} validation "
+                    f"frames (rates {[round(float(rate), 4) for rate in rates]})")
+
+    if external_memory and not hasattr(xgb, 'ExtMemQuantileDMatrix'):
+        # ExtMemQuantileDMatrix is new in xgboost 3.0 (requirements.txt pins 2.0.3).
+        metrics.log(f"xgboost {xgb.__version__} has no ExtMemQuantileDMatrix; building the matrices in memory")
+        external_memory = False
+    matrix = xgb.ExtMemQuantileDMatrix if external_memory else xgb.QuantileDMatrix
+    cache = tempfile.mkdtemp(prefix='xgb-cache-', dir=cache_dir)
+    try:
+        with metrics.stage('train_matrix', frames=int(counts[TRAIN].sum())):
+            # Only external memory caches pages, under the iterator's prefix.
+            train_iter = ChunkIter(chunks, TRAIN, seed, weights, rates,
+                                   os.path.join(cache, 'train') if external_memory else None)
+            dtrain = matrix(train_iter, max_bin=max_bin, nthread=params['nthread'])
+        with metrics.stage('validation_matrix', frames=int(counts[VALIDATION].sum())):
+            validation_iter = ChunkIter(chunks, VALIDATION, seed, weights, rates,
+                                        os.path.join(cache, 'validation') if external_memory else None)
+            dvalidation = matrix(validation_iter, max_bin=max_bin, ref=dtrain, nthread=params['nthread'])
+        history = {}
+        with metrics.stage('training', frames=int(sampled[TRAIN].sum())):
+            booster = xgb.train(params, dtrain, max_rounds, evals=[(dvalidation, 'validation')],
+                                early_stopping_rounds=early_stopping_rounds, evals_result=history,
+                                verbose_eval=metrics.verbosity >= DETAIL)
+        del dtrain, dvalidation, train_iter, validation_iter
+    finally:
+        shutil.rmtree(cache, ignore_errors=True)
+    rounds = booster.num_boosted_rounds()
+    best_iteration = booster.best_iteration
+    best_score = booster.best_score
+    booster = booster[:best_iteration + 1]
+    metrics.log(f"Stopped after {rounds} rounds; best round {best_iteration + 1} "
+                f"(validation {params['eval_metric']} {best_score:.6f})")
+
+    with metrics.stage('evaluate', frames=int(counts[TEST].sum())):
+        confusion = np.zeros((num_class, num_class), dtype=np.int64)
+        for features, labels, _, splits, _ in _with_splits(chunks, seed):
+            rows = splits == TEST
+            if rows.any():
+                predicted = booster.inplace_predict(features[rows]).argmax(axis=1)
+                confusion += np.bincount(labels[rows] * num_class + predicted,
+                                         minlength=num_class * num_class).reshape(num_class, num_class)
+
+    model_path.parent.mkdir(parents=True, exist_ok=True)
+    booster.save_model(model_path)
+    traffic_stats.normal_stats().save(normal_stats_path(model_path))
+    traffic_stats.save(traffic_stats_path(model_path))
+    CompiledTrees.from_json(model_path).save(trees_path(model_path))
+    metrics.log(f"Model, {len(traffic_stats)} CAN IDs of normal statistics and compiled trees saved next to {model_path}")
+
+    report = {
+        'model': str(model_path),
+        'params': params,
+        'external_memory': external_memory,
+        'rounds': rounds,
+        'best_iteration': best_iteration,
+        'best_score': best_score,
+        'validation_curve': history['validation'][params['eval_metric']],
+        'class_weights': weights.tolist(),
+        'sampling_rates': rates.tolist(),
+        'frames': {name: counts[split].tolist() for split, name in enumerate(SPLIT_NAMES)},
+        'test': _scores(confusion),
+        **metrics.to_dict(),
+    }
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'w') as output:
+        json.dump(report, output, indent=1)
+    metrics.log(f"Test accuracy {report['test']['accuracy']:.4f}; report saved to {report_path}")
+    return booster, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the XGBoost model out of core with early stopping.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--store-key', action='append', help='cached feature table (repeat for several)')
+    source.add_argument('--csv', action='append', help='labeled CSV export (repeat for several)')
+    parser.add_argument('--store-root', help='FeatureStore directory (default dataSet/features)')
+    parser.add_argument('--model', required=True, help='where to save the model JSON')
+    parser.add_argument('--report', help=f'JSON report (default {REPORT_FILENAME} next to the model)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--max-rounds', type=int, default=MAX_ROUNDS)
+    parser.add_argument('--early-stopping-rounds', type=int, default=EARLY_STOPPING_ROUNDS)
+    parser.add_argument('--max-train-rows', type=int, default=MAX_TRAIN_ROWS,
+                        help='subsample the largest classes above this many training rows (0 for no limit)')
+    parser.add_argument('--in-memory', action='store_true', help='QuantileDMatrix instead of external memory')
+    parser.add_argument('--cache-dir', help='directory for the external-memory pages (default: temp)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the train/validation/test split')
+    parser.add_argument('--verbose', action='store_true', help='print the validation loss every round')
+    args = parser.parse_args()
+
+    if args.store_key:
+        store = FeatureStore(args.store_root) if args.store_root else FeatureStore()
+        chunks = store_chunks(store, args.store_key, args.chunk_rows)
+    else:
+        chunks = csv_chunks(args.csv, args.chunk_rows)
+    train_out_of_core(chunks, args.model, max_rounds=args.max_rounds, early_stopping_rounds=args.early_stopping_rounds,
+                      seed=args.seed, external_memory=not args.in_memory, max_train_rows=args.max_train_rows or None,
+                      cache_dir=args.cache_dir,
+                      metrics=Metrics(DETAIL if args.verbose else SUMMARY), report_path=args.report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""XGBoost tree ensembles compiled to flat NumPy arrays for edge inference.
+
+``CompiledTrees.from_json`` reads a model saved with ``save_model`` (the
+JSON format) and lays every tree out as a complete binary tree of its own
+depth: split features, float32 thresholds and missing-value directions per
+internal node in heap order, and leaf values per leaf slot. Shallower
+branches are padded with splits whose leaves all repeat the branch's leaf
+value, so every row walks exactly ``depth`` levels of a tree and the next
+node is ``2 * node + 1 + goes_right``; no child arrays are needed. Trees are
+stored deepest first, so level ``k`` only touches the prefix of trees
+deeper than ``k``, and single-leaf trees are folded into the per-class
+bias.
+
+``predict_proba`` walks a batch of rows through all trees at once, one
+level at a time, with the comparison xgboost uses (``value < threshold``
+goes left, NaN takes the default direction in float32). It needs only
+NumPy, so a saved ``.trees.npz`` scores frames without importing xgboost,
+pandas or scikit-learn::
+
+    python -m canbus.trees --model ../models/xgboost_model.json
+
+writes ``../models/xgboost_model.trees.npz``.
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+
+TREES_SUFFIX = '.trees.npz'
+# Rows walked together; the rows x trees work arrays then stay in cache.
+BATCH_ROWS = 256
+OBJECTIVES = ('multi:softprob', 'multi:softmax', 'binary:logistic')
+
+
+def _parse_floats(text):
+    """``base_score`` is a number or, in newer models, a bracketed list of them."""
+    return [float(value) for value in str(text).strip('[]').split(',') if value.strip()]
+
+
+def _flatten(tree, depth, padded_depth):
+    """Heap-ordered ``(features, thresholds, default_left, leaves)`` of one tree."""
+    features = np.zeros(2 ** padded_depth - 1, dtype=np.int32)
+    thresholds = np.full(2 ** padded_depth - 1, np.inf, dtype=np.float32)
+    default_left = np.ones(2 ** padded_depth - 1, dtype=bool)
+    leaves = np.zeros(2 ** padded_depth, dtype=np.float32)
+    left, right = tree['left_children'], tree['right_children']
+    split_indices, conditions, defaults = tree['split_indices'], tree['split_conditions'], tree['default_left']
+    stack = [(0, 0, 0)]
+    while stack:
+        node, level, position = stack.pop()
+        if left[node] == -1:
+            # Every leaf slot under this heap position gets the leaf value.
+            span = 2 ** (depth - level)
+            leaves[position * span:(position + 1) * span] = conditions[node]
+            continue
+        heap = 2 ** level - 1 + position
+        features[heap] = split_indices[node]
+        thresholds[heap] = conditions[node]
+        default_left[heap] = bool(defaults[node])
+        stack.append((left[node], level + 1, 2 * position))
+        stack.append((right[node], level + 1, 2 * position + 1))
+    return features, thresholds, default_left, leaves
+
+
+def _depth(tree):
+    left, right = tree['left_children'], tree['right_children']
+    depths = {0: 0}
+    deepest = 0
+    for node in range(len(left)):
+        if left[node] != -1:
+            depths[left[node]] = depths[right[node]] = depths[node] + 1
+            deepest = max(deepest, depths[node] + 1)
+    return deepest
+
+
+class CompiledTrees:
+    """A boosted tree ensemble as flat arrays; see the module docstring.
+
+    For ``n`` non-constant trees of at most ``max_depth`` levels,
+    ``features``, ``thresholds`` and ``default_left`` are
+    ``(n, 2**max_depth - 1)``, ``leaves`` is ``(n, 2**max_depth)``, and
+    ``depths`` and ``tree_class`` are length ``n``, deepest tree first.
+    ``bias`` is the per-class margin of the base score and constant trees.
+    """
+
+    __slots__ = ('features', 'thresholds', 'default_left', 'leaves', 'depths', 'tree_class', 'bias',
+                 'objective', 'feature_names', '_level_trees')
+
+    def __init__(self, features, thresholds, default_left, leaves, depths, tree_class, bias, objective,
+                 feature_names=None):
+        if objective not in OBJECTIVES:
+            raise ValueError(f"Unsupported objective {objective!r}; expected one of {OBJECTIVES}.")
+        self.features = np.asarray(features, dtype=np.int32)
+        self.thresholds = np.asarray(thresholds, dtype=np.float32)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.leaves = np.asarray(leaves, dtype=np.float32)
+        self.depths = np.asarray(depths, dtype=np.int32)
+        self.tree_class = np.asarray(tree_class, dtype=np.int32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.objective = str(objective)
+        self.feature_names = None if feature_names is None else [str(name) for name in feature_names]
+        if (np.diff(self.depths) > 0).any():
+            raise ValueError("Trees must be ordered deepest first.")
+        # Number of trees still walking at each level.
+        self._level_trees = [int((self.depths > level).sum()) for level in range(self.max_depth)]
+
+    @property
+    def max_depth(self):
+        return int(self.depths[0]) if len(self.depths) else 0
+
+    @property
+    def num_class(self):
+        return len(self.bias)
+
+    def __len__(self):
+        return len(self.depths)
+
+    @classmethod
+    def from_json(cls, path, iteration_range=None):
+        """Compile an XGBoost JSON model.
+
+        ``iteration_range`` is ``(begin, end)`` boosting rounds as in
+        xgboost's ``predict``; by default the rounds up to the model's
+        ``best_iteration`` when it has one, as ``XGBClassifier`` uses.
+        """
+        with open(path) as model_file:
+            learner = json.load(model_file)['learner']
+        objective = learner['objective']['name']
+        if objective not in OBJECTIVES:
+            raise ValueError(f"Unsupported objective {objective!r}; expected one of {OBJECTIVES}.")
+        booster = learner['gradient_booster']
+        if booster['name'] != 'gbtree':
+            raise ValueError(f"Only gbtree models can be compiled, not {booster['name']!r}.")
+        model = booster['model']
+        num_class = max(int(learner['learner_model_param'].get('num_class', 0)), 1)
+        trees, tree_info = model['trees'], model['tree_info']
+        indptr = model.get('iteration_indptr') or list(range(0, len(trees) + 1, num_class))
+        if iteration_range is None:
+            best = learner.get('attributes', {}).get('best_iteration')
+            iteration_range = (0, int(best) + 1 if best is not None else len(indptr) - 1)
+        begin, end = iteration_range
+        selected = range(indptr[begin], indptr[min(end, len(indptr) - 1)])
+
+        base_score = _parse_floats(learner['learner_model_param']['base_score'])
+        bias = np.zeros(num_class, dtype=np.float64)
+        bias += base_score if len(base_score) == num_class else base_score[0]
+        if objective == 'binary:logistic':
+            # Stored as a probability; the margin starts at its logit.
+            bias = np.log(bias / (1 - bias))
+
+        kept = []
+        for index in selected:
+            tree = trees[index]
+            if any(tree.get('split_type', ())):
+                raise ValueError("Categorical splits cannot be compiled.")
+            depth = _depth(tree)
+            if depth == 0:
+                bias[tree_info[index]] += tree['split_conditions'][0]
+            else:
+                kept.append((depth, index))
+        kept.sort(key=lambda item: -item[0])
+        max_depth = kept[0][0] if kept else 0
+        if kept:
+            parts = [_flatten(trees[index], depth, max_depth) for depth, index in kept]
+            features, thresholds, default_left, leaves = (np.stack([part[field] for part in parts]) for field in range(4))
+        else:
+            features, thresholds, default_left, leaves = np.zeros((0, 0)), np.zeros((0, 0)), np.zeros((0, 0)), np.zeros((0, 1))
+        return cls(features, thresholds, default_left, leaves, [depth for depth, _ in kept],
+                   [tree_info[index] for _, index in kept], bias, objective, learner.get('feature_names'))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as table:
+            names = table['feature_names'].tolist() if 'feature_names' in table else None
+            return cls(table['features'], table['thresholds'], table['default_left'], table['leaves'],
+                       table['depths'], table['tree_class'], table['bias'], str(table['objective']), names)
+
+    def save(self, path):
+        # np.savez would append .npz to other suffixes; write through a handle.
+        arrays = {name: getattr(self, name) for name in
+                  ('features', 'thresholds', 'default_left', 'leaves', 'depths', 'tree_class', 'bias')}
+        if self.feature_names is not None:
+            arrays['feature_names'] = np.array(self.feature_names)
+        with open(path, 'wb') as handle:
+            np.savez(handle, objective=np.array(self.objective), **arrays)
+
+    def predict_margin(self, data, batch_rows=BATCH_ROWS):
+        """Raw per-class scores (``output_margin``) of a 2-D feature array."""
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        if data.ndim != 2:
+            raise ValueError(f"Expected a 2-D feature array, got shape {data.shape}.")
+        margins = np.empty((len(data), self.num_class), dtype=np.float32)
+        # Sums leaf values per class with one product per batch.
+        classes = np.zeros((len(self), self.num_class), dtype=np.float32)
+        classes[np.arange(len(self)), self.tree_class] = 1
+        for start in range(0, len(data), batch_rows):
+            rows = data[start:start + batch_rows]
+            margins[start:start + len(rows)] = self._leaf_values(rows) @ classes + self.bias
+        return margins
+
+    def _leaf_values(self, rows):
+        count, width = rows.shape
+        trees = len(self)
+        flat = rows.ravel()
+        missing = np.isnan(flat).any()
+        row_offsets = (np.arange(count, dtype=np.int32) * width)[:, None]
+        roots = (np.arange(trees, dtype=np.int32) * self.features.shape[1])[None, :]
+        features, thresholds, default_left = self.features.ravel(), self.thresholds.ravel(), self.default_left.ravel()
+        # Node of every (row, tree) as an index into the flattened node arrays,
+        # and work buffers reused across levels.
+        nodes = np.repeat(roots, count, axis=0)
+        offsets = np.empty((count, trees), dtype=np.int32)
+        values = np.empty((count, trees), dtype=np.float32)
+        limits = np.empty((count, trees), dtype=np.float32)
+        right = np.empty((count, trees), dtype=bool)
+        for active in self._level_trees:
+            node, offset, value, limit, goes_right = (
+                array[:, :active] for array in (nodes, offsets, values, limits, right))
+            np.take(features, node, out=offset)
+            offset += row_offsets
+            np.take(flat, offset, out=value)
+            np.take(thresholds, node, out=limit)
+            np.greater_equal(value, limit, out=goes_right)
+            if missing:
+                goes_right |= np.isnan(value) & ~default_left[node]
+            # Heap step h -> 2h + 1 + right, written on root + h.
+            node *= 2
+            node -= roots[:, :active]
+            node += goes_right
+            node += 1
+        # After d levels the heap index is 2**d - 1 + leaf slot.
+        slots = nodes - roots - (2 ** self.depths - 1)
+        return self.leaves.ravel()[slots + np.arange(trees, dtype=np.int32) * self.leaves.shape[1]]
+
+    def predict_proba(self, data, batch_rows=BATCH_ROWS):
+        """Class probabilities as ``XGBClassifier.predict_proba`` returns them."""
+        margins = self.predict_margin(data, batch_rows)
+        if self.objective == 'binary:logistic':
+            positive = 1 / (1 + np.exp(-margins[:, 0]))
+            return np.column_stack([1 - positive, positive])
+        margins -= margins.max(axis=1, keepdims=True)
+        np.exp(margins, out=margins)
+        margins /= margins.sum(axis=1, keepdims=True)
+        return margins
+
+    def predict(self, data, batch_rows=BATCH_ROWS):
+        """Predicted class of every row."""
+        return self.predict_proba(data, batch_rows).argmax(axis=1)
+
+    # Lets a CompiledTrees stand in for the booster of InferenceService.
+    inplace_predict = predict_proba
+
+
+def trees_path(model_path):
+    """Where the compiled ensemble of a model file is kept: ``<model>.trees.npz``."""
+    model_path = Path(model_path)
+    return model_path.with_name(model_path.stem + TREES_SUFFIX)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile an XGBoost JSON model to flat NumPy arrays.')
+    parser.add_argument('--model', required=True, help='XGBoost model saved as JSON')
+    parser.add_argument('--output', help='compiled .npz path (default: <model>.trees.npz)')
+    args = parser.parse_args()
+
+    compiled = CompiledTrees.from_json(args.model)
+    output = args.output or trees_path(args.model)
+    compiled.save(output)
+    print(f"{len(compiled)} trees of depth <= {compiled.max_depth}, {compiled.num_class} classes "
+          f"({Path(output).stat().st_size / 1024:.0f} KiB) saved to {output}")
+
+
+if __name__ == '__main__':
+    main()